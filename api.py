@@ -0,0 +1,134 @@
+"""JSON API（/api/v1/entries）の部品
+
+- fields=id,title,created_at で返す列を選ぶ。選ばれなかった列は load_only で
+  DB から読まない（本文が長くても一覧は軽い）。tags（名前のリスト）は選ばれた
+  ときだけ selectinload でまとめて引く
+- ETag は Entry の変更番号（counts.entries_version）・見ている人・引数から作る。
+  If-None-Match が一致すれば一覧の SQL も流さずに 304 を返す
+- 応答は orjson（無ければ json）で作り、Accept-Encoding に応じて brotli / gzip で
+  圧縮する（brotli は入っていれば）
+"""
+import gzip
+import hashlib
+import hmac
+import json
+
+from flask import abort, current_app, request
+from sqlalchemy.orm import load_only, selectinload
+
+from models import Entry
+
+# どちらも無くても動く（json / gzip だけになる）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FIELDS = {
+    "id": Entry.id,
+    "title": Entry.title,
+    "body": Entry.body,
+    "excerpt": Entry.excerpt,
+    "body_length": Entry.body_length,
+    "created_at": Entry.created_at,
+    "is_public": Entry.is_public,
+    "user_id": Entry.user_id,
+    "image_path": Entry.image_path,
+    "tags": Entry.tags,
+}
+LIST_FIELDS = ("id", "title", "created_at", "is_public")
+DETAIL_FIELDS = tuple(FIELDS)
+# これより小さい応答は圧縮しない
+COMPRESS_MIN_BYTES = 512
+
+
+def parse_fields(default):
+    """?fields= を検証して列名のタプルにする。未知の列は 400。"""
+    raw = request.args.get("fields", "")
+    if not raw:
+        return tuple(default)
+    names = tuple(dict.fromkeys(n.strip() for n in raw.split(",") if n.strip()))
+    unknown = [n for n in names if n not in FIELDS]
+    if unknown or not names:
+        abort(400, description=f"unknown fields: {','.join(unknown)}")
+    return names
+
+
+def load_fields(fields) -> list:
+    """返す列だけを読むオプション。カーソルに使う created_at と主キーは常に読む。"""
+    cols = {FIELDS[n] for n in fields if n != "tags"} | {Entry.created_at}
+    options = [load_only(*cols)]
+    if "tags" in fields:
+        options.append(selectinload(Entry.tags))
+    return options
+
+
+def serialize(e, fields) -> dict:
+    return {n: [t.name for t in e.tags] if n == "tags" else getattr(e, n)
+            for n in fields}
+
+
+def etag(*parts) -> str:
+    """弱い ETag（圧縮の有無で本文が変わっても同じ値）。SECRET_KEY で署名する。"""
+    key = current_app.config["SECRET_KEY"].encode()
+    return hmac.new(key, repr(parts).encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def not_modified(tag) -> bool:
+    return request.if_none_match.contains_weak(tag)
+
+
+def _dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, default=lambda o: o.isoformat(),
+                      separators=(",", ":")).encode()
+
+
+def _encoding(size):
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def response(payload, tag=None, status=200):
+    body = _dumps(payload)
+    headers = {"Vary": "Accept-Encoding, Cookie"}
+    coding = _encoding(len(body))
+    if coding == "br":
+        body = brotli.compress(body, quality=4)
+    elif coding == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+    if coding:
+        headers["Content-Encoding"] = coding
+    resp = current_app.response_class(body, status=status, headers=headers,
+                                      mimetype="application/json")
+    if tag:
+        resp.set_etag(tag, weak=True)
+        # 本人の非公開分も含むので共有キャッシュには置かせない
+        resp.cache_control.private = True
+        resp.cache_control.no_cache = True
+    return resp
+
+
+def not_modified_response(tag):
+    resp = current_app.response_class(status=304)
+    resp.set_etag(tag, weak=True)
+    resp.headers["Vary"] = "Accept-Encoding, Cookie"
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def error(exc):
+    """/api/ 以下の HTTP エラーは JSON で返す。"""
+    return response({"error": exc.name, "message": exc.description}, status=exc.code)
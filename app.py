@@ -1,50 +1,177 @@
 from flask import (
     Flask, render_template, request, redirect, url_for, abort, flash,
-    send_from_directory
+    send_from_directory, send_file, Response, stream_with_context, current_app
 )
-from sqlalchemy import func, or_
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 from flask_login import (
     LoginManager, login_user, logout_user, login_required, current_user
 )
 from pathlib import Path
-import os, uuid
+import os, sys, time, mimetypes
 
 from dotenv import load_dotenv
-load_dotenv()
 
 from models import db, Entry, User
 from forms import EntryForm, LoginForm
+import search
+import excerpts
+import revisions
+import pagination
+import counts
+import archive
+import images
+import storage
+import incoming
+import rendercache
+import metrics
+import dbconfig
+import transfer
+import bulk
+import tags
+import templatecache
+import jobs
+import passwords
+import ratelimit
+import usercache
+import api
 
 
 def create_app():
+    t0 = time.perf_counter()
+    boot = []   # (段階, 経過ms)。BOOT_PROFILE=1 で標準エラーに出す
+
+    def mark(phase):
+        boot.append((phase, (time.perf_counter() - t0) * 1000))
+
+    load_dotenv()
     app = Flask(__name__)
+    # ファイル部分は受信しながら判定して一時ファイルへ（incoming.py）
+    app.request_class = incoming.UploadRequest
     # --- 設定 ---
     app.config.from_mapping(
         SQLALCHEMY_DATABASE_URI=os.getenv("DB_URL", "sqlite:///diary.db"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         SECRET_KEY=os.getenv("SECRET_KEY", "dev-key"),
     )
+    # 接続プール・タイムアウト（dbconfig.py、SQLite では空）
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dbconfig.engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"])
     app.config.update(
         UPLOAD_FOLDER=os.getenv("UPLOAD_FOLDER", str(Path("uploads"))),
-        MAX_CONTENT_LENGTH=4 * 1024 * 1024,
+        # 保存先: local（UPLOAD_FOLDER）/ s3
+        UPLOAD_BACKEND=os.getenv("UPLOAD_BACKEND", "local"),
+        S3_BUCKET=os.getenv("S3_BUCKET"),
+        S3_PREFIX=os.getenv("S3_PREFIX", ""),
+        S3_ENDPOINT_URL=os.getenv("S3_ENDPOINT_URL"),
+        # 1リクエスト全体（本文・画像込み）と画像1枚の上限。超えると受信途中で 413
+        MAX_CONTENT_LENGTH=int(os.getenv("MAX_CONTENT_LENGTH_MB", "4")) * 1024 * 1024,
+        UPLOAD_MAX_FILE_BYTES=int(os.getenv("UPLOAD_MAX_FILE_MB", "4")) * 1024 * 1024,
+        # 一覧の件数: exact / estimated（PostgreSQL では reltuples の推定値）
+        COUNT_MODE=os.getenv("COUNT_MODE", "exact"),
+        COUNT_CACHE_TTL=float(os.getenv("COUNT_CACHE_TTL", "30")),
+        # 本人の日記がこの件数以下なら、検索は全文索引の全ヒットではなく本人の行から引く
+        SEARCH_NARROW_MAX=int(os.getenv("SEARCH_NARROW_MAX", "30")),
+        # 編集履歴（revisions.py）: この版数ごとに差分ではなく全文を置く
+        REVISION_SNAPSHOT_EVERY=int(os.getenv("REVISION_SNAPSHOT_EVERY", "20")),
+        # 日付のアーカイブで暦日を区切るタイムゾーン（変えたら rebuild_archive）
+        ARCHIVE_TZ=os.getenv("ARCHIVE_TZ", archive.DEFAULT_TZ),
+        # 縮小版の生成: thread / queue（flask worker）/ sync / off
+        IMAGE_PROCESSING=os.getenv("IMAGE_PROCESSING", "thread"),
+        IMAGE_WORKERS=int(os.getenv("IMAGE_WORKERS", "2")),
+        # 参照が無くなったアップロードの削除: inline（コミット直後）/ queue
+        UPLOAD_GC=os.getenv("UPLOAD_GC", "inline"),
+        # どこからも参照されないファイルでも、これより新しければ消さない（秒。
+        # 置いたリクエストがまだコミットしていないかもしれない）
+        UPLOAD_ORPHAN_MIN_AGE=int(os.getenv("UPLOAD_ORPHAN_MIN_AGE", "3600")),
+        # バックグラウンドジョブ（jobs.py）
+        JOB_MAX_ATTEMPTS=int(os.getenv("JOB_MAX_ATTEMPTS", "5")),
+        JOB_TIMEOUT=int(os.getenv("JOB_TIMEOUT", "300")),
+        JOB_POLL_INTERVAL=float(os.getenv("JOB_POLL_INTERVAL", "1")),
+        WORKER_CONCURRENCY=int(os.getenv("WORKER_CONCURRENCY", "2")),
+        # /uploads の配信: ""（gunicorn が返す）/ x-accel（nginx）/ x-sendfile
+        UPLOAD_CACHE_MAX_AGE=int(os.getenv("UPLOAD_CACHE_MAX_AGE", "31536000")),
+        UPLOAD_SENDFILE=os.getenv("UPLOAD_SENDFILE", ""),
+        UPLOAD_ACCEL_PREFIX=os.getenv("UPLOAD_ACCEL_PREFIX", "/protected-uploads/"),
+        # 一覧・詳細の描画キャッシュ: local（プロセス内 LRU）/ redis / off
+        RENDER_CACHE=os.getenv("RENDER_CACHE", "local"),
+        RENDER_CACHE_TTL=int(os.getenv("RENDER_CACHE_TTL", "300")),
+        RENDER_CACHE_MAX_BYTES=int(os.getenv("RENDER_CACHE_MAX_MB", "16")) * 1024 * 1024,
+        REDIS_URL=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        # リクエスト計測（Server-Timing ヘッダと /metrics）。既定は無効
+        METRICS_ENABLED=os.getenv("METRICS", "0") == "1",
+        METRICS_TOKEN=os.getenv("METRICS_TOKEN"),
+        METRICS_SLOW_QUERY_MS=float(os.getenv("METRICS_SLOW_QUERY_MS", "100")),
+        METRICS_N_PLUS_ONE=int(os.getenv("METRICS_N_PLUS_ONE", "10")),
+        # パスワード（passwords.py）。方式を変えると各ユーザーの次のログインで作り直す
+        PASSWORD_HASH_METHOD=os.getenv("PASSWORD_HASH_METHOD", passwords.DEFAULT_METHOD),
+        # 照合を子プロセスで行う数（0 はリクエストのスレッドで）と、同時に待てる上限
+        # （スレッド数より小さくして、他のリクエスト用のスレッドを残す）
+        PASSWORD_VERIFY_WORKERS=int(os.getenv("PASSWORD_VERIFY_WORKERS", "0")),
+        PASSWORD_VERIFY_MAX_PENDING=int(os.getenv("PASSWORD_VERIFY_MAX_PENDING", "2")),
+        PASSWORD_VERIFY_TIMEOUT=float(os.getenv("PASSWORD_VERIFY_TIMEOUT", "5")),
+        PASSWORD_VERIFY_NICE=int(os.getenv("PASSWORD_VERIFY_NICE", "5")),
+        # ログイン試行の制限（ratelimit.py）: memory / redis / off、"回数/秒数"
+        RATE_LIMIT_STORE=os.getenv("RATE_LIMIT_STORE", "memory"),
+        LOGIN_RATE_IP=os.getenv("LOGIN_RATE_IP", "20/60"),
+        LOGIN_RATE_USER=os.getenv("LOGIN_RATE_USER", "10/300"),
+        # ログイン中ユーザーの読み込み（usercache.py）。変更が他ワーカーに届くまでの最大秒数
+        USER_CACHE_TTL=int(os.getenv("USER_CACHE_TTL", "30")),
+        USER_CACHE_SIZE=int(os.getenv("USER_CACHE_SIZE", "10000")),
+        # 1 ならセッションに入れた署名済みスナップショットを DB を見ずに使う
+        USER_SNAPSHOT=os.getenv("USER_SNAPSHOT", "1") == "1",
+        USER_SNAPSHOT_TTL=int(os.getenv("USER_SNAPSHOT_TTL", "60")),
+        # 前段のプロキシの段数（X-Forwarded-For を信じる数）。0 は直結
+        TRUSTED_PROXIES=int(os.getenv("TRUSTED_PROXIES", "0")),
+        # ASGI（asgi.py）: 一覧・詳細で使う非同期ドライバの URL（空なら DB_URL から作る）と、
+        # それ以外のルートを動かすスレッド数
+        ASYNC_DB_URL=os.getenv("ASYNC_DB_URL") or None,
+        ASGI_WSGI_THREADS=int(os.getenv("ASGI_WSGI_THREADS", "8")),
+        # 起動時に create_all する（開発・テスト用）。本番は Alembic に任せて 0
+        DB_AUTO_CREATE=os.getenv("DB_AUTO_CREATE", "1") == "1",
+        BOOT_PROFILE=os.getenv("BOOT_PROFILE", "0") == "1",
+        # テンプレート（templatecache.py）: コンパイル結果を置いてワーカーで共有するディレクトリ
+        # （空なら置かない）と、更新を見に行くか（0 = 本番。空ならデバッグ時だけ）
+        TEMPLATE_CACHE_DIR=os.getenv("TEMPLATE_CACHE_DIR", ""),
+        TEMPLATES_AUTO_RELOAD=templatecache.auto_reload_setting(
+            os.getenv("TEMPLATES_AUTO_RELOAD", "")),
     )
+    app.config["USE_X_SENDFILE"] = app.config["UPLOAD_SENDFILE"] == "x-sendfile"
+    if app.config["TRUSTED_PROXIES"]:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        n = app.config["TRUSTED_PROXIES"]
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=n, x_proto=n, x_host=n)
+    # jinja_env は CSRFProtect が最初に触るので、その前に
+    templatecache.configure(app)
+    mark("config")
 
     # --- 拡張 ---
     CSRFProtect(app)
     db.init_app(app)
+    with app.app_context():
+        dbconfig.install(db.engine)
     login_manager = LoginManager()
     login_manager.login_view = "login"
     login_manager.init_app(app)
+    image_pipeline = images.ImagePipeline(app)
+    render_cache = rendercache.RenderCache(app)
+    hasher = passwords.PasswordHasher(app)
+    limiter = ratelimit.RateLimiter(app)
+    user_cache = usercache.UserCache(app)
+    metrics.Metrics(app)
 
     @login_manager.user_loader
     def load_user(user_id: str):
-        return db.session.get(User, int(user_id))
+        return user_cache.load(int(user_id))
+
+    mark("extensions")
 
     Path(app.config["UPLOAD_FOLDER"]).mkdir(parents=True, exist_ok=True)
-    with app.app_context():
-        db.create_all()
+    if app.config["DB_AUTO_CREATE"]:
+        with app.app_context():
+            db.create_all()
+    mark("schema")
 
     # --- ヘルパ ---
     ALLOWED_EXTS = {"png", "jpg", "jpeg", "gif", "webp"}
@@ -56,15 +183,90 @@ def create_app():
         ext = fname.rsplit(".", 1)[-1].lower() if "." in fname else ""
         if ext not in ALLOWED_EXTS:
             raise ValueError("許可されていない拡張子です")
-        new_name = f"{uuid.uuid4().hex}.{ext}"
-        dest = Path(app.config["UPLOAD_FOLDER"]) / new_name
-        file_storage.save(dest)
-        return new_name
+        stream = file_storage.stream
+        if isinstance(stream, incoming.IncomingFile):
+            # 受信時に種類を判定・ハッシュ済みの一時ファイルを置くだけ
+            if stream.kind is None:
+                raise ValueError(incoming.NotAnImage.description)
+            return stream.save(storage.get_storage())
+        # 受信しながらハッシュを取り、同じ内容なら既存のファイルを共有する
+        return storage.get_storage().put(stream, ext)
 
     # --- 静的配信 ---
+    # アップロードは内容の SHA-256 で名前が決まり上書きされないので、URL ごと
+    # 不変として長期キャッシュさせる。ETag もキー由来（サーバ間で同じ値）。
+    # 見せてよいかは参照している日記（同じ内容なら複数）で決める。どれも見られ
+    # なければ 404。非公開の日記からしか参照されていなければ共有キャッシュに
+    # 載せず（private）、毎回確かめる（no-cache。ETag で 304 になる）。
+    def upload_visibility(filename):
+        """(見てよいか, 公開の日記から参照されているか)"""
+        rows = db.session.execute(
+            db.select(Entry.user_id, Entry.is_public)
+              .where(Entry.image_path.in_(images.source_names(filename)))).all()
+        return (any(can_view(r.user_id, r.is_public) for r in rows),
+                any(r.is_public for r in rows))
+
     @app.get("/uploads/<path:filename>")
     def uploaded_file(filename):
-        return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+        visible, public = upload_visibility(filename)
+        if not visible:
+            abort(404)
+        backend = storage.get_storage()
+        if not backend.exists(filename):
+            if not images.ensure_variant(backend, filename):
+                abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        path = backend.local_path(filename)
+        max_age = app.config["UPLOAD_CACHE_MAX_AGE"] if public else None
+
+        # X-Accel の置き場所は誰でも読める前提なので、非公開の画像はここから返す
+        if app.config["UPLOAD_SENDFILE"] == "x-accel" and public:
+            resp = app.response_class(mimetype=mimetype)
+            resp.headers["X-Accel-Redirect"] = \
+                app.config["UPLOAD_ACCEL_PREFIX"].rstrip("/") + "/" + filename
+        elif path is not None:
+            resp = send_from_directory(
+                backend.root, filename, etag=filename.replace("/", "-"),
+                max_age=max_age)
+            resp.accept_ranges = "bytes"
+        else:
+            resp = send_file(
+                backend.open(filename), mimetype=mimetype,
+                etag=filename.replace("/", "-"), max_age=max_age)
+            resp.accept_ranges = "bytes"
+        if not public:
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            return resp
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+        resp.cache_control.immutable = True
+        return resp
+
+    app.jinja_env.globals.update(
+        image_srcset=lambda e, ext: images.srcset(e, url_for, ext),
+        image_variant=images.variant_name,
+        image_size=lambda e, variant: images.variant_size(
+            e.image_width, e.image_height, variant),
+    )
+
+    # --- 所有者・公開範囲 ---
+    def current_user_id():
+        return current_user.id if current_user.is_authenticated else None
+
+    def can_view(user_id, is_public):
+        return is_public or (user_id is not None and user_id == current_user_id())
+
+    def owned_entry(entry_id, *options):
+        """本人の日記を返す。他人の日記・所有者の無い日記は 404（有無を漏らさない）。"""
+        uid = current_user_id()
+        e = db.session.execute(
+            db.select(Entry).where(Entry.id == entry_id, Entry.user_id == uid)
+              .options(*options)
+        ).scalar_one_or_none() if uid is not None else None
+        if e is None:
+            abort(404)
+        return e
 
     # --- ルート ---
     @app.get("/")
@@ -74,31 +276,199 @@ def create_app():
             page = max(int(request.args.get("page", 1)), 1)
         except ValueError:
             page = 1
-        per_page = 10
+        after = request.args.get("after", "")
+        before = request.args.get("before", "")
+        tag = tags.normalize(request.args.get("tag", ""))
+        # ログイン中は自分の日記（公開・非公開とも）、?scope=public で公開分
+        owner = current_user_id()
+        if request.args.get("scope") == "public":
+            owner = None
+        content = render_cache.fragment(
+            "index", "index", (q, page, after, before, owner, tag),
+            lambda: index_content(q, page, after, before, owner, tag))
+        return render_template("index.html", content=content, q=q, owner=owner,
+                               user=current_user)
 
-        base = db.select(Entry)
+    def index_content(q, page, after_token, before_token, owner, tag):
+        listing = list_entries(q, page, after_token, before_token, owner, tag=tag,
+                               options=[db.selectinload(Entry.tags)])
+        return render_template("_index_content.html", q=q, owner=owner, tag=tag,
+                               cloud=tags.cloud(counts.scope(owner)[0]), **listing)
+
+    def list_entries(q, page, after_token, before_token, owner, per_page=10,
+                     options=(), tag=""):
+        """一覧の1ページ分（HTML の一覧と JSON API で共通）。tag はタグ名での絞り込み。"""
+        scope = counts.scope(owner)
+        base = db.select(Entry).where(scope[1]).options(*options)
+        tag_id = tag_total = None
+        if tag:
+            found = tags.find(tag)
+            tag_id = found.id if found else 0
+            tag_total = tags.total(scope[0], tag_id)
+            # カーソルで辿るなら1ページ分、OFFSET ならそこまでの行を探す
+            rows = (per_page + 1) * (1 if after_token or before_token else page)
+            base = tags.filter_entries(base, tag_id, dense=not q and tags.is_dense(
+                tag_total, counts.scope_total(scope), rows))
+        ranking = []
         if q:
-            like = f"%{q.lower()}%"
-            base = base.where(
-                or_(
-                    func.lower(Entry.title).like(like),
-                    func.lower(Entry.body).like(like),
-                )
-            )
-        count_stmt = db.select(func.count()).select_from(base.subquery())
-        total = db.session.scalar(count_stmt) or 0
+            narrow = owner is not None and \
+                counts.scope_total(scope) <= app.config["SEARCH_NARROW_MAX"]
+            base, ranking = search.apply_search(base, q, narrow)
+        if tag_id is not None and not q:
+            # タグだけの絞り込みは tag_counts の件数を読む
+            total, total_estimated = tag_total, False
+        else:
+            total, total_estimated = counts.count_entries(
+                base, q, mode=app.config["COUNT_MODE"],
+                ttl=app.config["COUNT_CACHE_TTL"], scope=scope, tag=tag_id)
         total_pages = max((total + per_page - 1) // per_page, 1) if total else 1
         page = min(page, total_pages)
 
-        stmt = base.order_by(Entry.created_at.desc()) \
-                   .limit(per_page).offset((page - 1) * per_page)
-        entries = db.session.execute(stmt).scalars().all()
-        has_next = page < total_pages
-        return render_template("index.html",
-                               entries=entries, q=q,
-                               page=page, has_next=has_next,
-                               total=total, total_pages=total_pages,
-                               user=current_user)
+        # 前後リンクはカーソルで辿る（深いページでも OFFSET で読み捨てない）。
+        # 関連度順の検索結果は (created_at, id) 順ではないので page 番号のまま。
+        after = pagination.decode_cursor(after_token)
+        before = pagination.decode_cursor(before_token)
+        if not ranking and (after or before):
+            entries, more = pagination.keyset_page(
+                db.session, base, per_page, after=after, before=before)
+            has_next = more if not before else True
+            has_prev = more if before else page > 1
+        else:
+            # 件数が推定値でも「次へ」を正しく出せるよう1件多く読む
+            stmt = base.order_by(*ranking, *pagination.ORDER) \
+                       .limit(per_page + 1).offset((page - 1) * per_page)
+            entries = db.session.execute(stmt).scalars().all()
+            has_next = len(entries) > per_page
+            entries = entries[:per_page]
+            has_prev = page > 1
+
+        next_cursor = prev_cursor = None
+        if entries and not ranking:
+            next_cursor = pagination.encode_cursor(entries[-1]) if has_next else None
+            prev_cursor = pagination.encode_cursor(entries[0]) if has_prev else None
+        return dict(entries=entries, page=page, has_next=has_next, has_prev=has_prev,
+                    next_cursor=next_cursor, prev_cursor=prev_cursor,
+                    total=total, total_estimated=total_estimated,
+                    total_pages=total_pages)
+
+    # ---- 日付のアーカイブ ----
+    def archive_owner():
+        # 一覧と同じ: ログイン中は自分の日記、?scope=public で公開分
+        owner = current_user_id()
+        return None if request.args.get("scope") == "public" else owner
+
+    @app.get("/archive")
+    @app.get("/archive/<int:year>")
+    def archive_year(year=None):
+        owner = archive_owner()
+        scope_name = counts.scope(owner)[0]
+        years = archive.years(scope_name)
+        if year is None:
+            year = years[0][0] if years else archive.today().year
+        if not 1 <= year <= 9998:
+            abort(404)
+        days = archive.day_counts(scope_name, *archive.period(year))
+        return render_template("archive.html", owner=owner, year=year, years=years,
+                               months=archive.months(days, year),
+                               heatmap=archive.heatmap(days, year),
+                               total=sum(days.values()))
+
+    @app.get("/archive/<int:year>/<int:month>")
+    @app.get("/archive/<int:year>/<int:month>/<int:day>")
+    def archive_entries(year, month, day=None):
+        try:
+            start, end = archive.period(year, month, day)
+        except (ValueError, OverflowError):
+            abort(404)
+        try:
+            page = max(int(request.args.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+        per_page = 20
+        owner = archive_owner()
+        scope = counts.scope(owner)
+        days = archive.day_counts(scope[0], *archive.period(year, month))
+        # 件数は entry_days から（Entry を数えない）
+        total = sum(n for d, n in days.items() if start <= d < end)
+        since, until = archive.utc_range(start, end, archive.zone())
+        entries = db.session.execute(
+            db.select(Entry).where(scope[1], Entry.created_at >= since,
+                                   Entry.created_at < until)
+              .order_by(*pagination.ORDER)
+              .limit(per_page).offset((page - 1) * per_page)
+        ).scalars().all()
+        return render_template("archive_entries.html", owner=owner, year=year,
+                               month=month, day=day, entries=entries, total=total,
+                               page=page, has_next=page * per_page < total,
+                               calendar=archive.month_calendar(days, year, month))
+
+    # ---- JSON API ----
+    @app.get("/api/v1/entries")
+    def api_entries():
+        q = request.args.get("q", "").strip()
+        try:
+            page = max(int(request.args.get("page", 1)), 1)
+            limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+        except ValueError:
+            abort(400, description="page / limit must be integers")
+        after = request.args.get("after", "")
+        before = request.args.get("before", "")
+        owner = current_user_id()
+        if request.args.get("scope") == "public":
+            owner = None
+        tag_name = tags.normalize(request.args.get("tag", ""))
+        fields = api.parse_fields(api.LIST_FIELDS)
+        # 一覧の中身を読む前に、変更番号だけで 304 を返せるか見る
+        tag = api.etag("entries", counts.entries_version(), owner,
+                       search.normalize_query(q) if q else "", tag_name, page, limit,
+                       after, before, fields)
+        if api.not_modified(tag):
+            return api.not_modified_response(tag)
+        listing = list_entries(q, page, after, before, owner, per_page=limit,
+                               options=api.load_fields(fields), tag=tag_name)
+        return api.response({
+            "entries": [api.serialize(e, fields) for e in listing["entries"]],
+            "page": listing["page"],
+            "total": listing["total"],
+            "total_estimated": listing["total_estimated"],
+            "next_cursor": listing["next_cursor"],
+            "prev_cursor": listing["prev_cursor"],
+            "has_next": listing["has_next"],
+            "has_prev": listing["has_prev"],
+        }, tag)
+
+    @app.get("/api/v1/entries/<int:entry_id>")
+    def api_entry(entry_id: int):
+        fields = api.parse_fields(api.DETAIL_FIELDS)
+        tag = api.etag("entry", counts.entries_version(), current_user_id(),
+                       entry_id, fields)
+        if api.not_modified(tag):
+            return api.not_modified_response(tag)
+        e = db.session.execute(
+            db.select(Entry).where(Entry.id == entry_id)
+              .options(*api.load_fields(fields + ("user_id", "is_public")))
+        ).scalar_one_or_none()
+        if e is None or not can_view(e.user_id, e.is_public):
+            abort(404)
+        return api.response(api.serialize(e, fields), tag)
+
+    # 画像を受け取るビュー -> 断ったときに戻すフォーム
+    UPLOAD_FORMS = {"create_entry": "new_entry", "update_entry": "edit_entry"}
+
+    @app.errorhandler(HTTPException)
+    def http_error(exc):
+        if request.path.startswith("/api/"):
+            return api.error(exc)
+        if exc.code in (413, 415) and request.endpoint in UPLOAD_FORMS:
+            # 受信途中で断ったアップロードは、理由を出してフォームに戻す
+            if isinstance(exc, (incoming.NotAnImage, incoming.FileTooLarge)):
+                flash(exc.description, "error")
+            else:
+                limit = app.config["MAX_CONTENT_LENGTH"] / 1024 / 1024
+                flash(f"送信内容が大きすぎます（{limit:g} MB まで）", "error")
+            return redirect(url_for(UPLOAD_FORMS[request.endpoint],
+                                    **(request.view_args or {})), 303)
+        return exc
 
     # ---- 認証 ----
     @app.get("/login")
@@ -110,15 +480,32 @@ def create_app():
     def login_post():
         form = LoginForm()
         if form.validate_on_submit():
+            username = form.username.data.strip()
+            wait = limiter.check_login(request.remote_addr or "", username)
+            if wait:
+                flash("ログインの試行が多すぎます。しばらく待ってから試してください", "error")
+                return render_template("login.html", form=form), 429, \
+                    {"Retry-After": str(int(wait) + 1)}
             u = db.session.execute(
-                db.select(User).where(User.email == form.email.data.strip())
+                db.select(User).where(User.username == username)
             ).scalar_one_or_none()
-            if u and u.check_password(form.password.data):
+            try:
+                ok = hasher.verify(u.password_hash if u else None, form.password.data)
+            except passwords.Busy:
+                flash("混み合っています。少し待ってからもう一度試してください", "error")
+                return render_template("login.html", form=form), 503, {"Retry-After": "1"}
+            if ok and u.active:
+                if hasher.needs_rehash(u.password_hash):
+                    # 方式・パラメータが変わっていたら、平文があるうちに作り直す
+                    u.set_password(form.password.data)
+                    db.session.commit()
+                    hasher.stats["rehashed"] += 1
                 login_user(u)
+                user_cache.remember(u)
                 flash("ログインしました", "success")
                 nxt = request.args.get("next")
                 return redirect(nxt or url_for("index"))
-            flash("メールまたはパスワードが違います", "error")
+            flash("ユーザー名またはパスワードが違います", "error")
             return render_template("login.html", form=form), 400
         return render_template("login.html", form=form), 400
 
@@ -127,6 +514,7 @@ def create_app():
     @login_required
     def logout():
         logout_user()
+        user_cache.forget()
         flash("ログアウトしました", "success")
         return redirect(url_for("index"))
 
@@ -152,9 +540,14 @@ def create_app():
                 title=form.title.data.strip(),
                 body=form.body.data.strip(),
                 image_path=img_name,
+                user_id=current_user.id,
+                is_public=not form.private.data,
+                tags=tags.resolve(tags.parse(form.tag_names.data)),
             )
             db.session.add(e)
             db.session.commit()
+            if img_name:
+                image_pipeline.submit(e.id)
             flash("作成しました", "success")
             return redirect(url_for("detail", entry_id=e.id))
 
@@ -165,40 +558,114 @@ def create_app():
 
     @app.get("/entry/<int:entry_id>")
     def detail(entry_id: int):
-        e = db.session.get(Entry, entry_id)
-        if not e:
+        # 見てよいかは主キーで2列だけ読んで決める（本文の描画はキャッシュから）
+        row = db.session.execute(
+            db.select(Entry.user_id, Entry.is_public).where(Entry.id == entry_id)
+        ).first()
+        if row is None or not can_view(*row):
             abort(404)
-        return render_template("detail.html", e=e, user=current_user)
+
+        def render():
+            e = db.session.get(Entry, entry_id, options=[db.undefer(Entry.body)])
+            if not e:
+                abort(404)
+            return render_template("_entry_content.html", e=e)
+
+        content = render_cache.fragment(
+            "detail", f"entry:{entry_id}", (entry_id,), render)
+        return render_template("detail.html", content=content,
+                               entry_id=entry_id, user=current_user,
+                               can_edit=row.user_id is not None
+                               and row.user_id == current_user_id())
+
+    @app.get("/export.<fmt>")
+    @login_required
+    def export_entries(fmt: str):
+        if fmt not in transfer.FORMATS:
+            abort(404)
+        # 自分の日記だけを、行を読みながら返す（全件をメモリに載せない）
+        body = stream_with_context(transfer.export(fmt, user_id=current_user.id))
+        return Response(body, mimetype=transfer.FORMATS[fmt], headers={
+            "Content-Disposition": f"attachment; filename=entries.{fmt}"})
+
+    @app.post("/entries/bulk")
+    @login_required
+    def bulk_entries():
+        """一覧で選んだ日記をまとめて 削除 / 非公開 / 公開 / タグ付け / 書き出し（export.<形式>）。"""
+        op = request.form.get("op", "")
+        try:
+            ids = [int(i) for i in request.form.getlist("ids")]
+        except ValueError:
+            abort(400)
+        back = url_for("index", q=request.form.get("q") or None)
+        if op.startswith("export."):
+            fmt = op.split(".", 1)[1]
+            if fmt not in transfer.FORMATS or not ids:
+                abort(400)
+            body = stream_with_context(
+                transfer.export(fmt, user_id=current_user.id, ids=ids))
+            return Response(body, mimetype=transfer.FORMATS[fmt], headers={
+                "Content-Disposition": f"attachment; filename=entries.{fmt}"})
+        if op not in ("delete", "private", "public", "tag"):
+            abort(400)
+        if not ids:
+            flash("日記を選んでください", "error")
+            return redirect(back)
+
+        if op == "delete":
+            n = bulk.delete(ids, current_user.id)
+            done = f"{n}件を削除しました"
+        elif op == "tag":
+            try:
+                names = tags.parse(request.form.get("tag_name", ""))
+            except ValueError as e:
+                names, error = [], str(e)
+            else:
+                error = "付けるタグを1つ入力してください"
+            if len(names) != 1:
+                flash(error, "error")
+                return redirect(back)
+            n = bulk.add_tag(ids, current_user.id, names[0])
+            done = f"{n}件に #{names[0]} を付けました"
+        else:
+            n = bulk.set_public(ids, current_user.id, op == "public")
+            done = f"{n}件を" + ("公開にしました" if op == "public" else "非公開にしました")
+        skipped = len(set(ids)) - n
+        flash(done + (f"（{skipped}件はそのまま）" if skipped else ""), "success")
+        return redirect(back)
 
     @app.get("/entry/<int:entry_id>/edit")
     @login_required
     def edit_entry(entry_id: int):
-        e = db.session.get(Entry, entry_id)
-        if not e:
-            abort(404)
-        form = EntryForm(obj=e)
+        e = owned_entry(entry_id, db.undefer(Entry.body))
+        form = EntryForm(obj=e, private=not e.is_public,
+                         tag_names=" ".join(t.name for t in e.tags))
         return render_template("edit.html", form=form, e=e)
 
     @app.post("/entry/<int:entry_id>/update")
     @login_required
     def update_entry(entry_id: int):
-        e = db.session.get(Entry, entry_id)
-        if not e:
-            abort(404)
+        e = owned_entry(entry_id)
         form = EntryForm()
         if form.validate_on_submit():
             e.title = form.title.data.strip()
             e.body = form.body.data.strip()
+            e.is_public = not form.private.data
+            e.tags = tags.resolve(tags.parse(form.tag_names.data))
 
             file = request.files.get("image")
-            if file and file.filename:
+            new_image = bool(file and file.filename)
+            if new_image:
                 try:
                     e.image_path = save_image(file)
                 except ValueError as err:
                     flash(str(err), "error")
                     return render_template("edit.html", form=form, e=e), 400
+                e.image_width = e.image_height = e.image_variants = None
 
             db.session.commit()
+            if new_image:
+                image_pipeline.submit(e.id)
             flash("更新しました", "success")
             return redirect(url_for("detail", entry_id=e.id))
 
@@ -207,47 +674,259 @@ def create_app():
                 flash(f"{field}: {err}", "error")
         return render_template("edit.html", form=form, e=e), 400
 
+    # ---- 編集履歴（本人だけ） ----
+    @app.get("/entry/<int:entry_id>/history")
+    @login_required
+    def entry_history(entry_id: int):
+        e = owned_entry(entry_id)
+        return render_template("history.html", e=e,
+                               revisions=revisions.history(entry_id))
+
+    @app.get("/entry/<int:entry_id>/history/<int:seq>")
+    @login_required
+    def entry_revision(entry_id: int, seq: int):
+        e = owned_entry(entry_id)
+        version = revisions.load(entry_id, seq)
+        if version is None:
+            abort(404)
+        title, body, created_at = version
+        prev = revisions.load(entry_id, seq - 1) if seq > 1 else None
+        return render_template("revision.html", e=e, seq=seq, title=title, body=body,
+                               created_at=created_at, prev_title=prev and prev[0],
+                               diff=revisions.diff_lines(prev[1], body) if prev else [])
+
+    @app.post("/entry/<int:entry_id>/history/<int:seq>/restore")
+    @login_required
+    def restore_revision(entry_id: int, seq: int):
+        e = owned_entry(entry_id)
+        version = revisions.load(entry_id, seq)
+        if version is None:
+            abort(404)
+        # 戻した内容も新しい版として残る
+        e.title, e.body = version[0], version[1]
+        db.session.commit()
+        flash(f"第{seq}版に戻しました", "success")
+        return redirect(url_for("detail", entry_id=entry_id))
+
     @app.post("/entry/<int:entry_id>/delete")
     @login_required
     def delete_entry(entry_id: int):
-        e = db.session.get(Entry, entry_id)
-        if not e:
-            abort(404)
+        e = owned_entry(entry_id)
         db.session.delete(e)
         db.session.commit()
         flash("削除しました", "success")
         return redirect(url_for("index"))
 
+    for command in cli.commands.values():
+        app.cli.add_command(command)
+    mark("routes")
+    app.extensions["boot_profile"] = boot
+    if app.config["BOOT_PROFILE"]:
+        print("boot:", " ".join(f"{p}={ms:.1f}ms" for p, ms in boot), file=sys.stderr)
     return app
 
 
-app = create_app()
-# 便利に参照できるように（任意）
-app.db = db
-
+def __getattr__(name):
+    # `gunicorn app:app` / `flask --app app` から参照されたときに初めて作る。
+    # `from app import create_app` だけなら（テストなど）アプリは作らない
+    if name == "app":
+        global app
+        app = create_app()
+        # 便利に参照できるように（任意）
+        app.db = db
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-# --- CLI: 初回の管理ユーザー作成 ---
+# --- CLI（create_app() が登録する） ---
 import click
+from flask.cli import AppGroup
 from models import db, User
 from werkzeug.security import generate_password_hash
 
-@app.cli.command("create_admin")
+cli = AppGroup("diary")
+
+
+@cli.command("create_admin")
 @click.argument("username")
 @click.argument("password")
 def create_admin(username, password):
     """例: flask --app app create_admin admin 'Passw0rd!'"""
-    with app.app_context():
-        if User.query.filter_by(username=username).first():
-            print("既に存在します:", username)
-            return
-        u = User(username=username)
-        # set_password() があればそれを使う。無ければ password_hash を直接設定
-        if hasattr(u, "set_password"):
-            u.set_password(password)
-        else:
-            u.password_hash = generate_password_hash(password)
-        db.session.add(u)
-        db.session.commit()
-        print("作成OK:", username)
+    if User.query.filter_by(username=username).first():
+        print("既に存在します:", username)
+        return
+    u = User(username=username)
+    # set_password() があればそれを使う。無ければ password_hash を直接設定
+    if hasattr(u, "set_password"):
+        u.set_password(password)
+    else:
+        u.password_hash = generate_password_hash(password)
+    db.session.add(u)
+    db.session.commit()
+    print("作成OK:", username)
+
+
+
+@cli.command("recount")
+def recount():
+    """件数カウンタ（counters）を実件数から作り直す。例: flask --app app recount"""
+    rows = counts.recount()
+    print("再構築OK: 全", rows[counts.TOTAL], "件（範囲ごとの件数は次に読まれたときに数える）")
+
+
+@cli.command("rebuild_search")
+def rebuild_search():
+    """全文検索インデックスを作り直す。例: flask --app app rebuild_search"""
+    n = search.rebuild_index()
+    print("再構築OK:", n, "件")
+
+
+@cli.command("rebuild_archive")
+def rebuild_archive():
+    """日付のアーカイブ（entry_days）を作り直す。例: flask --app app rebuild_archive"""
+    n = archive.rebuild()
+    print("再構築OK:", n, "行")
+
+
+@cli.command("rebuild_tags")
+def rebuild_tags():
+    """タグごとの件数（tag_counts）を作り直す。例: flask --app app rebuild_tags"""
+    n = tags.rebuild()
+    print("再構築OK:", n, "行")
+
+
+@cli.command("compile_templates")
+@click.option("--clear", is_flag=True, help="先にキャッシュを空にする")
+def compile_templates(clear):
+    """全テンプレートをコンパイルしてバイトコードキャッシュに入れる（ビルド時に）。
+    例: flask --app app compile_templates"""
+    directory = current_app.config["TEMPLATE_CACHE_DIR"] or templatecache.DEFAULT_DIR
+    n, ms, errors = templatecache.compile_all(current_app, directory, clear=clear)
+    for name, message in errors:
+        print("エラー:", name, message, file=sys.stderr)
+    if errors:
+        raise click.ClickException(f"{len(errors)} 件のテンプレートを読めません")
+    print(f"コンパイルOK: {n} 件（{ms:.0f}ms）→ {directory}")
+
+
+@cli.command("backfill_images")
+def backfill_images():
+    """既存画像の縮小版を作る。例: flask --app app backfill_images"""
+    ids = db.session.execute(
+        db.select(Entry.id).where(Entry.image_path.is_not(None),
+                                  Entry.image_variants.is_(None))
+    ).scalars().all()
+    backend = storage.get_storage()
+    ok = sum(images.process_entry_image(backend, i) for i in ids)
+    print("縮小版OK:", ok, "/", len(ids), "件")
+
+
+@cli.command("migrate_uploads")
+def migrate_uploads():
+    """旧形式のアップロードを内容アドレス方式へ移す。例: flask --app app migrate_uploads"""
+    backend = storage.get_storage()
+    n, freed = storage.migrate_legacy(
+        lambda entry_id: images.process_entry_image(backend, entry_id))
+    print("移行OK:", n, "件 / 解放:", freed, "bytes")
+
+
+@cli.command("gc_uploads")
+@click.option("--min-age", type=int, help="これより新しい（秒）ファイルは残す。既定は UPLOAD_ORPHAN_MIN_AGE")
+def gc_uploads(min_age):
+    """参照されていないアップロードを消す。例: flask --app app gc_uploads"""
+    freed = storage.collect() + storage.sweep_orphans(min_age)
+    print("解放:", freed, "bytes")
+
+
+def _owner_id(username):
+    if username is None:
+        return None
+    uid = db.session.scalar(db.select(User.id).where(User.username == username))
+    if uid is None:
+        raise click.BadParameter(f"ユーザーがいません: {username}", param_hint="--owner")
+    return uid
+
+
+@cli.command("export_entries")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(list(transfer.FORMATS)),
+              help="省略時は拡張子から")
+@click.option("--batch", default=1000, show_default=True)
+@click.option("--owner", help="このユーザーの日記だけ（省略時は全件）")
+def export_entries(path, fmt, batch, owner):
+    """日記を書き出す。例: flask --app app export_entries backup.zip"""
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+    user_id = _owner_id(owner)
+    with open(path, "wb") as f:
+        for chunk in transfer.export(fmt, batch, user_id):
+            f.write(chunk)
+    print("書き出しOK:", path)
+
+
+@cli.command("import_entries")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(list(transfer.FORMATS)),
+              help="省略時は拡張子から")
+@click.option("--chunk", default=1000, show_default=True)
+@click.option("--owner", help="取り込んだ日記の所有者（省略時は所有者なし）")
+def import_entries(path, fmt, chunk, owner):
+    """日記を取り込む（id は振り直す）。例: flask --app app import_entries backup.zip --owner alice"""
+    n = transfer.import_file(path, fmt, chunk, _owner_id(owner))
+    print("取り込みOK:", n, "件（画像の縮小版は backfill_images で作る）")
+
+
+@cli.command("assign_owner")
+@click.argument("username")
+def assign_owner(username):
+    """所有者の無い（移行前の）日記を username のものにする。例: flask --app app assign_owner alice"""
+    user_id = _owner_id(username)
+    res = db.session.execute(
+        db.update(Entry).where(Entry.user_id.is_(None)).values(user_id=user_id)
+          .execution_options(synchronize_session=False))
+    db.session.commit()
+    # Core の一括 UPDATE は件数カウンタ・アーカイブ・描画キャッシュのフックを通らない
+    counts.recount()
+    archive.rebuild()
+    tags.rebuild()
+    cache = current_app.extensions.get("render_cache")
+    if cache:
+        cache.invalidate([])
+    print("割り当てOK:", res.rowcount, "件 →", username)
+
+
+@cli.command("set_user_active")
+@click.argument("username")
+@click.argument("state", type=click.Choice(["on", "off"]))
+def set_user_active(username, state):
+    """ユーザーを有効/無効にする（無効にするとログイン中のセッションも切れる）。例: flask --app app set_user_active alice off"""
+    u = db.session.execute(db.select(User).where(User.username == username)).scalar_one_or_none()
+    if u is None:
+        raise click.BadParameter(f"ユーザーがいません: {username}", param_hint="username")
+    u.active = state == "on"
+    db.session.commit()
+    print("変更OK:", username, state)
+
+
+@cli.command("worker")
+@click.option("--concurrency", type=int, help="既定は WORKER_CONCURRENCY（SQLite では 1）")
+@click.option("--once", is_flag=True, help="今あるジョブを処理したら終わる")
+def worker(concurrency, once):
+    """バックグラウンドジョブを処理する。例: flask --app app worker"""
+    if once:
+        print("処理:", jobs.run_pending(), "件")
+        return
+    cfg = current_app.config
+    w = jobs.Worker(current_app._get_current_object(),
+                    concurrency or cfg["WORKER_CONCURRENCY"], cfg["JOB_POLL_INTERVAL"])
+    print("worker 起動: 並行数", w.concurrency)
+    w.run()
+
+
+@cli.command("enqueue")
+@click.argument("kind", type=click.Choice(jobs.MAINTENANCE))
+def enqueue(kind):
+    """保守ジョブを積む。例: flask --app app enqueue search.rebuild"""
+    job = jobs.enqueue(kind)
+    db.session.commit()
+    print("登録OK:", kind, "id =", job.id)
 
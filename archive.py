@@ -0,0 +1,190 @@
+"""日付ごとのアーカイブ（年・月・日の一覧とカレンダーのヒートマップ）
+
+entry_days 表に (範囲, 暦日) ごとの件数を持ち、年・月ごとの件数やヒートマップは
+Entry を数えずにここから作る。範囲は counts と同じ行名（entries_public /
+entries_user:<id>）。Entry の追加・削除・公開設定の変更と同じトランザクションで
+増減する（after_flush）。Core で一括投入したときは bump_days を呼ぶ。ずれたら
+`flask rebuild_archive` で作り直す。
+
+created_at は UTC で保存しているので、暦日は ARCHIVE_TZ（既定 Asia/Tokyo）で
+区切る。日・月の一覧は、その暦日の範囲を UTC に直して created_at の索引で引く。
+"""
+import calendar
+from collections import Counter as Tally
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Entry, EntryDay
+import counts
+
+DEFAULT_TZ = "Asia/Tokyo"
+
+
+def zone():
+    name = current_app.config["ARCHIVE_TZ"] if has_app_context() else DEFAULT_TZ
+    return ZoneInfo(name)
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).astimezone(zone()).date()
+
+
+def local_day(created_at, tz) -> date:
+    # SQLite から読んだ値は tzinfo が無い（UTC として保存している）
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(tz).date()
+
+
+def utc_range(start: date, end: date, tz):
+    """暦日 [start, end) を created_at の範囲（UTC）にする。"""
+    def to_utc(d):
+        return datetime.combine(d, time.min, tz).astimezone(timezone.utc)
+    return to_utc(start), to_utc(end)
+
+
+def period(year, month=None, day=None):
+    """年 / 月 / 日を暦日の範囲 [start, end) にする。存在しない日付は ValueError。"""
+    if day is not None:
+        start = date(year, month, day)
+        return start, start + timedelta(days=1)
+    if month is not None:
+        start = date(year, month, 1)
+        return start, date(year + month // 12, month % 12 + 1, 1)
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def tally_days(rows, tz) -> Tally:
+    """(user_id, is_public, created_at) の列から {(範囲, 暦日): 件数} を作る。"""
+    tally = Tally()
+    for user_id, is_public, created_at in rows:
+        day = local_day(created_at, tz)
+        for name in counts.scope_names(user_id, is_public):
+            tally[name, day] += 1
+    return tally
+
+
+# --- 書き込み側 ---
+@event.listens_for(Session, "after_flush")
+def _track_entry_days(session, flush_context):
+    changes = Tally()
+    tz = None
+    for o in session.new:
+        if isinstance(o, Entry):
+            tz = tz or zone()
+            changes.update(tally_days([(o.user_id, o.is_public, o.created_at)], tz))
+    for o in session.deleted:
+        if isinstance(o, Entry):
+            tz = tz or zone()
+            changes.subtract(tally_days([(o.user_id, o.is_public, o.created_at)], tz))
+    for o in session.dirty:
+        if not isinstance(o, Entry) or not session.is_modified(o):
+            continue
+        (old_user, new_user), (old_pub, new_pub), (old_at, new_at) = (
+            counts.before_after(o, "user_id"), counts.before_after(o, "is_public"),
+            counts.before_after(o, "created_at"))
+        if (old_user, old_pub, old_at) != (new_user, new_pub, new_at):
+            tz = tz or zone()
+            changes.subtract(tally_days([(old_user, old_pub, old_at)], tz))
+            changes.update(tally_days([(new_user, new_pub, new_at)], tz))
+    if changes:
+        bump_days(session, changes)
+
+
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(EntryDay)
+
+
+def bump_days(session, changes):
+    """{(範囲, 暦日): 増減} を entry_days に反映する。Core で一括投入した後にも呼ぶ。"""
+    conn = session.connection()
+    for (name, day), delta in changes.items():
+        if delta > 0:
+            # その日の最初の日記を同時に書いても（entries_public は全員で共有）
+            # 主キーで落ちないように upsert
+            conn.execute(_insert(conn).values(scope=name, day=day, count=delta)
+                           .on_conflict_do_update(index_elements=["scope", "day"],
+                                                  set_={"count": EntryDay.count + delta}))
+        elif delta < 0:
+            conn.execute(db.update(EntryDay)
+                           .where(EntryDay.scope == name, EntryDay.day == day)
+                           .values(count=EntryDay.count + delta))
+
+
+def rebuild(batch=10_000) -> int:
+    """entry_days を Entry から作り直して行数を返す。"""
+    rows = db.session.execute(
+        db.select(Entry.user_id, Entry.is_public, Entry.created_at)
+          .execution_options(yield_per=batch))
+    tally = tally_days(rows, zone())
+    db.session.execute(db.delete(EntryDay))
+    items = [{"scope": name, "day": day, "count": n} for (name, day), n in tally.items()]
+    for i in range(0, len(items), batch):
+        db.session.execute(db.insert(EntryDay), items[i:i + batch])
+    db.session.commit()
+    return len(items)
+
+
+# --- 読み込み側 ---
+def day_counts(scope_name, start=None, end=None) -> dict:
+    """{暦日: 件数}（0 件の日は含まない）。"""
+    stmt = db.select(EntryDay.day, EntryDay.count) \
+             .where(EntryDay.scope == scope_name, EntryDay.count > 0)
+    if start is not None:
+        stmt = stmt.where(EntryDay.day >= start)
+    if end is not None:
+        stmt = stmt.where(EntryDay.day < end)
+    return dict(db.session.execute(stmt).all())
+
+
+def years(scope_name):
+    """[(年, 件数)] の新しい順。"""
+    tally = Tally()
+    for day, n in day_counts(scope_name).items():
+        tally[day.year] += n
+    return sorted(tally.items(), reverse=True)
+
+
+def months(days: dict, year: int):
+    """day_counts の結果から [(月, 件数)]（1〜12 月すべて）。"""
+    tally = Tally()
+    for d, n in days.items():
+        if d.year == year:
+            tally[d.month] += n
+    return [(m, tally[m]) for m in range(1, 13)]
+
+
+def heatmap(days: dict, year: int):
+    """1年分のヒートマップ。曜日（月〜日）ごとの行に、週ごとのセルを並べる。
+
+    セルは {"day", "count", "level"}（level は 0〜4 の濃さ）。年の外は None。
+    """
+    top = max(days.values(), default=0)
+    first = date(year, 1, 1)
+    start = first - timedelta(days=first.weekday())
+    weeks = (date(year, 12, 31) - start).days // 7 + 1
+    rows = [[] for _ in range(7)]
+    for i in range(weeks * 7):
+        d = start + timedelta(days=i)
+        if d.year != year:
+            rows[d.weekday()].append(None)
+            continue
+        n = days.get(d, 0)
+        level = 0 if not n else min(4, -(-n * 4 // top))
+        rows[d.weekday()].append({"day": d, "count": n, "level": level})
+    return rows
+
+
+def month_calendar(days: dict, year: int, month: int):
+    """月のカレンダー（月曜始まりの週ごと）。セルは (暦日, 件数)、月の外は None。"""
+    return [[(date(year, month, d), days.get(date(year, month, d), 0)) if d else None
+             for d in week]
+            for week in calendar.Calendar().monthdayscalendar(year, month)]
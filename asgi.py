@@ -0,0 +1,191 @@
+"""ASGI の入口（uvicorn で動かす）
+
+例: uvicorn asgi:app --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 asgi:app
+
+よく読まれる GET（一覧 index・詳細 detail・JSON API・画像 uploaded_file）だけここで受け、
+それ以外（ログイン・フォーム・書き込み・書き出しなど）は従来どおり Flask を
+スレッドプール（ASGI_WSGI_THREADS）で動かす（a2wsgi）。
+
+一覧・詳細は Flask のビューをそのまま使い、DB だけ非同期ドライバ
+（SQLite: aiosqlite / PostgreSQL: psycopg の async。ASYNC_DB_URL で変更可）に
+つなぎ替える。AsyncSession.run_sync の中でビューを呼ぶと、db.session の I/O を
+待つ間はイベントループが他の接続を進める（SQLAlchemy の greenlet 連携）。
+権限・件数・描画キャッシュはすべて WSGI と同じコードを通る。描画自体は CPU
+処理なのでループ上で行う。
+
+画像はビュー（存在確認・縮小版の生成）をスレッドで動かし、本文はチャンクごとに
+スレッドで読みながら送る。遅いクライアントがワーカーやスレッドを塞がない。
+"""
+import asyncio
+import contextvars
+import io
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import appcontext_pushed
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+import dbconfig
+from models import db
+
+# ループ上で動かす（DB は非同期）ルートと、スレッドで動かすルート
+ASYNC_ENDPOINTS = {"index", "detail", "api_entries", "api_entry"}
+THREAD_ENDPOINTS = {"uploaded_file"}
+
+_session = contextvars.ContextVar("asgi_db_session", default=None)
+
+
+def async_url(url: str) -> str:
+    """同期用の DB_URL から非同期ドライバの URL を作る。"""
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if backend == "sqlite":
+        if u.database in (None, "", ":memory:"):
+            raise ValueError("ASGI ではメモリ上の SQLite は使えません（ファイルにしてください）")
+        return u.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend == "postgresql":
+        # psycopg 3 は同じパッケージで async にも対応している
+        return u.set(drivername="postgresql+psycopg").render_as_string(hide_password=False)
+    raise ValueError(f"非同期ドライバが分かりません: {backend}")
+
+
+class DiaryASGI:
+    """Flask アプリを包む ASGI アプリ。"""
+
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config["ASGI_WSGI_THREADS"])
+        self.stats = {"async": 0, "thread": 0, "wsgi": 0}
+        self._engine = None
+        flask_app.extensions["asgi"] = self
+        appcontext_pushed.connect(self._use_async_session, flask_app)
+
+    @property
+    def engine(self):
+        # ワーカープロセスで初めて使うときに作る（preload した親では作らない）
+        if self._engine is None:
+            cfg = self.flask.config
+            url = cfg["ASYNC_DB_URL"] or async_url(cfg["SQLALCHEMY_DATABASE_URI"])
+            engine = create_async_engine(url, **dbconfig.engine_options(url))
+            dbconfig.install(engine.sync_engine)
+            metrics = self.flask.extensions.get("metrics")
+            if metrics:
+                metrics.watch_engine(engine.sync_engine)
+            self._engine = engine
+        return self._engine
+
+    @staticmethod
+    def _use_async_session(app, **extra):
+        # run_sync の中で積まれたアプリコンテキストでは、db.session を
+        # 非同期エンジンにつながった Session にする
+        session = _session.get()
+        if session is not None:
+            db.session.registry.set(session)
+
+    def _endpoint(self, environ):
+        adapter = self.flask.url_map.bind_to_environ(environ)
+        try:
+            return adapter.match()[0]
+        except HTTPException:
+            return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            environ = build_environ(scope, io.BytesIO())
+            endpoint = self._endpoint(environ)
+            if endpoint in ASYNC_ENDPOINTS:
+                self.stats["async"] += 1
+                return await self._respond(send, *await self._run_async(environ))
+            if endpoint in THREAD_ENDPOINTS:
+                self.stats["thread"] += 1
+                return await self._respond(
+                    send, *await asyncio.to_thread(self._call_wsgi, environ))
+        self.stats["wsgi"] += 1
+        await self.wsgi(scope, receive, send)
+
+    def _call_wsgi(self, environ):
+        head = []
+
+        def start_response(status, headers, exc_info=None):
+            head[:] = [status, headers]
+
+        body = self.flask.wsgi_app(environ, start_response)
+        return head[0], head[1], body
+
+    def _call_buffered(self, environ):
+        # 一覧・詳細の本文は描画済みの文字列なので、ここで読み切る
+        status, headers, body = self._call_wsgi(environ)
+        try:
+            return status, headers, [b"".join(body)]
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    async def _run_async(self, environ):
+        async with AsyncSession(self.engine, expire_on_commit=False) as session:
+            token = _session.set(session.sync_session)
+            try:
+                return await session.run_sync(lambda _: self._call_buffered(environ))
+            finally:
+                _session.reset(token)
+
+    async def _respond(self, send, status, headers, body):
+        await send({"type": "http.response.start", "status": int(status.split()[0]),
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                for k, v in headers]})
+        try:
+            if isinstance(body, (list, tuple)):
+                for chunk in body:
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": True})
+            else:
+                # ファイルなど。読み出しはスレッドで
+                it = iter(body)
+                while True:
+                    chunk = await asyncio.to_thread(next, it, None)
+                    if chunk is None:
+                        break
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                await asyncio.to_thread(close)
+
+    async def aclose(self):
+        """接続を閉じる（aiosqlite の接続スレッドが残るとプロセスが終わらない）。"""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi(flask_app=None):
+    if flask_app is None:
+        from app import create_app
+        flask_app = create_app()
+    return DiaryASGI(flask_app)
+
+
+def __getattr__(name):
+    # `uvicorn asgi:app` から参照されたときに初めて作る（app.py と同じ）
+    if name == "app":
+        global app
+        app = create_asgi()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
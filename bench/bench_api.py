@@ -0,0 +1,55 @@
+"""モバイル向けのタイトル一覧: HTML の一覧と JSON API の転送量・時間
+
+例: python bench/bench_api.py --entries 20000 --body-chars 2000 --repeat 20
+先頭から 20 件分のタイトル一覧を取るのにかかるバイト数とサーバー側の時間を
+  - html: 一覧ページ（1ページ 10 件なので 2 ページ分）
+  - api all fields: /api/v1/entries?fields=...（本文も含む）
+  - api id,title,created_at: 返す列を絞る（本文は DB からも読まない）
+  - 304: If-None-Match で再検証（変更が無ければ本文なし）
+で比べる。圧縮は identity / gzip / br（brotli が入っていれば）。
+描画キャッシュは切って、毎回組み立てる時間を測る。
+"""
+import argparse
+
+from common import use_temp_db, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=20_000)
+    ap.add_argument("--body-chars", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    use_temp_db(f"api_{args.entries}_{args.body_chars}")
+    from app import create_app
+    import api, common
+
+    app = create_app()
+    app.config.update(RENDER_CACHE="off")
+    with app.app_context():
+        common.ensure_seeded(args.entries, body_chars=args.body_chars)
+    c = app.test_client()
+    cases = [
+        ("html", ["/", "/?page=2"]),
+        ("api all fields", [f"/api/v1/entries?fields={','.join(api.FIELDS)}"]),
+        ("api id,title,created_at", ["/api/v1/entries?fields=id,title,created_at"]),
+    ]
+    codings = ["identity", "gzip"] + (["br"] if api.brotli is not None else [])
+    print(f"{'case':<26}{'coding':>9}{'bytes':>10}{'ms':>8}")
+    for name, urls in cases:
+        for coding in codings:
+            headers = {"Accept-Encoding": coding}
+            size = sum(len(c.get(u, headers=headers).data) for u in urls)
+            ms = timed(lambda: [c.get(u, headers=headers) for u in urls], args.repeat)
+            print(f"{name:<26}{coding:>9}{size:>10}{ms:>8.2f}")
+    url = cases[-1][1][0]
+    tag = c.get(url).headers["ETag"]
+    headers = {"If-None-Match": tag}
+    r = c.get(url, headers=headers)
+    ms = timed(lambda: c.get(url, headers=headers), args.repeat)
+    print(f"{'304 revalidate':<26}{'-':>9}{len(r.data):>10}{ms:>8.2f}  (status {r.status_code})")
+
+
+if __name__ == "__main__":
+    main()
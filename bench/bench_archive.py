@@ -0,0 +1,79 @@
+"""日付のアーカイブ: entry_days（集計表）と、その場での GROUP BY の比較
+
+例: python bench/bench_archive.py --entries 1000000 --repeat 10
+1分おきの日記を --entries 件（半分は非公開、10 人に分ける）入れ、
+  - 年のページ: 年ごとの件数 + その年の日ごとの件数（ヒートマップ）
+  - 月のページ: その月の日ごとの件数
+  - 本人の年のページ（user 1 の範囲）
+を、created_at を JST の日付にして GROUP BY する場合と entry_days を読む場合で比べる。
+最後に /archive/<年> の1リクエスト全体の時間も出す。
+"""
+import argparse
+from datetime import datetime
+
+from common import use_temp_db, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=1_000_000)
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    use_temp_db(f"archive_{args.entries}")
+    from sqlalchemy import func
+    from app import create_app
+    from models import db, Entry
+    import archive, common, counts
+
+    app = create_app()
+    app.config.update(RENDER_CACHE="off")
+    with app.app_context():
+        common.ensure_seeded(args.entries, body_chars=20,
+                             owner=lambda rnd: (rnd.randint(1, 10), rnd.random() < 0.5))
+        tz = archive.zone()
+        if db.engine.dialect.name == "postgresql":
+            local = func.timezone(app.config["ARCHIVE_TZ"], Entry.created_at)
+            day_expr, year_expr = func.date(local), func.extract("year", local)
+        else:
+            # SQLite は固定の時差で（JST には夏時間が無い）
+            hours = f"{datetime.now(tz).utcoffset().total_seconds() / 3600:+g} hours"
+            day_expr = func.date(Entry.created_at, hours)
+            year_expr = func.strftime("%Y", Entry.created_at, hours)
+
+        def on_the_fly(scope, year, month=None):
+            name, where = counts.scope(scope)
+            start, end = archive.period(year, month)
+            since, until = archive.utc_range(start, end, tz)
+            years = None
+            if month is None:
+                years = db.session.execute(
+                    db.select(year_expr, func.count()).where(where)
+                      .group_by(year_expr)).all()
+            days = db.session.execute(
+                db.select(day_expr, func.count())
+                  .where(where, Entry.created_at >= since, Entry.created_at < until)
+                  .group_by(day_expr)).all()
+            return years, days
+
+        def aggregated(scope, year, month=None):
+            name = counts.scope(scope)[0]
+            years = archive.years(name) if month is None else None
+            return years, archive.day_counts(name, *archive.period(year, month))
+
+        cases = (("year page (public)", (None, 2021)),
+                 ("month page (public)", (None, 2021, 3)),
+                 ("year page (user 1)", (1, 2021)))
+        print(f"{'case':<22}{'GROUP BY ms':>13}{'entry_days ms':>15}")
+        for label, a in cases:
+            slow = timed(lambda: on_the_fly(*a), args.repeat)
+            fast = timed(lambda: aggregated(*a), args.repeat)
+            print(f"{label:<22}{slow:>13.2f}{fast:>15.2f}")
+
+    c = app.test_client()
+    ms = timed(lambda: c.get("/archive/2021"), args.repeat)
+    print(f"GET /archive/2021: {ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
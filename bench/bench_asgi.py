@@ -0,0 +1,155 @@
+"""同時接続数を増やしたときの WSGI（gunicorn gthread）と ASGI（uvicorn + asgi.py）
+
+例: python bench/bench_asgi.py --workers 2 --threads 4 -c 8 64 256 -d 10
+同じ DB・同じプロセス数で両方を起動し、一覧と詳細（半々）を読み続ける接続を
+-c 本ずつ張って rps / p50 / p99 / エラー数を比べる。
+--slow N で、大きな画像をゆっくり受け取る（--slow-rate KB/s）接続を N 本
+混ぜる。WSGI では送り終わるまでスレッドが1本ずつ塞がる。
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from common import ROOT
+from bench_startup import free_port
+from loadtest import Client
+
+BIG = "slow-client-test.bin"
+# /uploads は参照している日記が見られるときだけ返すので、公開の日記から参照させる
+REFERENCE_BIG = ("from app import create_app; from models import db, Entry; "
+                 "app = create_app(); app.app_context().push(); "
+                 f"db.session.add(Entry(title='big', body='', image_path='{BIG}')); "
+                 "db.session.commit()")
+
+
+def start(kind, env, args, port):
+    if kind == "wsgi":
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+               "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+               "--threads", str(args.threads), "--access-logfile", "/dev/null", "app:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(args.workers),
+               "--no-access-log", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{kind} が起動しません")
+
+
+async def slow_download(port, rate_kb, deadline, received):
+    """1本の接続で大きなファイルをゆっくり読む（遅い回線のクライアント）。"""
+    while time.perf_counter() < deadline:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            writer.write(f"GET /uploads/{BIG} HTTP/1.1\r\nHost: x\r\n"
+                         "Connection: close\r\n\r\n".encode())
+            await writer.drain()
+            while time.perf_counter() < deadline:
+                chunk = await reader.read(1024)
+                if not chunk:
+                    break
+                received[0] += len(chunk)
+                await asyncio.sleep(1 / rate_kb)
+        finally:
+            writer.close()
+
+
+async def run(port, args, conns, n_entries):
+    deadline = 0.0
+    lat, errors, received = [], 0, [0]
+
+    async def read_loop(i):
+        nonlocal errors
+        rnd = random.Random(i)
+        c = Client("127.0.0.1", port)
+        await ready.wait()
+        while time.perf_counter() < deadline:
+            path = "/" if rnd.random() < 0.5 else f"/entry/{rnd.randint(1, n_entries)}"
+            t0 = time.perf_counter()
+            try:
+                status, _, _ = await c.request("GET", path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                errors += 1
+                await asyncio.sleep(0.01)
+                continue
+            if time.perf_counter() < deadline:
+                if status == 200:
+                    lat.append((time.perf_counter() - t0) * 1000)
+                else:
+                    errors += 1
+
+    ready = asyncio.Event()
+    tasks = [asyncio.create_task(read_loop(i)) for i in range(conns)]
+    # 遅いクライアントは先に受信を始めさせておく
+    tasks += [asyncio.create_task(slow_download(
+        port, args.slow_rate, time.perf_counter() + args.duration + 2, received))
+        for _ in range(args.slow)]
+    await asyncio.sleep(0.5)
+    deadline = time.perf_counter() + args.duration
+    ready.set()
+    # 時間内に返らなかったリクエストは数えずに打ち切る
+    await asyncio.sleep(args.duration)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    lat.sort()
+    p = lambda q: lat[min(len(lat) - 1, int(len(lat) * q))] if lat else float("nan")
+    return (len(lat) / args.duration, statistics.median(lat) if lat else 0, p(0.99),
+            errors, received[0] / 1024 / (args.duration + 0.5))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("-c", "--connections", type=int, nargs="+", default=[8, 64, 256])
+    ap.add_argument("-d", "--duration", type=float, default=10)
+    ap.add_argument("--seed", type=int, default=2000, help="投入する日記の件数")
+    ap.add_argument("--slow", type=int, default=0, help="ゆっくり画像を受け取る接続数")
+    ap.add_argument("--slow-rate", type=float, default=64, help="その受信速度（KB/s）")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_asgi_")
+    base = dict(os.environ, DB_URL=os.environ.get("DB_URL", f"sqlite:///{tmp}/asgi.db"),
+                UPLOAD_FOLDER=f"{tmp}/uploads", RATE_LIMIT_STORE="off")
+    os.makedirs(f"{tmp}/uploads")
+    with open(f"{tmp}/uploads/{BIG}", "wb") as f:
+        f.write(os.urandom(64 * 1024 * 1024))
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT,
+                   env=base, capture_output=True, check=True)
+    subprocess.run([sys.executable, "bench/loadtest.py", "--seed", str(args.seed)],
+                   cwd=ROOT, env=base, capture_output=True, check=True)
+    subprocess.run([sys.executable, "-c", REFERENCE_BIG], cwd=ROOT, env=base,
+                   capture_output=True, check=True)
+
+    print(f"{'mode':<6}{'conns':>7}{'slow':>6}{'rps':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'slow KB/s':>11}")
+    for kind in ("wsgi", "asgi"):
+        for conns in args.connections:
+            port = free_port()
+            proc = start(kind, base, args, port)
+            try:
+                rps, p50, p99, errors, slow_kb = asyncio.run(run(port, args, conns, args.seed))
+            finally:
+                proc.send_signal(signal.SIGTERM)
+                proc.wait(10)
+            print(f"{kind:<6}{conns:>7}{args.slow:>6}{rps:>9.1f}{p50:>9.1f}{p99:>9.1f}"
+                  f"{errors:>8}{slow_kb:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
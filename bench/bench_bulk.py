@@ -0,0 +1,60 @@
+"""一括操作: 1件ずつの削除・公開設定の変更と bulk.py の比較
+
+例: python bench/bench_bulk.py --entries 20000 --select 500
+user 1 の日記を --entries 件入れ、--select 件を
+  - 1件ずつ: delete_entry / update_entry と同じく読み込み → 削除（変更）→ コミット
+  - bulk.py: 500 件ずつの DELETE / UPDATE ... WHERE id IN (...) を1トランザクション
+で処理した時間を比べる（別々の id の範囲を使う）。
+"""
+import argparse
+import time
+
+from common import use_temp_db, ensure_seeded
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=20_000)
+    ap.add_argument("--select", type=int, default=500)
+    args = ap.parse_args()
+
+    use_temp_db(f"bulk_{args.entries}")
+    from app import create_app
+    from models import db, Entry
+    import bulk
+
+    app = create_app()
+    with app.app_context():
+        ensure_seeded(args.entries, body_chars=200, owner=lambda rnd: (1, True))
+        ranges = [list(range(1 + i * args.select, 1 + (i + 1) * args.select))
+                  for i in range(4)]
+
+        def one_by_one_delete(ids):
+            for entry_id in ids:
+                e = db.session.execute(db.select(Entry).where(
+                    Entry.id == entry_id, Entry.user_id == 1)).scalar_one()
+                db.session.delete(e)
+                db.session.commit()
+
+        def one_by_one_private(ids):
+            for entry_id in ids:
+                e = db.session.execute(db.select(Entry).where(
+                    Entry.id == entry_id, Entry.user_id == 1)).scalar_one()
+                e.is_public = False
+                db.session.commit()
+
+        cases = (("delete", one_by_one_delete, lambda ids: bulk.delete(ids, 1)),
+                 ("make private", one_by_one_private,
+                  lambda ids: bulk.set_public(ids, 1, False)))
+        print(f"{args.select} of {args.entries} entries")
+        print(f"{'op':<14}{'one by one ms':>15}{'bulk ms':>10}")
+        for i, (label, slow, fast) in enumerate(cases):
+            t0 = time.perf_counter(); slow(ranges[2 * i])
+            slow_ms = (time.perf_counter() - t0) * 1000
+            t0 = time.perf_counter(); fast(ranges[2 * i + 1])
+            fast_ms = (time.perf_counter() - t0) * 1000
+            print(f"{label:<14}{slow_ms:>15.1f}{fast_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""一覧で本文を読まない効果（deferred の body / search_tokens と抜粋列）
+
+例: python bench/bench_deferred.py --entries 20000 --body-chars 4000 --repeat 20
+本文が数 KB ある日記で、一覧の1ページ（10件）と検索を
+  - full rows: 以前と同じく全列（本文・検索用トークン込み）を読む
+  - deferred: 今の一覧（抜粋と文字数だけ）
+で比べる。SQL が返したバイト数（行の値の合計）・クエリ時間・そのときのメモリ確保量（tracemalloc の peak）と、
+一覧ページ全体を描画したときのリクエストあたりの peak を出す。
+描画キャッシュは切る。
+"""
+import argparse
+import tracemalloc
+
+from common import use_temp_db, timed
+
+
+def row_bytes(rows):
+    total = 0
+    for row in rows:
+        for v in row:
+            if isinstance(v, str):
+                total += len(v.encode())
+            elif v is not None:
+                total += 8
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=20_000)
+    ap.add_argument("--body-chars", type=int, default=4000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    use_temp_db(f"deferred_{args.entries}_{args.body_chars}")
+    from sqlalchemy.orm import undefer
+    from app import create_app
+    from models import db, Entry
+    import common, pagination, search
+
+    app = create_app()
+    app.config.update(RENDER_CACHE="off")
+    with app.app_context():
+        common.ensure_seeded(args.entries, body_chars=args.body_chars)
+    full = [undefer(Entry.body), undefer(Entry.search_tokens)]
+
+    def page(options, q=""):
+        stmt = db.select(Entry).where(Entry.is_public).options(*options)
+        ranking = []
+        if q:
+            stmt, ranking = search.apply_search(stmt, q)
+        stmt = stmt.order_by(*ranking, *pagination.ORDER).limit(10)
+        return stmt
+
+    print(f"{'query':<10}{'mode':<10}{'bytes':>10}{'ms':>8}{'peak KiB':>10}")
+    with app.app_context():
+        for q in ("", "天気"):
+            for mode, options in (("full rows", full), ("deferred", [])):
+                stmt = page(options, q)
+                raw = db.session.execute(stmt).all()
+                size = row_bytes(tuple(getattr(r[0], c.key) for c in Entry.__table__.columns
+                                       if c.key in r[0].__dict__) for r in raw)
+                ms = timed(lambda: db.session.execute(stmt).scalars().all(), args.repeat)
+                db.session.expunge_all()
+                tracemalloc.start()
+                db.session.execute(stmt).scalars().all()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                db.session.expunge_all()
+                print(f"{q or 'index':<10}{mode:<10}{size:>10}{ms:>8.2f}{peak / 1024:>10.0f}")
+
+    # ページ全体（今のアプリ）を描画したときのメモリ
+    c = app.test_client()
+    for url in ("/", "/?q=天気"):
+        c.get(url)
+        tracemalloc.start()
+        c.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"GET {url:<12} peak {peak / 1024:.0f} KiB per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""ログインが集中しているときのログイン処理量と、他のルートの p99
+
+例: python bench/bench_login.py --workers 2 --threads 4 --login-rate 40 -d 10
+gunicorn を設定を変えて起動し直し、毎秒 --login-rate 回のログインを送るクライアント
+（--flood 本に分ける。応答を待たずに一定の間隔で送る攻撃側を想定）と、一覧（/）を
+読み続けるクライアント（--readers 本）を同時に走らせる。
+  - no flood: ログインなし（一覧の基準値）
+  - inline unbounded: リクエストのスレッドで照合、待ちの上限なし（以前の動き）
+  - inline bounded: 同じく、照合待ちは PASSWORD_VERIFY_MAX_PENDING まで（超えたら 503）
+  - pool: 子プロセス（PASSWORD_VERIFY_NICE、既定 5）で照合
+  - rate limited: pool + LOGIN_RATE_IP / LOGIN_RATE_USER（同じ IP からなので大半は 429）
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter as Tally
+
+from common import BENCH_USER, ROOT
+from bench_startup import free_port
+from loadtest import Client, csrf_token, form
+
+MODES = [
+    ("no flood", {}, False),
+    ("inline unbounded", {"PASSWORD_VERIFY_WORKERS": "0",
+                          "PASSWORD_VERIFY_MAX_PENDING": "100000"}, True),
+    ("inline bounded", {"PASSWORD_VERIFY_WORKERS": "0"}, True),
+    ("pool", {"PASSWORD_VERIFY_WORKERS": "1"}, True),
+    ("rate limited", {"PASSWORD_VERIFY_WORKERS": "1", "RATE_LIMIT_STORE": "memory"}, True),
+]
+
+
+def start(env, args, port):
+    cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+           "-b", f"127.0.0.1:{port}", "-w", str(args.workers),
+           "--threads", str(args.threads), "--access-logfile", "/dev/null", "app:app"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("gunicorn が起動しません")
+
+
+async def run(port, args, flood):
+    deadline = 0.0
+    statuses, reads = Tally(), []
+
+    async def login_loop(i):
+        c = Client("127.0.0.1", port)
+        token = await csrf_token(c, "/login")
+        body, ctype = form({"username": BENCH_USER[0], "password": BENCH_USER[1],
+                            "csrf_token": token})
+        interval = args.flood / args.login_rate
+        await ready.wait()
+        next_at = time.perf_counter() + interval * i / args.flood
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            next_at += interval
+            try:
+                status, _, _ = await c.request("POST", "/login", body, ctype)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                status = "error"
+            if time.perf_counter() < deadline:
+                statuses[status] += 1
+
+    async def read_loop():
+        c = Client("127.0.0.1", port)
+        await ready.wait()
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            try:
+                status, _, _ = await c.request("GET", "/")
+            except (ConnectionError, asyncio.IncompleteReadError):
+                continue
+            if status == 200 and time.perf_counter() < deadline:
+                reads.append((time.perf_counter() - t0) * 1000)
+
+    ready = asyncio.Event()
+    tasks = [asyncio.create_task(read_loop()) for _ in range(args.readers)]
+    if flood:
+        tasks += [asyncio.create_task(login_loop(i)) for i in range(args.flood)]
+    await asyncio.sleep(0.5)   # CSRF トークンの取得などは計測に含めない
+    deadline = time.perf_counter() + args.duration
+    ready.set()
+    # 時間内に返らなかったリクエストは数えずに打ち切る（接続は gunicorn ごと閉じる）
+    await asyncio.sleep(args.duration)
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    reads.sort()
+    p = lambda q: reads[min(len(reads) - 1, int(len(reads) * q))] if reads else float("nan")
+    return statuses, len(reads) / args.duration, statistics.median(reads) if reads else 0, p(0.99)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--login-rate", type=float, default=40, help="毎秒のログイン試行数")
+    ap.add_argument("--flood", type=int, default=32, help="ログインを送る接続数")
+    ap.add_argument("--readers", type=int, default=4, help="一覧を読む接続数")
+    ap.add_argument("-d", "--duration", type=float, default=10)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_login_")
+    base = dict(os.environ, DB_URL=os.environ.get("DB_URL", f"sqlite:///{tmp}/login.db"),
+                UPLOAD_FOLDER=f"{tmp}/uploads", RENDER_CACHE="off",
+                RATE_LIMIT_STORE="off")
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT,
+                   env=base, capture_output=True, check=True)
+    subprocess.run([sys.executable, "bench/loadtest.py", "--seed", "1000"], cwd=ROOT,
+                   env=base, capture_output=True, check=True)
+
+    print(f"{'mode':<18}{'login/s':>9}{'302':>7}{'429':>7}{'503':>7}"
+          f"{'/ rps':>8}{'/ p50 ms':>10}{'/ p99 ms':>10}")
+    for name, env, flood in MODES:
+        port = free_port()
+        proc = start(dict(base, **env), args, port)
+        try:
+            statuses, rps, p50, p99 = asyncio.run(run(port, args, flood))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(10)
+        logins = statuses[302] / args.duration
+        print(f"{name:<18}{logins:>9.1f}{statuses[302]:>7}{statuses[429]:>7}"
+              f"{statuses[503]:>7}{rps:>8.1f}{p50:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""所有者で絞った一覧・件数・検索のレイテンシ（ユーザー数が多く、件数が偏る場合）
+
+例: python bench/bench_ownership.py --entries 200000 --users 2000
+ユーザーごとの件数は Zipf 分布（上位数人が大半を書く）。件数の多い人・中央値・
+少ない人について、同じクエリを
+  - owner index: ix_entries_user_created_at_id（user_id, created_at DESC, id DESC）
+  - no owner index: 全体の (created_at, id) 索引を新しい順に読みながら user_id で捨てる
+    （所有者の索引が無かった場合。user_id + 0 で索引を使わせずに再現する）
+で比べる。件数は counters の行（counts.scope）と COUNT(*) を比べる。
+検索は全文索引のヒットから絞る（fts）と本人の行から引く（narrow）の両方を測る。
+アプリは本人の件数が SEARCH_NARROW_MAX 以下なら narrow を使う。
+"""
+import argparse
+
+from common import use_temp_db, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=200_000)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--skew", type=float, default=1.1, help="Zipf の指数")
+    ap.add_argument("--private", type=float, default=0.2, help="非公開の割合")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    use_temp_db(f"ownership_{args.entries}_{args.users}")
+    from sqlalchemy import func
+    from werkzeug.security import generate_password_hash
+    from app import create_app
+    from models import db, Entry, User
+    import common, counts, pagination, search
+
+    app = create_app()
+    with app.app_context():
+        if not db.session.scalar(db.select(func.count()).select_from(Entry)):
+            pw = generate_password_hash("bench")
+            db.session.execute(db.insert(User), [
+                {"username": f"user{i}", "password_hash": pw} for i in range(args.users)])
+            ids = db.session.scalars(db.select(User.id).order_by(User.id)).all()
+            weights = [1 / (rank + 1) ** args.skew for rank in range(len(ids))]
+
+            def owner(rnd):
+                return rnd.choices(ids, weights)[0], rnd.random() >= args.private
+            common.seed(args.entries, body_chars=100, owner=owner)
+
+        per_user = db.session.execute(
+            db.select(Entry.user_id, func.count()).group_by(Entry.user_id)
+              .order_by(func.count().desc())).all()
+        picks = [("heaviest", per_user[0]), ("p90", per_user[len(per_user) // 10]),
+                 ("median", per_user[len(per_user) // 2]), ("lightest", per_user[-1])]
+        print(f"{len(per_user)} users with entries, top user {per_user[0][1]} "
+              f"/ {args.entries} entries")
+
+        def first_page(uid, use_index=True):
+            owner = Entry.user_id if use_index else Entry.user_id + 0
+            stmt = db.select(Entry).where(owner == uid) \
+                     .order_by(*pagination.ORDER).limit(10)
+            return db.session.execute(stmt).scalars().all()
+
+        def search_page(uid, narrow, q="天気"):
+            stmt, ranking = search.apply_search(
+                db.select(Entry).where(Entry.user_id == uid), q, narrow)
+            return db.session.execute(
+                stmt.order_by(*ranking, *pagination.ORDER).limit(10)).scalars().all()
+
+        def count_all(uid):
+            return db.session.scalar(db.select(func.count()).select_from(Entry)
+                                       .where(Entry.user_id == uid))
+
+        narrow_max = app.config["SEARCH_NARROW_MAX"]
+        print(f"\n{'user':<10}{'entries':>8}{'page ms':>10}{'no idx ms':>11}"
+              f"{'count ms':>10}{'COUNT(*) ms':>13}{'fts ms':>9}{'narrow ms':>11}")
+        for name, (uid, n) in picks:
+            scope = counts.scope(uid)
+            counts.scope_total(scope)   # counters の行を作っておく
+            db.session.expunge_all()
+            t_page = timed(lambda: first_page(uid), args.repeat)
+            t_noidx = timed(lambda: first_page(uid, use_index=False), args.repeat)
+            t_count = timed(lambda: counts.scope_total(scope), args.repeat)
+            t_full = timed(lambda: count_all(uid), args.repeat)
+            t_fts = timed(lambda: search_page(uid, False), args.repeat)
+            # 件数の多い人の narrow は遅すぎるので測らない
+            t_narrow = (timed(lambda: search_page(uid, True), args.repeat)
+                        if n <= narrow_max * 20 else float("nan"))
+            mark = "*" if n <= narrow_max else " "
+            print(f"{name:<10}{n:>8}{t_page:>10.2f}{t_noidx:>11.2f}"
+                  f"{t_count:>10.2f}{t_full:>13.2f}{t_fts:>9.2f}{t_narrow:>10.2f}{mark}")
+        print(f"\n* アプリが narrow を選ぶ（SEARCH_NARROW_MAX={narrow_max}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""深いページの取得レイテンシ比較: OFFSET とキーセット（カーソル）
+
+例: python bench/bench_pagination.py --entries 200000
+"""
+import argparse
+
+from common import use_temp_db, ensure_seeded, timed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=200_000)
+    ap.add_argument("--per-page", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    use_temp_db("pagination")
+    from app import create_app
+    from models import db, Entry
+    import pagination
+
+    app = create_app()
+    with app.app_context():
+        ensure_seeded(args.entries, body_chars=100)
+        per = args.per_page
+        last_page = args.entries // per
+        print(f"{'page':>8}{'OFFSET ms':>12}{'keyset ms':>12}")
+        for page in (1, 10, 100, 1000, last_page // 2, last_page):
+            if page < 1 or page > last_page:
+                continue
+            offset = (page - 1) * per
+
+            def by_offset():
+                stmt = db.select(Entry).order_by(*pagination.ORDER) \
+                         .limit(per).offset(offset)
+                return db.session.execute(stmt).scalars().all()
+
+            # 直前ページ最後の行をカーソルにする（計測外で求めておく）
+            cursor = None
+            if offset:
+                prev = db.session.execute(
+                    db.select(Entry).order_by(*pagination.ORDER)
+                      .limit(1).offset(offset - 1)).scalar_one()
+                cursor = (prev.created_at, prev.id)
+
+            def by_keyset():
+                return pagination.keyset_page(db.session, db.select(Entry),
+                                              per, after=cursor)[0]
+
+            assert [e.id for e in by_offset()] == [e.id for e in by_keyset()]
+            db.session.expunge_all()
+            t_off = timed(by_offset, args.repeat)
+            t_key = timed(by_keyset, args.repeat)
+            print(f"{page:>8}{t_off:>12.2f}{t_key:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
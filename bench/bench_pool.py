@@ -0,0 +1,127 @@
+"""同時読み書きのスループット比較: ドライバ既定 と WAL + 調整済み PRAGMA
+
+gunicorn の複数ワーカーを模して、別プロセスが同じ SQLite ファイルに対して
+一覧・詳細の読み込みと日記の追加を並行で行い、秒間処理数とロック失敗数を数える。
+描画キャッシュは切って DB の差だけを見る。
+
+例: python bench/bench_pool.py --procs 4 --seconds 10 --write-ratio 0.2
+PostgreSQL で試すときは DB_URL を指定する（PRAGMA の差は無く、プールの設定だけ効く）。
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+
+from common import ensure_seeded
+
+CONFIGS = {
+    # SQLite の既定値（journal_mode は DB ファイルに残るので明示して戻す）
+    "default": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL",
+                "SQLITE_BUSY_TIMEOUT_MS": "", "SQLITE_MMAP_MB": ""},
+    # .env.example の値
+    "tuned": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL",
+              "SQLITE_BUSY_TIMEOUT_MS": "5000", "SQLITE_MMAP_MB": "256"},
+}
+
+
+def worker(env, seconds, write_ratio, n_entries, seed, out):
+    os.environ.update(env)
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from models import db, Entry
+
+    rnd = random.Random(seed)
+    reads = writes = errors = 0
+    try:
+        app = create_app()
+        c = app.test_client()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            try:
+                if rnd.random() < write_ratio:
+                    with app.app_context():
+                        db.session.add(Entry(title="bench", body="x" * 200))
+                        db.session.commit()
+                    writes += 1
+                else:
+                    if rnd.random() < 0.5:
+                        r = c.get("/")
+                    else:
+                        r = c.get(f"/entry/{rnd.randint(1, n_entries)}")
+                    if r.status_code >= 500:
+                        errors += 1
+                    else:
+                        reads += 1
+            except OperationalError:
+                errors += 1
+    finally:
+        # 親が待ち続けないよう、失敗しても結果は返す
+        out.put((reads, writes, errors))
+
+
+def prepare(db_url, n_entries):
+    os.environ["DB_URL"] = db_url
+    from app import create_app
+    with create_app().app_context():
+        ensure_seeded(n_entries, body_chars=200)
+
+
+def set_journal_mode(db_url, mode):
+    # 切り替えには排他ロックが要るので、ワーカーを起動する前に親で済ませる
+    from sqlalchemy import create_engine, text
+    engine = create_engine(db_url)
+    with engine.connect() as conn:
+        conn.execute(text(f"PRAGMA journal_mode={mode}"))
+    engine.dispose()
+
+
+def run(name, args, db_url):
+    env = dict(CONFIGS[name], DB_URL=db_url, RENDER_CACHE="off",
+               IMAGE_PROCESSING="off")
+    if db_url.startswith("sqlite"):
+        set_journal_mode(db_url, env.pop("SQLITE_JOURNAL_MODE"))
+        env["SQLITE_JOURNAL_MODE"] = ""
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(env, args.seconds, args.write_ratio,
+                                              args.entries, i, out))
+             for i in range(args.procs)]
+    for p in procs:
+        p.start()
+    totals = [0, 0, 0]
+    for _ in procs:
+        for i, v in enumerate(out.get()):
+            totals[i] += v
+    for p in procs:
+        p.join()
+    reads, writes, errors = totals
+    return {"config": name, "reads_per_s": reads / args.seconds,
+            "writes_per_s": writes / args.seconds, "errors": errors}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=10_000)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--write-ratio", type=float, default=0.2)
+    args = ap.parse_args()
+
+    db_url = os.environ.get("DB_URL")
+    if db_url is None:
+        db_url = f"sqlite:///{tempfile.mkdtemp(prefix='bench_pool_')}/bench.db"
+    # 親が接続を持ったままだと journal_mode を切り替えられないので、投入も子で行う
+    p = mp.get_context("spawn").Process(target=prepare, args=(db_url, args.entries))
+    p.start(); p.join()
+
+    print(f"{'config':<10}{'reads/s':>10}{'writes/s':>10}{'errors':>8}")
+    for name in CONFIGS:
+        r = run(name, args, db_url)
+        print(f"{name:<10}{r['reads_per_s']:>10.0f}{r['writes_per_s']:>10.0f}"
+              f"{r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""編集履歴: 差分 + 定期的な全文（revisions.py）と、毎回全文を残す場合の比較
+
+例: python bench/bench_revisions.py --edits 500 --lines 80 --every 20
+--lines 行の日記を1件作り、毎回数行だけ書き換える編集を --edits 回コミットする。
+  - 保存量: entry_revisions.data の合計と、全文をそのまま / zlib で残した場合
+  - 復元: 版を1つ読む時間（直前の全文から差分を当てる）と、全文の行を1つ読む時間
+  - 書き込み: 編集1回のコミット時間（履歴を取る場合と取らない場合）
+"""
+import argparse
+import random
+import zlib
+
+from common import use_temp_db, timed, fake_body
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--edits", type=int, default=500)
+    ap.add_argument("--lines", type=int, default=80)
+    ap.add_argument("--every", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+
+    use_temp_db("revisions")
+    from sqlalchemy import event, func
+    from sqlalchemy.orm import Session
+    from app import create_app
+    from models import db, Entry, EntryRevision
+    import revisions
+
+    app = create_app()
+    app.config.update(REVISION_SNAPSHOT_EVERY=args.every)
+    with app.app_context():
+        db.create_all()
+
+        def run(record):
+            """同じ乱数で同じ編集を繰り返し、(entry_id, 各版の本文, コミット時間の中央値)"""
+            rnd = random.Random(42)
+            lines = [fake_body(rnd, 50) for _ in range(args.lines)]
+            e = Entry(title="履歴", body="\n".join(lines))
+            db.session.add(e); db.session.commit()
+            bodies = [e.body]
+
+            def edit():
+                for _ in range(rnd.randint(1, 3)):
+                    lines[rnd.randrange(len(lines))] = fake_body(rnd, 50)
+                if rnd.random() < 0.2:
+                    lines.insert(rnd.randrange(len(lines)), fake_body(rnd, 50))
+                e.body = "\n".join(lines)
+                db.session.commit()
+                bodies.append(e.body)
+
+            if not record:
+                event.remove(Session, "before_flush", revisions._record_revisions)
+            try:
+                return e.id, bodies, timed(edit, args.edits)
+            finally:
+                if not record:
+                    event.listen(Session, "before_flush", revisions._record_revisions)
+
+        without = run(False)[2]
+        entry_id, bodies, with_history = run(True)
+        rnd = random.Random(1)
+
+        stored = db.session.scalar(db.select(func.sum(func.length(EntryRevision.data))))
+        raw = sum(len(b.encode()) for b in bodies)
+        packed = sum(len(zlib.compress(b.encode())) for b in bodies)
+        print(f"{len(bodies)} versions of ~{len(bodies[-1])} chars")
+        print(f"storage: full copies {raw / 1024:.0f}KB, zlib full copies {packed / 1024:.0f}KB, "
+              f"deltas {stored / 1024:.0f}KB")
+
+        # 全文の表（比較用）: seq ごとに zlib で圧縮した本文
+        full = db.Table("bench_full_copies", db.metadata,
+                        db.Column("seq", db.Integer, primary_key=True),
+                        db.Column("data", db.LargeBinary), extend_existing=True)
+        full.drop(db.engine, checkfirst=True); full.create(db.engine)
+        db.session.execute(db.insert(full), [{"seq": i, "data": zlib.compress(b.encode())}
+                                             for i, b in enumerate(bodies, 1)])
+        db.session.commit()
+
+        seqs = [rnd.randint(1, len(bodies)) for _ in range(args.repeat)]
+        worst = args.every * (len(bodies) // args.every)   # 全文の直前 = 差分が最も多い版
+        it = iter(seqs * 2)
+        delta_ms = timed(lambda: revisions.load(entry_id, next(it)), args.repeat)
+        it = iter(seqs * 2)
+        full_ms = timed(lambda: zlib.decompress(db.session.scalar(
+            db.select(full.c.data).where(full.c.seq == next(it)))).decode(), args.repeat)
+        worst_ms = timed(lambda: revisions.load(entry_id, worst), args.repeat)
+        assert revisions.load(entry_id, worst)[1] == bodies[worst - 1]
+        print(f"load a version: full copy {full_ms:.2f}ms, delta {delta_ms:.2f}ms "
+              f"(worst case {args.every - 1} deltas: {worst_ms:.2f}ms)")
+        print(f"commit an edit: without history {without:.2f}ms, with history {with_history:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""検索レイテンシ比較: LIKE '%q%' と全文検索（FTS5 / tsvector）
+
+例: python bench/bench_search.py --entries 100000
+DB_URL を指定しなければ一時 SQLite ファイルに投入して計測する。
+"""
+import argparse
+
+from common import use_temp_db, ensure_seeded, timed
+
+QUERIES = ["天気", "温泉", "カレー", "ランニング 週末", "猫"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    use_temp_db("search")
+    from app import create_app
+    from models import db, Entry
+    from sqlalchemy import func, or_
+    import search
+
+    app = create_app()
+    with app.app_context():
+        ensure_seeded(args.entries)
+
+        def run(stmt, order):
+            count = db.select(func.count()).select_from(stmt.subquery())
+            db.session.scalar(count)
+            db.session.execute(stmt.order_by(*order, Entry.created_at.desc())
+                                   .limit(10)).scalars().all()
+
+        print(f"{'query':<18}{'LIKE ms':>10}{'FTS ms':>10}{'speedup':>10}")
+        for q in QUERIES:
+            like = f"%{q.lower()}%"
+            like_stmt = db.select(Entry).where(or_(
+                func.lower(Entry.title).like(like),
+                func.lower(Entry.body).like(like)))
+            fts_stmt, ranking = search.apply_search(db.select(Entry), q)
+            t_like = timed(lambda: run(like_stmt, []), args.repeat)
+            t_fts = timed(lambda: run(fts_stmt, ranking), args.repeat)
+            print(f"{q:<18}{t_like:>10.1f}{t_fts:>10.1f}{t_like / t_fts:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
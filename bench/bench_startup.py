@@ -0,0 +1,140 @@
+"""起動時間とワーカーあたりのメモリ
+
+例: python bench/bench_startup.py --repeat 5 --workers 4
+  - cold start: 新しいプロセスで `import app` して app を作るまでの時間と最大 RSS
+  - gunicorn: preload（GUNICORN_PRELOAD）の有無でワーカーの RSS / PSS / USS（/proc/<pid>/smaps_rollup）
+DB_AUTO_CREATE=1（create_all する）と 0（Alembic に任せる）を比べる。
+--importtime で、どの import に時間がかかっているか（python -X importtime）を出す。
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from common import ROOT
+
+CHILD = """
+import resource, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.app
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+"""
+
+
+def cold_start(env, repeat):
+    imports, boots, rss = [], [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout.split()
+        imports.append(float(out[0]) * 1000)
+        boots.append(float(out[1]) * 1000)
+        rss.append(float(out[2]))
+    return statistics.median(imports), statistics.median(boots), statistics.median(rss)
+
+
+def import_profile(env, top=15):
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app; app.app"],
+                         cwd=ROOT, env=env, capture_output=True, text=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # app.py が直接 import したもの（深さ 1）だけ
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative), name.strip()))
+    for us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{name:<30}{us / 1000:>8.1f} ms")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def smaps(pid):
+    vals = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                vals[parts[0].rstrip(":")] = int(parts[1])
+    uss = vals.get("Private_Clean", 0) + vals.get("Private_Dirty", 0)
+    return vals.get("Rss", 0) / 1024, vals.get("Pss", 0) / 1024, uss / 1024
+
+
+def gunicorn_memory(env, workers, preload):
+    port = free_port()
+    args = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+            "-b", f"127.0.0.1:{port}", "-w", str(workers), "--threads", "1",
+            "--access-logfile", "/dev/null", "app:app"]
+    env = dict(env, GUNICORN_PRELOAD="1" if preload else "0")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    try:
+        # 全ワーカーが応答するまで待つ
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - t0
+        # 各ワーカーに何度か当てて、実際に使われた状態で測る
+        for _ in range(workers * 10):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+        kids = subprocess.run(["pgrep", "-P", str(proc.pid)], capture_output=True,
+                              text=True).stdout.split()
+        stats = [smaps(int(k)) for k in kids]
+        return ready * 1000, [statistics.mean(s[i] for s in stats) for i in range(3)]
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(10)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--importtime", action="store_true")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    db_url = os.environ.get("DB_URL", f"sqlite:///{tmp}/startup.db")
+    base = dict(os.environ, DB_URL=db_url, UPLOAD_FOLDER=f"{tmp}/uploads",
+                PYTHONDONTWRITEBYTECODE="0")
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT,
+                   env=base, capture_output=True, check=True)
+
+    if args.importtime:
+        import_profile(dict(base, DB_AUTO_CREATE="0"))
+        return
+
+    print(f"{'mode':<22}{'import ms':>10}{'boot ms':>10}{'max RSS MB':>12}")
+    for auto in ("1", "0"):
+        env = dict(base, DB_AUTO_CREATE=auto)
+        imp, boot, rss = cold_start(env, args.repeat)
+        print(f"{'DB_AUTO_CREATE=' + auto:<22}{imp:>10.0f}{boot:>10.0f}{rss:>12.1f}")
+
+    print(f"\n{'gunicorn':<22}{'ready ms':>10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}")
+    for preload in (False, True):
+        env = dict(base, DB_AUTO_CREATE="0")
+        ready, (rss, pss, uss) = gunicorn_memory(env, args.workers, preload)
+        name = f"{args.workers} workers" + (" preload" if preload else "")
+        print(f"{name:<22}{ready:>10.0f}{rss:>10.1f}{pss:>10.1f}{uss:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
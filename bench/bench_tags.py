@@ -0,0 +1,82 @@
+"""タグ: タグで絞り込んだ一覧・件数・タグクラウドの時間
+
+例: python bench/bench_tags.py --entries 200000 --repeat 10
+--entries 件（半分は非公開、10 人に分ける）に 0〜3 個のタグを付ける。タグは
+WORDS の 25 個（よく使う）と tag0〜tag199（まれ）で、人気は Zipf 風に偏らせる。
+  - 一覧: /?tag=<タグ> と、タグの代わりに同じ語で検索する /?q=<語>（公開分）
+  - 件数: tag_counts を読む場合と entry_tags を COUNT する場合
+  - タグクラウド: tag_counts の上位 30 件と、entry_tags を GROUP BY する場合
+"""
+import argparse
+import random
+
+from common import use_temp_db, timed, ensure_seeded, WORDS
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=200_000)
+    ap.add_argument("--repeat", type=int, default=10)
+    args = ap.parse_args()
+
+    use_temp_db(f"tags_{args.entries}")
+    from sqlalchemy import func
+    from app import create_app
+    from models import db, Entry, EntryTag, Tag, TagCount
+    import counts, tags
+
+    app = create_app()
+    app.config.update(RENDER_CACHE="off")
+    names = list(WORDS) + [f"tag{i}" for i in range(200)]
+    with app.app_context():
+        ensure_seeded(args.entries, body_chars=100,
+                      owner=lambda rnd: (rnd.randint(1, 10), rnd.random() < 0.5))
+        if not db.session.scalar(db.select(func.count()).select_from(EntryTag)):
+            rnd = random.Random(7)
+            weights = [1 / (i + 1) for i in range(len(names))]
+            ids = tags.resolve(names)
+            tag_ids = [t.id for t in ids]
+            rows = []
+            for entry_id in range(1, args.entries + 1):
+                for tag_id in set(rnd.choices(tag_ids, weights, k=rnd.randint(0, 3))):
+                    rows.append({"entry_id": entry_id, "tag_id": tag_id})
+            for i in range(0, len(rows), 10_000):
+                db.session.execute(db.insert(EntryTag), rows[i:i + 10_000])
+            db.session.commit()
+            tags.rebuild()
+            print(f"tagged: {len(rows)} rows")
+        by_name = dict(db.session.execute(db.select(Tag.name, Tag.id)).all())
+        sizes = dict(db.session.execute(
+            db.select(TagCount.tag_id, TagCount.count)
+              .where(TagCount.scope == counts.PUBLIC)).all())
+        cases = [names[0], names[10], names[-1]]
+
+        print(f"{'tag':<10}{'public':>8}{'count(*) ms':>13}{'tag_counts ms':>15}")
+        for name in cases:
+            tag_id = by_name[name]
+            slow = timed(lambda: db.session.scalar(
+                db.select(func.count()).select_from(Entry)
+                  .join(EntryTag, EntryTag.entry_id == Entry.id)
+                  .where(EntryTag.tag_id == tag_id, Entry.is_public)), args.repeat)
+            fast = timed(lambda: tags.total(counts.PUBLIC, tag_id), args.repeat)
+            print(f"{name:<10}{sizes.get(tag_id, 0):>8}{slow:>13.2f}{fast:>15.2f}")
+
+        slow = timed(lambda: db.session.execute(
+            db.select(Tag.name, func.count())
+              .join(EntryTag, EntryTag.tag_id == Tag.id)
+              .join(Entry, Entry.id == EntryTag.entry_id)
+              .where(Entry.is_public).group_by(Tag.name)
+              .order_by(func.count().desc()).limit(30)).all(), args.repeat)
+        fast = timed(lambda: tags.cloud(counts.PUBLIC), args.repeat)
+        print(f"tag cloud: GROUP BY {slow:.2f} ms, tag_counts {fast:.2f} ms")
+
+    c = app.test_client()
+    print(f"{'tag':<10}{'/?tag= ms':>11}{'/?q= ms':>10}")
+    for name in cases:
+        by_tag = timed(lambda: c.get(f"/?scope=public&tag={name}"), args.repeat)
+        by_search = timed(lambda: c.get(f"/?scope=public&q={name}"), args.repeat)
+        print(f"{name:<10}{by_tag:>11.2f}{by_search:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""テンプレート: ワーカーの最初のリクエストの時間（コンパイル込み）
+
+例: python bench/bench_templates.py --workers 4 --repeat 200
+ワーカーに見立てた新しいプロセスを --workers 個ずつ起動し、各ページの最初の
+1回（テンプレートのコンパイル込み）と2回目以降の中央値を測る。
+  - no cache: 各ワーカーがテンプレートを Jinja からコンパイルする（これまで）
+  - bytecode cache: `flask compile_templates` で入れた TEMPLATE_CACHE_DIR から読む
+最後に、一覧を --repeat 回描画したときの TEMPLATES_AUTO_RELOAD=1（描画のたびに
+テンプレートの更新を stat で確かめる）と 0 の差を見る（描画キャッシュは切る）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, use_temp_db, ensure_seeded, ensure_user, BENCH_USER
+
+PAGES = ["/login", "/", "/entry/1", "/archive", "/new", "/entry/1/edit", "/entry/1/history"]
+
+CHILD = """
+import json, sys, time
+from app import create_app
+pages, repeat = json.loads(sys.argv[1]), int(sys.argv[2])
+app = create_app()
+app.config.update(WTF_CSRF_ENABLED=False, RATE_LIMIT_STORE="off", RENDER_CACHE="off")
+c = app.test_client()
+first = {}
+for url in pages:
+    if url == "/":
+        c.post("/login", data={"username": sys.argv[3], "password": sys.argv[4]})
+    t0 = time.perf_counter()
+    r = c.get(url)
+    first[url] = (time.perf_counter() - t0) * 1000
+    assert r.status_code == 200, (url, r.status_code)
+warm = []
+for _ in range(repeat):
+    t0 = time.perf_counter(); c.get("/"); warm.append((time.perf_counter() - t0) * 1000)
+print(json.dumps({"first": first, "warm": sorted(warm)[len(warm) // 2]}))
+"""
+
+
+def run_worker(env, repeat):
+    out = subprocess.run([sys.executable, "-c", CHILD, json.dumps(PAGES), str(repeat),
+                          *BENCH_USER], cwd=ROOT, env=env, capture_output=True, text=True,
+                         check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    use_temp_db("templates")
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        ensure_user()
+        ensure_seeded(1000, body_chars=300, owner=lambda rnd: (1, True))
+
+    cache = tempfile.mkdtemp(prefix="bench_jinja_")
+    base = dict(os.environ, RATE_LIMIT_STORE="off", PASSWORD_HASH_METHOD="pbkdf2:sha256:1000")
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "compile_templates"],
+                   cwd=ROOT, env=dict(base, TEMPLATE_CACHE_DIR=cache), check=True,
+                   capture_output=True)
+    modes = (("no cache", dict(base, TEMPLATE_CACHE_DIR="")),
+             ("bytecode cache", dict(base, TEMPLATE_CACHE_DIR=cache)))
+
+    results = {}
+    for label, env in modes:
+        runs = [run_worker(env, 1) for _ in range(args.workers)]
+        results[label] = {url: statistics.median(r["first"][url] for r in runs)
+                          for url in PAGES}
+    print(f"first request per worker (median of {args.workers} workers)")
+    print(f"{'page':<20}" + "".join(f"{label + ' ms':>20}" for label, _ in modes))
+    for url in PAGES:
+        print(f"{url:<20}" + "".join(f"{results[label][url]:>20.1f}" for label, _ in modes))
+    print(f"{'total':<20}" + "".join(f"{sum(results[label].values()):>20.1f}"
+                                     for label, _ in modes))
+
+    print(f"\n/ warm, {args.repeat} renders")
+    for reload in ("1", "0"):
+        r = run_worker(dict(base, TEMPLATE_CACHE_DIR=cache, TEMPLATES_AUTO_RELOAD=reload),
+                       args.repeat)
+        print(f"TEMPLATES_AUTO_RELOAD={reload}: {r['warm']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
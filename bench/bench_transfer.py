@@ -0,0 +1,64 @@
+"""一括エクスポート / インポートのスループット
+
+例: python bench/bench_transfer.py --entries 100000
+書き出し → 別の一時 DB へ取り込み、の件数/秒と最大 RSS を出す。
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import use_temp_db, ensure_seeded
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--entries", type=int, default=100_000)
+    ap.add_argument("--format", default="jsonl", choices=["jsonl", "csv"])
+    ap.add_argument("--chunk", type=int, default=1000)
+    ap.add_argument("--import-into", metavar="DB_URL",
+                    help=argparse.SUPPRESS)   # 子プロセス用
+    ap.add_argument("--path", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.import_into:
+        # 取り込み側は別プロセス（DB_URL が違う app を作るため）
+        os.environ["DB_URL"] = args.import_into
+        from app import create_app
+        import transfer
+        with create_app().app_context():
+            t0 = time.perf_counter()
+            n = transfer.import_file(args.path, args.format, args.chunk)
+            dt = time.perf_counter() - t0
+        print(f"import {n} rows: {dt:.1f}s ({n / dt:,.0f} rows/s, max RSS {rss_mb():.0f} MB)")
+        return
+
+    use_temp_db(f"transfer_{args.entries}")
+    from app import create_app
+    import transfer
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_transfer_"), f"entries.{args.format}")
+    with create_app().app_context():
+        ensure_seeded(args.entries)
+        t0 = time.perf_counter()
+        with open(path, "wb") as f:
+            for chunk in transfer.export(args.format):
+                f.write(chunk)
+        dt = time.perf_counter() - t0
+    size = os.path.getsize(path) / 1024 / 1024
+    print(f"export {args.entries} rows: {dt:.1f}s ({args.entries / dt:,.0f} rows/s, "
+          f"{size:.0f} MB, max RSS {rss_mb():.0f} MB)")
+
+    target = f"sqlite:///{tempfile.mkdtemp(prefix='bench_transfer_')}/import.db"
+    subprocess.run([sys.executable, __file__, "--import-into", target, "--path", path,
+                    "--format", args.format, "--chunk", str(args.chunk)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""同時アップロードのメモリと、画像でないファイルを断るまでに読む量
+
+例: python bench/bench_upload_stream.py --concurrency 8 --sizes 300 3000 --rounds 3
+アプリを同じプロセスで動かし、--concurrency 本のスレッドから /create へ
+画像（--sizes KB）を同時に送る。送信側は本文をその場で作りながら渡すので、
+計測されるのはアプリ側の確保だけ。
+  - werkzeug: 以前の受け方（Werkzeug 既定の SpooledTemporaryFile に溜めてから
+    storage.put がコピーしながらハッシュ）
+  - streaming: incoming.UploadRequest（受信しながら判定・ハッシュして rename）
+で、全体の tracemalloc peak・1件あたりの時間と、拡張子だけ .png の偽ファイルを
+断るまでにアプリが読んだバイト数を比べる。
+"""
+import argparse
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+from common import BENCH_USER, use_temp_db
+
+BOUNDARY = "----diarybench"
+BLOCK = os.urandom(64 * 1024)
+
+
+class GeneratedBody:
+    """multipart の本文を読まれる分だけ作る wsgi.input。"""
+
+    def __init__(self, token, magic, size):
+        self.head = "".join(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'
+            for k, v in (("csrf_token", token), ("title", "bench"), ("body", "b"))).encode() \
+            + (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; '
+               f'filename="photo.png"\r\nContent-Type: image/png\r\n\r\n').encode() + magic
+        self.middle = size - len(magic)
+        self.tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+        self.length = len(self.head) + self.middle + len(self.tail)
+        self.consumed = 0
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self.length - self.consumed
+        out = bytearray()
+        while len(out) < n and self.consumed + len(out) < self.length:
+            pos, want = self.consumed + len(out), n - len(out)
+            if pos < len(self.head):
+                out += self.head[pos:pos + want]
+            elif pos < len(self.head) + self.middle:
+                left = len(self.head) + self.middle - pos
+                out += BLOCK[:min(want, left)]
+            else:
+                off = pos - len(self.head) - self.middle
+                out += self.tail[off:off + want]
+        self.consumed += len(out)
+        return bytes(out)
+
+    # テストクライアントが長さを調べるのに使う
+    def tell(self):
+        return self.consumed
+
+    def seek(self, offset, whence=0):
+        self.consumed = self.length + offset if whence == 2 else offset
+
+
+def client(app):
+    c = app.test_client()
+    token = lambda path: re.search(rb'name="csrf_token".*?value="([^"]+)"',
+                                   c.get(path).data, re.S).group(1).decode()
+    c.post("/login", data={"username": BENCH_USER[0], "password": BENCH_USER[1],
+                           "csrf_token": token("/login")})
+    return c, token("/new")
+
+
+def run(app, clients, magic, size, rounds):
+    """全スレッドで rounds 回ずつ送り、(peak バイト, 1件の ms, 読んだバイト数/件) を返す。"""
+    consumed = []
+    statuses = []
+    barrier = threading.Barrier(len(clients))
+
+    def worker(c, token):
+        barrier.wait()
+        for _ in range(rounds):
+            body = GeneratedBody(token, magic, size)
+            r = c.post("/create", input_stream=body, content_length=body.length,
+                       content_type=f"multipart/form-data; boundary={BOUNDARY}")
+            statuses.append(r.status_code)
+            consumed.append(body.consumed)
+
+    threads = [threading.Thread(target=worker, args=ct) for ct in clients]
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert all(s in (302, 303) for s in statuses), statuses
+    return peak, elapsed * 1000 / len(consumed), sum(consumed) / len(consumed)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[300, 3000], help="KB")
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    use_temp_db("upload_stream")
+    import tempfile
+    from flask import Request
+    from app import create_app
+    import common, incoming
+
+    app = create_app()
+    app.config.update(UPLOAD_FOLDER=tempfile.mkdtemp(prefix="bench_up_"),
+                      RATE_LIMIT_STORE="off", IMAGE_PROCESSING="off",
+                      PASSWORD_HASH_METHOD="pbkdf2:sha256:1000",
+                      MAX_CONTENT_LENGTH=None, UPLOAD_MAX_FILE_BYTES=64 * 1024 * 1024)
+    with app.app_context():
+        common.ensure_user()
+
+    print(f"{'mode':<11}{'file':<8}{'KB':>6}{'peak MiB':>10}{'ms/upload':>11}{'read KB':>9}")
+    for mode, request_class in (("werkzeug", Request), ("streaming", incoming.UploadRequest)):
+        app.request_class = request_class
+        clients = [client(app) for _ in range(args.concurrency)]
+        for kb in args.sizes:
+            for label, magic in (("png", b"\x89PNG\r\n\x1a\n"), ("spoofed", b"MZ\x90\0")):
+                peak, ms, read = run(app, clients, magic, kb * 1024, args.rounds)
+                print(f"{mode:<11}{label:<8}{kb:>6}{peak / 1024 / 1024:>10.1f}"
+                      f"{ms:>11.1f}{read / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
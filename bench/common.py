@@ -0,0 +1,116 @@
+"""ベンチマーク共通: 一時 DB の用意・合成データ投入・計測"""
+import io, os, platform, random, statistics, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+WORDS = ["今日", "天気", "散歩", "公園", "仕事", "会議", "夕飯", "カレー", "友達",
+         "電車", "読書", "映画", "雨", "晴れ", "コーヒー", "疲れた", "楽しかった",
+         "週末", "買い物", "料理", "ランニング", "勉強", "旅行", "温泉", "猫"]
+KANJI = [chr(c) for c in range(0x4E00, 0x4E00 + 2000)]
+KANA = [chr(c) for c in range(0x3041, 0x3094)]
+
+
+def use_temp_db(name):
+    """DB_URL が未指定なら一時 SQLite ファイルを使う（app の import 前に呼ぶ）。"""
+    if "DB_URL" not in os.environ:
+        tmp = tempfile.mkdtemp(prefix=f"bench_{name}_")
+        os.environ["DB_URL"] = f"sqlite:///{tmp}/bench.db"
+    return os.environ["DB_URL"]
+
+
+def fake_body(rnd, n_chars=300):
+    # 大半はランダムな漢字かな、所々に WORDS を混ぜてヒット率を現実的にする
+    parts = []
+    while sum(map(len, parts)) < n_chars:
+        if rnd.random() < 0.02:
+            parts.append(rnd.choice(WORDS))
+        else:
+            parts.append("".join(rnd.choices(KANJI, k=2) + rnd.choices(KANA, k=2)))
+    return "".join(parts)
+
+
+def seed(n, batch=5000, body_chars=300, seed=42, owner=None):
+    """合成エントリを n 件投入する（app_context 内で呼ぶ）。
+
+    owner(rnd) を渡すと (user_id, is_public) を1件ごとに決める。
+    """
+    from models import db, Entry
+    from search import entry_tokens
+    from excerpts import body_fields
+    rnd = random.Random(seed)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(n):
+        title = rnd.choice(WORDS) + "".join(rnd.choices(KANJI, k=3))
+        body = fake_body(rnd, body_chars)
+        row = {"title": title, "body": body,
+               "search_tokens": entry_tokens(title, body), **body_fields(body),
+               "created_at": start + timedelta(minutes=i)}
+        if owner is not None:
+            row["user_id"], row["is_public"] = owner(rnd)
+        rows.append(row)
+        if len(rows) >= batch:
+            db.session.execute(db.insert(Entry), rows); rows = []
+    if rows:
+        db.session.execute(db.insert(Entry), rows)
+    db.session.commit()
+    # Core の一括 INSERT は件数カウンタ・アーカイブを通らないので作り直す
+    import archive, counts
+    counts.recount()
+    archive.rebuild()
+
+
+def ensure_seeded(n, **kw):
+    from sqlalchemy import func
+    from models import db, Entry
+    if not db.session.scalar(db.select(func.count()).select_from(Entry)):
+        t0 = time.perf_counter()
+        seed(n, **kw)
+        print(f"seed {n} entries: {time.perf_counter() - t0:.1f}s")
+
+
+def timed(fn, repeat):
+    """fn を repeat 回実行した中央値（ms）。"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+
+BENCH_USER = ("bench", "bench-pass-1234")
+
+
+def ensure_user(username=BENCH_USER[0], password=BENCH_USER[1]):
+    """ログイン計測用のユーザー（app_context 内で呼ぶ）。"""
+    from models import db, User
+    if db.session.execute(db.select(User).where(User.username == username)).scalar_one_or_none():
+        return
+    u = User(username=username); u.set_password(password)
+    db.session.add(u); db.session.commit()
+
+
+def sample_jpeg(width=1600, height=1200, seed=0):
+    """アップロード計測用の JPEG（写真程度の大きさ）。"""
+    from PIL import Image
+    rnd = random.Random(seed)
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    img.paste((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)),
+              (0, 0, width // 2, height // 2))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def run_meta(**extra):
+    """結果 JSON に添える実行環境（コミット間の比較用）。"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), **extra}
@@ -0,0 +1,54 @@
+"""loadtest.py の結果 JSON を2つ比べる（回帰があれば終了コード 1）
+
+例: python bench/compare.py before.json after.json --threshold 10
+p50 が threshold% 以上遅くなるか、rps が threshold% 以上落ちたら回帰とみなす。
+pytest-benchmark の結果は `pytest-benchmark compare` を使う。
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        doc = json.load(f)
+    return doc["meta"], {r["scenario"]: r for r in doc["results"]}
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("before")
+    ap.add_argument("after")
+    ap.add_argument("--threshold", type=float, default=10.0)
+    args = ap.parse_args()
+
+    meta_a, a = load(args.before)
+    meta_b, b = load(args.after)
+    print(f"before: {meta_a.get('commit')}  after: {meta_b.get('commit')}")
+    print(f"{'scenario':<14}{'rps':>16}{'Δ%':>8}{'p50 ms':>18}{'Δ%':>8}")
+    regressed = []
+    for name in a:
+        if name not in b:
+            continue
+        ra, rb = a[name], b[name]
+        d_rps = change(ra["rps"], rb["rps"])
+        d_p50 = change(ra["p50_ms"], rb["p50_ms"])
+        fmt = lambda d: f"{d:+.1f}" if d is not None else "-"
+        print(f"{name:<14}{ra['rps']:>8}→{rb['rps']:<7}{fmt(d_rps):>8}"
+              f"{ra['p50_ms'] or '-':>9}→{rb['p50_ms'] or '-':<8}{fmt(d_p50):>8}")
+        if (d_rps is not None and d_rps <= -args.threshold) or \
+           (d_p50 is not None and d_p50 >= args.threshold):
+            regressed.append(name)
+    if regressed:
+        print("regressed:", ", ".join(regressed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
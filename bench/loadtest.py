@@ -0,0 +1,301 @@
+"""HTTP 負荷試験（asyncio、標準ライブラリだけ）
+
+起動済みのサーバー（gunicorn など）にシナリオごとに同時接続をかけ、
+スループットとレイテンシ分位を JSON で出す。
+
+例:
+  DB_URL=sqlite:///diary.db python bench/loadtest.py --seed 100000   # 投入とユーザー作成
+  gunicorn -c gunicorn.conf.py app:app &
+  python bench/loadtest.py --url http://127.0.0.1:8000 -c 32 -d 20 --json before.json
+  python bench/compare.py before.json after.json
+
+シナリオ: index / deep / cursor / search / detail / create / create_image / login
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import sys
+import time
+import uuid
+from urllib.parse import quote, urlsplit
+
+from common import BENCH_USER, run_meta, sample_jpeg
+
+SCENARIOS = ["index", "deep", "cursor", "search", "detail", "create",
+             "create_image", "login"]
+SEARCH_WORDS = ["天気", "温泉", "カレー", "ランニング 週末", "猫"]
+CSRF = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+NEXT_CURSOR = re.compile(rb'href="[^"]*[?&]after=([^"&]+)')
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Client:
+    """1 接続を keep-alive で使い回す最小限の HTTP/1.1 クライアント。"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+        self.cookies = {}
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", content_type=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                "Connection: keep-alive", f"Content-Length: {len(body)}"]
+        if content_type:
+            head.append(f"Content-Type: {content_type}")
+        if self.cookies:
+            head.append("Cookie: " + "; ".join(f"{k}={v}" for k, v in self.cookies.items()))
+        try:
+            self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+            await self.writer.drain()
+            return await self._read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip()
+            if name == "set-cookie":
+                k, _, v = value.split(";", 1)[0].partition("=")
+                self.cookies[k] = v
+            headers[name] = value
+        if headers.get("transfer-encoding") == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                body += await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                del body[-2:]
+            body = bytes(body)
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, headers, body
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    out = bytearray()
+    for name, value in fields.items():
+        out += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                f"{value}\r\n").encode()
+    for name, (filename, data, ctype) in files.items():
+        out += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; "
+                f"filename=\"{filename}\"\r\nContent-Type: {ctype}\r\n\r\n").encode()
+        out += data + b"\r\n"
+    out += f"--{boundary}--\r\n".encode()
+    return bytes(out), f"multipart/form-data; boundary={boundary}"
+
+
+def form(fields):
+    body = "&".join(f"{quote(k)}={quote(str(v))}" for k, v in fields.items())
+    return body.encode(), "application/x-www-form-urlencoded"
+
+
+async def csrf_token(client, path):
+    status, _, body = await client.request("GET", path)
+    m = CSRF.search(body)
+    if not m:
+        raise HTTPError(f"csrf_token not found on {path} ({status})")
+    return m.group(1).decode()
+
+
+async def login(client):
+    token = await csrf_token(client, "/login")
+    body, ctype = form({"username": BENCH_USER[0], "password": BENCH_USER[1],
+                        "csrf_token": token})
+    status, _, _ = await client.request("POST", "/login", body, ctype)
+    if status != 302:
+        raise HTTPError(f"login failed ({status})")
+
+
+class User:
+    """仮想ユーザー 1 人。setup() で必要な準備をしてから step() を繰り返す。"""
+
+    def __init__(self, scenario, client, args, seed, shared):
+        self.scenario, self.client, self.args = scenario, client, args
+        self.rnd = random.Random(seed)
+        self.shared = shared
+        self.seq = 0
+
+    async def setup(self):
+        if self.scenario in ("create", "create_image"):
+            await login(self.client)
+            self.token = await csrf_token(self.client, "/new")
+        elif self.scenario == "login":
+            self.token = await csrf_token(self.client, "/login")
+
+    async def step(self):
+        c, a, rnd = self.client, self.args, self.rnd
+        s = self.scenario
+        if s == "index":
+            return await c.request("GET", "/"), 200
+        if s == "deep":
+            page = max(1, a.entries // 10 // 2)
+            return await c.request("GET", f"/?page={page}"), 200
+        if s == "cursor":
+            return await c.request("GET", f"/?after={self.shared['cursor']}"), 200
+        if s == "search":
+            q = quote(rnd.choice(SEARCH_WORDS))
+            return await c.request("GET", f"/?q={q}"), 200
+        if s == "detail":
+            return await c.request("GET", f"/entry/{rnd.randint(1, a.entries)}"), 200
+        if s == "create":
+            body, ctype = form({"title": "load", "body": "本文" * 100,
+                                "csrf_token": self.token})
+            return await c.request("POST", "/create", body, ctype), 302
+        if s == "create_image":
+            self.seq += 1
+            data = self.shared["jpeg"] + f"{id(self)}-{self.seq}".encode()
+            body, ctype = multipart({"title": "load", "body": "画像つき",
+                                     "csrf_token": self.token},
+                                    {"image": ("photo.jpg", data, "image/jpeg")})
+            return await c.request("POST", "/create", body, ctype), 302
+        if s == "login":
+            body, ctype = form({"username": BENCH_USER[0], "password": BENCH_USER[1],
+                                "csrf_token": self.token})
+            return await c.request("POST", "/login", body, ctype), 302
+        raise ValueError(s)
+
+
+async def run_scenario(name, args, shared):
+    u = urlsplit(args.url)
+    latencies, errors = [], 0
+    users = [User(name, Client(u.hostname, u.port or 80), args, i, shared)
+             for i in range(args.concurrency)]
+
+    async def setup(user):
+        nonlocal errors
+        try:
+            await user.setup()
+            return user
+        except (HTTPError, ConnectionError, asyncio.IncompleteReadError):
+            errors += 1
+            await user.client.close()
+
+    async def loop(user):
+        nonlocal errors
+        try:
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    (status, _, _), expected = await user.step()
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                    errors += 1
+                    continue
+                if status == expected:
+                    latencies.append(time.perf_counter() - t0)
+                else:
+                    errors += 1
+        finally:
+            await user.client.close()
+
+    # ログインなどの準備は計測時間に含めない
+    ready = [x for x in await asyncio.gather(*(setup(x) for x in users)) if x]
+    t_start = time.perf_counter()
+    deadline = t_start + args.duration
+    await asyncio.gather(*(loop(x) for x in ready))
+    elapsed = time.perf_counter() - t_start
+    ms = sorted(x * 1000 for x in latencies)
+
+    def pct(p):
+        return round(ms[min(len(ms) - 1, int(len(ms) * p))], 2) if ms else None
+    return {"scenario": name, "requests": len(ms), "errors": errors,
+            "rps": round(len(ms) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(ms), 2) if ms else None,
+            "p50_ms": pct(0.50), "p90_ms": pct(0.90), "p99_ms": pct(0.99)}
+
+
+async def prepare_shared(args):
+    shared = {"jpeg": sample_jpeg()}
+    u = urlsplit(args.url)
+    c = Client(u.hostname, u.port or 80)
+    # 一覧の中ほどまで「次へ」を辿ったカーソル（キーセットの深いページ）
+    shared["cursor"] = ""
+    _, _, body = await c.request("GET", "/")
+    for _ in range(min(args.cursor_hops, args.entries // 10)):
+        m = NEXT_CURSOR.search(body)
+        if not m:
+            break
+        shared["cursor"] = m.group(1).decode()
+        _, _, body = await c.request("GET", f"/?after={shared['cursor']}")
+    await c.close()
+    return shared
+
+
+def seed(n):
+    """DB_URL の DB に n 件投入し、計測用ユーザーを作る。"""
+    from app import create_app
+    from common import ensure_seeded, ensure_user
+    with create_app().app_context():
+        ensure_seeded(n)
+        ensure_user()
+
+
+async def main_async(args):
+    shared = await prepare_shared(args)
+    results = []
+    print(f"{'scenario':<14}{'rps':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for name in args.scenarios.split(","):
+        r = await run_scenario(name, args, shared)
+        results.append(r)
+        print(f"{name:<14}{r['rps']:>9}{r['p50_ms'] or '-':>9}{r['p90_ms'] or '-':>9}"
+              f"{r['p99_ms'] or '-':>9}{r['errors']:>8}")
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("-c", "--concurrency", type=int, default=16)
+    ap.add_argument("-d", "--duration", type=float, default=10)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--entries", type=int, default=10_000,
+                    help="DB の件数（詳細・深いページの対象範囲）")
+    ap.add_argument("--cursor-hops", type=int, default=50)
+    ap.add_argument("--seed", type=int, metavar="N",
+                    help="計測せず、DB_URL の DB に N 件投入してユーザーを作る")
+    ap.add_argument("--json", metavar="PATH", help="結果を JSON で書き出す")
+    args = ap.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+        return
+    results = asyncio.run(main_async(args))
+    if args.json:
+        doc = {"meta": run_meta(url=args.url, concurrency=args.concurrency,
+                                duration=args.duration, entries=args.entries),
+               "results": results}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+    if any(r["requests"] == 0 for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
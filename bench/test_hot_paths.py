@@ -0,0 +1,108 @@
+"""主要経路のマイクロベンチマーク（pytest-benchmark）
+
+例: pytest bench --benchmark-json=bench-results.json
+    BENCH_ENTRIES=100000 pytest bench -k search
+比較: pytest-benchmark compare 0001 0002 --group-by=name
+
+アプリはプロセス内（test_client）で動かすので、HTTP サーバーを除いた
+ルーティング〜DB〜描画のコストを測る。描画キャッシュは既定で切る
+（BENCH_RENDER_CACHE=local で有効）。DB_URL を指定すればその DB を使う。
+"""
+import io, os, random, tempfile
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from common import use_temp_db, ensure_seeded, ensure_user, sample_jpeg, BENCH_USER
+
+ENTRIES = int(os.getenv("BENCH_ENTRIES", "10000"))
+PER_PAGE = 10
+
+use_temp_db(f"hot_paths_{ENTRIES}")
+os.environ["RENDER_CACHE"] = os.getenv("BENCH_RENDER_CACHE", "off")
+os.environ["IMAGE_PROCESSING"] = "off"
+os.environ["RATE_LIMIT_STORE"] = "off"   # test_login が同じ IP から繰り返すので
+os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp(prefix="bench_up_"))
+
+from app import create_app
+from models import db, Entry
+import pagination
+
+
+@pytest.fixture(scope="module")
+def app():
+    app = create_app()
+    app.config.update(WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        ensure_seeded(ENTRIES)
+        ensure_user()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def logged_in(app):
+    c = app.test_client()
+    r = c.post("/login", data={"username": BENCH_USER[0], "password": BENCH_USER[1]})
+    assert r.status_code == 302
+    return c
+
+
+def ok(r, status=200):
+    assert r.status_code == status, r.status_code
+    return r
+
+
+def test_index(benchmark, client):
+    benchmark(lambda: ok(client.get("/")))
+
+
+def test_deep_page_offset(benchmark, client):
+    page = ENTRIES // PER_PAGE // 2
+    benchmark(lambda: ok(client.get(f"/?page={page}")))
+
+
+def test_deep_page_cursor(benchmark, app, client):
+    with app.app_context():
+        mid = db.session.execute(db.select(Entry).order_by(*pagination.ORDER)
+                                 .offset(ENTRIES // 2).limit(1)).scalar_one()
+        token = pagination.encode_cursor(mid)
+    benchmark(lambda: ok(client.get(f"/?after={token}")))
+
+
+@pytest.mark.parametrize("q", ["天気", "ランニング 週末", "存在しない語"])
+def test_search(benchmark, client, q):
+    benchmark(lambda: ok(client.get("/", query_string={"q": q})))
+
+
+def test_detail(benchmark, client):
+    rnd = random.Random(0)
+    benchmark(lambda: ok(client.get(f"/entry/{rnd.randint(1, ENTRIES)}")))
+
+
+def test_create_text(benchmark, logged_in):
+    benchmark(lambda: ok(logged_in.post("/create", data={"title": "bench", "body": "本文" * 100}), 302))
+
+
+def test_create_image(benchmark, logged_in):
+    jpeg = sample_jpeg()
+    n = iter(range(10 ** 9))
+
+    def create():
+        # 毎回違う内容にして重複排除（storage.py）に当たらないようにする
+        data = jpeg + next(n).to_bytes(8, "big")
+        return ok(logged_in.post("/create", data={
+            "title": "bench", "body": "画像つき",
+            "image": (io.BytesIO(data), "photo.jpg")},
+            content_type="multipart/form-data"), 302)
+    benchmark(create)
+
+
+def test_login(benchmark, client):
+    data = {"username": BENCH_USER[0], "password": BENCH_USER[1]}
+    benchmark(lambda: ok(client.post("/login", data=data), 302))
@@ -0,0 +1,159 @@
+"""日記の一括操作（一覧で選んだ複数件の削除・公開設定の変更・タグ付け）
+
+1件ずつ get → delete → commit するのではなく、CHUNK 件ずつの
+`DELETE ... WHERE id IN (...) AND user_id = ?`（公開設定は UPDATE）を流し、
+全体を1つのトランザクションでコミットする。途中で失敗したらすべて戻す。
+対象は user_id の日記だけで、他人の日記や無い id は飛ばす（戻り値の件数に入らない）。
+
+Core の文は ORM のイベントを通らないので、transfer.import_rows と同じく
+件数カウンタ・日付のアーカイブ・タグごとの件数・blobs の参照数はここで増減し、
+版の履歴とタグの対応も消す。
+描画キャッシュは session.info に id を積んでおけばコミット後に捨てられる。
+参照が無くなった画像はコミット後に消え（storage の after_commit）、
+ロールバックしたときは消さない。選んだ日記の書き出しは transfer.export(ids=...)。
+"""
+from collections import Counter as Tally
+
+from sqlalchemy import func
+
+from models import db, Entry, EntryRevision, EntryTag
+import archive
+import counts
+import storage
+import tags
+
+CHUNK = 500
+
+
+def chunks(ids, size=CHUNK):
+    """重複を除いた id を昇順に size 件ずつ。"""
+    ids = sorted(set(ids))
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _mark_changed(session, ids):
+    # rendercache の after_commit が一覧とこの id の詳細を捨てる
+    session.info.setdefault("render_dirty", set()).update(ids)
+
+
+def _run(apply):
+    """apply(session) を1つのトランザクションで実行してコミットする。"""
+    session = db.session
+    try:
+        n = apply(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return n
+
+
+def delete(ids, user_id, chunk_size=CHUNK) -> int:
+    """user_id の日記のうち ids を消して、消した件数を返す。"""
+    def apply(session):
+        scopes, days, refs, tag_changes = Tally(), Tally(), Tally(), Tally()
+        tz = archive.zone()
+        removed = 0
+        for part in chunks(ids, chunk_size):
+            # タグの対応は先に読む（PostgreSQL では日記を消すと外部キーで一緒に消える）
+            tagged = tags.rows_for(part)
+            rows = session.execute(
+                db.delete(Entry).where(Entry.id.in_(part), Entry.user_id == user_id)
+                  .returning(Entry.id, Entry.is_public, Entry.created_at, Entry.image_path)
+                  .execution_options(synchronize_session=False)).all()
+            if not rows:
+                continue
+            gone = [r.id for r in rows]
+            for model in (EntryRevision, EntryTag):
+                session.execute(db.delete(model).where(model.entry_id.in_(gone))
+                                  .execution_options(synchronize_session=False))
+            removed += len(rows)
+            public = {r.id: r.is_public for r in rows}
+            for entry_id, tag_id in tagged:
+                if entry_id in public:
+                    for name in counts.scope_names(user_id, public[entry_id]):
+                        tag_changes[name, tag_id] -= 1
+            for r in rows:
+                scopes.update(counts.scope_names(user_id, r.is_public))
+                if r.image_path:
+                    refs[r.image_path] += 1
+            days.update(archive.tally_days(
+                ((user_id, r.is_public, r.created_at) for r in rows), tz))
+            _mark_changed(session, gone)
+        if removed:
+            counts.bump(session, -removed, {name: -n for name, n in scopes.items()})
+            archive.bump_days(session, {key: -n for key, n in days.items()})
+            storage.adjust_refs(session, [(key, -n) for key, n in refs.items()])
+            tags.bump(session, tag_changes)
+        return removed
+
+    return _run(apply)
+
+
+def set_public(ids, user_id, is_public: bool, chunk_size=CHUNK) -> int:
+    """user_id の日記のうち ids の公開設定を変えて、変わった件数を返す。"""
+    def apply(session):
+        days, tag_changes = Tally(), Tally()
+        tz = archive.zone()
+        changed = 0
+        for part in chunks(ids, chunk_size):
+            rows = session.execute(
+                db.update(Entry)
+                  .where(Entry.id.in_(part), Entry.user_id == user_id,
+                         Entry.is_public != is_public)
+                  .values(is_public=is_public)
+                  .returning(Entry.id, Entry.created_at)
+                  .execution_options(synchronize_session=False)).all()
+            if not rows:
+                continue
+            changed += len(rows)
+            # 本人の範囲の件数は変わらず、公開分だけ増減する
+            days.update(archive.tally_days(((None, True, r.created_at) for r in rows), tz))
+            moved = [r.id for r in rows]
+            tag_changes.update((counts.PUBLIC, tag_id) for _, tag_id in tags.rows_for(moved))
+            _mark_changed(session, moved)
+        if changed:
+            sign = 1 if is_public else -1
+            counts.bump(session, 0, {counts.PUBLIC: sign * changed})
+            archive.bump_days(session, {key: sign * n for key, n in days.items()})
+            tags.bump(session, {key: sign * n for key, n in tag_changes.items()})
+        return changed
+
+    return _run(apply)
+
+
+def add_tag(ids, user_id, name: str, chunk_size=CHUNK) -> int:
+    """user_id の日記のうち ids にタグ name を付けて、新しく付いた件数を返す。
+
+    既に付いている日記と、タグが tags.MAX_PER_ENTRY 個ある日記は飛ばす。
+    """
+    def apply(session):
+        tag = tags.resolve([name])[0]
+        tag_changes = Tally()
+        per_entry = db.select(func.count()).where(EntryTag.entry_id == Entry.id) \
+                      .scalar_subquery()
+        added = 0
+        for part in chunks(ids, chunk_size):
+            rows = session.execute(
+                db.select(Entry.id, Entry.is_public)
+                  .where(Entry.id.in_(part), Entry.user_id == user_id,
+                         Entry.id.not_in(db.select(EntryTag.entry_id)
+                                           .where(EntryTag.tag_id == tag.id)),
+                         per_entry < tags.MAX_PER_ENTRY)).all()
+            if not rows:
+                continue
+            session.execute(db.insert(EntryTag),
+                            [{"entry_id": r.id, "tag_id": tag.id} for r in rows])
+            added += len(rows)
+            for r in rows:
+                for scope_name in counts.scope_names(user_id, r.is_public):
+                    tag_changes[scope_name, tag.id] += 1
+            _mark_changed(session, [r.id for r in rows])
+        if added:
+            tags.bump(session, tag_changes)
+            # 件数は変わらないが、一覧のメモ・ETag が見る version を進める
+            counts.bump(session, 0)
+        return added
+
+    return _run(apply)
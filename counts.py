@@ -0,0 +1,248 @@
+"""一覧の件数取得
+
+- 絞り込みなし: counters 表の "entries" 行（Entry の追加・削除時に同じ
+  トランザクションで増減）を読むだけ。COUNT_MODE=estimated の PostgreSQL
+  では pg_class.reltuples の推定値を使う。
+- 検索あり: 正規化したクエリごとに短い TTL でメモ化する。counters 表の
+  "entries_version"（Entry の追加・更新・削除ごとに +1）をキーに含めるので、
+  他ワーカーでの書き込みでも古い件数は返さない。
+- 範囲つき（本人の日記 / 公開分）: "entries_user:<id>" / "entries_public" 行。
+  初めて読まれたときに数えて作り、以後は Entry の増減・公開設定の変更で
+  増減する。
+
+行を数えて作るときは、リクエストのセッションとは別のトランザクションで
+entries への書き込みを止めてから数える（SQLite: BEGIN IMMEDIATE /
+PostgreSQL: LOCK TABLE ... IN SHARE MODE）。数えてから行ができるまでの間に
+書き込みが入ると、その bump は行が無いので空振りし、件数がずれたままになるため。
+ずれたら `flask recount` で作り直す。
+"""
+import threading
+import time
+from collections import Counter as Tally, OrderedDict
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Entry, Counter
+import search
+
+TOTAL = "entries"
+VERSION = "entries_version"
+PUBLIC = "entries_public"
+USER_PREFIX = "entries_user:"
+
+_cache = OrderedDict()   # (範囲, タグ, 正規化クエリ, version) -> (件数, 期限)
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0}
+
+
+# --- 書き込み側: Entry の増減を counters に反映 ---
+def scope(user_id=None):
+    """一覧の範囲を (counters の行名, 絞り込み条件) で返す。None は公開分。"""
+    if user_id is None:
+        return PUBLIC, Entry.is_public
+    return f"{USER_PREFIX}{user_id}", Entry.user_id == user_id
+
+
+def scope_names(user_id, is_public):
+    """この Entry が数えられる範囲の行名。"""
+    names = [PUBLIC] if is_public is not False else []
+    if user_id is not None:
+        names.append(f"{USER_PREFIX}{user_id}")
+    return names
+
+
+def before_after(obj, attr):
+    """属性の (変更前, 変更後)。変わっていなければ同じ値の組。"""
+    hist = inspect(obj).attrs[attr].history
+    if not hist.has_changes():
+        value = getattr(obj, attr)
+        return value, value
+    return (hist.deleted[0] if hist.deleted else None,
+            hist.added[0] if hist.added else None)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_entry_changes(session, flush_context):
+    added = removed = 0
+    scopes = Tally()
+    changed = False
+    for o in session.new:
+        if isinstance(o, Entry):
+            added += 1
+            scopes.update(scope_names(o.user_id, o.is_public))
+    for o in session.deleted:
+        if isinstance(o, Entry):
+            removed += 1
+            scopes.subtract(scope_names(o.user_id, o.is_public))
+    for o in session.dirty:
+        if isinstance(o, Entry) and session.is_modified(o):
+            changed = True
+            (old_user, new_user), (old_pub, new_pub) = (
+                before_after(o, "user_id"), before_after(o, "is_public"))
+            if (old_user, old_pub) != (new_user, new_pub):
+                scopes.subtract(scope_names(old_user, old_pub))
+                scopes.update(scope_names(new_user, new_pub))
+    if not (added or removed or changed):
+        return
+    bump(session, added - removed, scopes)
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_local_cache(session):
+    # 同一プロセス内はすぐ捨てる（他プロセスは version の変化で無効になる）
+    if session.info.pop("entries_changed", False):
+        clear_cache()
+
+
+def bump(session, delta: int, scopes=None):
+    """件数を delta 増減し version を進める。Core で一括更新した後にも呼ぶ。
+
+    scopes は {範囲の行名: 増減}。まだ作られていない行は読むときに数える。
+    """
+    conn = session.connection()
+    if delta:
+        conn.execute(db.update(Counter).where(Counter.name == TOTAL)
+                       .values(value=Counter.value + delta))
+    for name, d in (scopes or {}).items():
+        if d:
+            conn.execute(db.update(Counter).where(Counter.name == name)
+                           .values(value=Counter.value + d))
+    conn.execute(db.update(Counter).where(Counter.name == VERSION)
+                   .values(value=Counter.value + 1))
+    session.info["entries_changed"] = True
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+# --- 読み込み側 ---
+def _counters():
+    with db.session.no_autoflush:
+        rows = dict(db.session.execute(
+            db.select(Counter.name, Counter.value)
+              .where(Counter.name.in_([TOTAL, VERSION]))).all())
+    if len(rows) < 2:
+        rows = recount()
+    return rows
+
+
+@contextmanager
+def _locked_counting():
+    """entries への書き込みを止めた別のトランザクション（数えて行を作る間）。
+
+    書き込み中のセッションから呼ぶと自分を待つので、読むだけのときに使う。
+    """
+    # ASGI では db.session が非同期エンジンにつながっているので、その接続先で
+    with db.session.get_bind().begin() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif conn.dialect.name == "postgresql":
+            conn.exec_driver_sql("LOCK TABLE entries IN SHARE MODE")
+        yield conn
+
+
+def _upsert(conn, name, value, on_conflict):
+    """counters の行を作る。既にあれば on_conflict（None なら何もしない）で更新。"""
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(Counter).values(name=name, value=value)
+    if on_conflict is None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["name"])
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=["name"],
+                                          set_={"value": on_conflict})
+    conn.execute(stmt)
+
+
+def recount():
+    """counters を実件数から作り直す（初回や Core で直接投入した後）。
+
+    リクエストのセッションはコミットもロールバックもしない。
+    """
+    with _locked_counting() as conn:
+        total = conn.scalar(db.select(func.count()).select_from(Entry)) or 0
+        # 範囲ごとの行は捨てて、次に読まれたときに数え直す
+        conn.execute(db.delete(Counter).where(db.or_(
+            Counter.name == PUBLIC, Counter.name.startswith(USER_PREFIX))))
+        _upsert(conn, TOTAL, total, total)
+        # 件数が変わっているかもしれないので、検索件数のメモも古くする
+        _upsert(conn, VERSION, 0, Counter.value + 1)
+        rows = dict(conn.execute(
+            db.select(Counter.name, Counter.value)
+              .where(Counter.name.in_([TOTAL, VERSION]))).all())
+    clear_cache()
+    return rows
+
+
+def entries_version() -> int:
+    """Entry が変わるたびに進む番号（他プロセスの書き込みも反映される）。"""
+    return _counters()[VERSION]
+
+
+def _estimated_total():
+    if db.engine.dialect.name != "postgresql":
+        return None
+    n = db.session.scalar(db.text(
+        "SELECT reltuples::bigint FROM pg_class WHERE relname = 'entries'"))
+    # 一度も ANALYZE されていなければ -1
+    return n if n is not None and n >= 0 else None
+
+
+def scope_total(scope) -> int:
+    """counts.scope() の範囲の件数（counters の行。無ければ数えて作る）。"""
+    name, where = scope
+    with db.session.no_autoflush:
+        n = db.session.scalar(db.select(Counter.value).where(Counter.name == name))
+    if n is not None:
+        return n
+    # 初回だけ数える（本人の分は ix_entries_user_created_at_id の範囲だけ読む）
+    with _locked_counting() as conn:
+        # 待っている間に別ワーカーが作っていればそれを使う
+        n = conn.scalar(db.select(Counter.value).where(Counter.name == name))
+        if n is None:
+            n = conn.scalar(db.select(func.count()).select_from(Entry).where(where)) or 0
+            _upsert(conn, name, n, None)
+    return n
+
+
+def count_entries(stmt, q: str, mode: str = "exact", ttl: float = 30.0,
+                  max_size: int = 256, scope=None, tag=None):
+    """(件数, 推定値か) を返す。stmt は検索条件を付けた後の select。
+
+    scope は counts.scope() の戻り値。stmt にも同じ条件を付けておくこと。
+    tag はタグで絞り込んでいればその id（メモのキーに入れる）。
+    """
+    if not q and scope is not None:
+        return scope_total(scope), False
+    if not q:
+        if mode == "estimated":
+            n = _estimated_total()
+            if n is not None:
+                return n, True
+        return _counters()[TOTAL], False
+
+    key = (scope and scope[0], tag, search.normalize_query(q), _counters()[VERSION])
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(key)
+        if hit and hit[1] > now:
+            _cache.move_to_end(key)
+            stats["hits"] += 1
+            return hit[0], False
+    stats["misses"] += 1
+    # 数えるだけなので id だけの副問い合わせにする（本文などを運ばない）
+    ids = stmt.with_only_columns(Entry.id, maintain_column_froms=True).order_by(None)
+    n = db.session.scalar(
+        db.select(func.count()).select_from(ids.subquery())) or 0
+    with _lock:
+        _cache[key] = (n, now + ttl)
+        _cache.move_to_end(key)
+        while len(_cache) > max_size:
+            _cache.popitem(last=False)
+    return n, False
@@ -0,0 +1,68 @@
+"""DB エンジンの設定（接続プール・SQLite の PRAGMA・fork 後の破棄）
+
+create_app() から呼ぶ。値はすべて環境変数（.env.example 参照）で変えられる。
+空文字を指定した SQLite の PRAGMA は発行せず、ドライバ既定のままにする。
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def _env(name, default):
+    return os.getenv(name, default)
+
+
+def engine_options(url: str) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS を組み立てる。"""
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite":
+        # SQLite はファイル単位のロックなのでプールを大きくしても意味が薄い。
+        # 待ち時間は busy_timeout（PRAGMA）で制御する
+        return {}
+    opts = {
+        "pool_size": int(_env("DB_POOL_SIZE", "5")),
+        "max_overflow": int(_env("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(_env("DB_POOL_TIMEOUT", "30")),
+        # LB やサーバー側で切られた接続を使い回さない
+        "pool_recycle": int(_env("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env("DB_POOL_PRE_PING", "1") == "1",
+    }
+    timeout = int(_env("DB_STATEMENT_TIMEOUT_MS", "0"))
+    if timeout and u.get_backend_name() == "postgresql":
+        opts["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return opts
+
+
+def sqlite_pragmas() -> dict:
+    mmap_mb = _env("SQLITE_MMAP_MB", "256")
+    return {
+        "journal_mode": _env("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": _env("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": _env("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+        "mmap_size": str(int(mmap_mb) * 1024 * 1024) if mmap_mb else "",
+    }
+
+
+def install(engine):
+    """SQLite なら接続ごとに PRAGMA を発行する（最初の接続より前に呼ぶ）。"""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = {k: v for k, v in sqlite_pragmas().items() if v}
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+
+def dispose(app):
+    """gunicorn の post_fork から呼ぶ。親プロセスの接続を子で使わない。"""
+    from models import db
+    with app.app_context():
+        # close=False: 親が持つソケットを閉じず、子のプールだけ捨てる
+        db.engine.dispose(close=False)
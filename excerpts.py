@@ -0,0 +1,30 @@
+"""一覧用の抜粋（Entry.excerpt）と本文の長さ（Entry.body_length）
+
+一覧では本文（Entry.body、数 KB になりうる）を読まずに、保存時に作った
+先頭 EXCERPT_CHARS 文字と文字数だけを使う。body と search_tokens は
+モデル側で deferred にしてあり、必要な画面（詳細・編集）だけが読む。
+"""
+from sqlalchemy import event, inspect
+
+from models import Entry
+
+EXCERPT_CHARS = 120
+
+
+def make_excerpt(body: str) -> str:
+    """空白・改行を1つに詰めた先頭 EXCERPT_CHARS 文字。"""
+    return " ".join((body or "")[:EXCERPT_CHARS * 4].split())[:EXCERPT_CHARS]
+
+
+def body_fields(body: str) -> dict:
+    """Core で一括 INSERT / UPDATE するときに body と一緒に入れる値。"""
+    return {"excerpt": make_excerpt(body), "body_length": len(body or "")}
+
+
+@event.listens_for(Entry, "before_insert")
+@event.listens_for(Entry, "before_update")
+def _sync_excerpt(mapper, connection, target):
+    # 本文が変わっていなければ（公開設定や縮小版の更新など）読み直さない
+    if inspect(target).attrs.body.history.has_changes():
+        for k, v in body_fields(target.body).items():
+            setattr(target, k, v)
@@ -1,15 +1,27 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField
-from wtforms.validators import DataRequired, Email
+from flask_wtf.file import FileField, FileAllowed
+from wtforms import StringField, PasswordField, TextAreaField, BooleanField, SubmitField
+from wtforms.validators import DataRequired, Length, ValidationError
+
+import tags
 
 class EntryForm(FlaskForm):
     title = StringField("タイトル", validators=[DataRequired(), Length(max=120)])
     body = TextAreaField("本文", validators=[DataRequired()])
     image = FileField("画像（任意）",
         validators=[FileAllowed(["jpg","jpeg","png","gif","webp"], "画像のみ")])
+    # 空白・カンマ区切り（tags.parse）
+    tag_names = StringField("タグ（空白・カンマ区切り）", validators=[Length(max=400)])
+    private = BooleanField("非公開（自分だけが見られる）")
     submit = SubmitField("保存")
 
+    def validate_tag_names(self, field):
+        try:
+            tags.parse(field.data)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
 class LoginForm(FlaskForm):
-    email = StringField("メールアドレス", validators=[DataRequired(), Email()])
+    username = StringField("ユーザー名", validators=[DataRequired(), Length(max=50)])
     password = PasswordField("パスワード", validators=[DataRequired()])
     submit = SubmitField("ログイン")
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""gunicorn 設定（Procfile から -c で読む）
+
+環境変数:
+  PORT / WEB_CONCURRENCY（プロセス数）/ GUNICORN_THREADS（プロセスあたりのスレッド数）
+  GUNICORN_TIMEOUT / GUNICORN_PRELOAD（既定 1: 親で app を読み込んでから fork）
+  TEMPLATE_CACHE_DIR（既定 instance/jinja_cache）/ TEMPLATES_AUTO_RELOAD（既定 0）
+
+preload すると import と create_app() は親で1回だけになり、ワーカーは
+コピーオンライトでそのメモリを共有する。スキーマは Procfile の
+`alembic upgrade head` が作るので、ここでは create_all しない（DB_AUTO_CREATE=0）。
+
+I/O 待ち（DB・アップロード）が主なので、プロセスはコア数程度に抑えて
+スレッドで並行度を稼ぐ。DB の接続数はおおよそ
+  workers × min(threads, DB_POOL_SIZE + DB_MAX_OVERFLOW)
+になるので、PostgreSQL の max_connections に収まるように決める。
+"""
+import gc
+import multiprocessing
+import os
+import sys
+
+os.environ.setdefault("DB_AUTO_CREATE", "0")
+# パスワード照合は子プロセスで（passwords.py）。ログインが集中してもスレッドを埋めない
+os.environ.setdefault("PASSWORD_VERIFY_WORKERS", "1")
+# テンプレートのコンパイル結果はワーカーで共有し（Procfile の compile_templates が
+# 先に入れておく）、更新は見に行かない（templatecache.py。場所は DEFAULT_DIR と同じ）
+os.environ.setdefault("TEMPLATE_CACHE_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "instance", "jinja_cache"))
+os.environ.setdefault("TEMPLATES_AUTO_RELOAD", "0")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count() * 2, 8))))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = 5
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# メモリ断片化・リーク対策でときどき入れ替える
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+
+def when_ready(server):
+    # 親で作ったオブジェクトを GC の対象から外し、子での参照カウント・GC による
+    # ページのコピーを減らす
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # preload 時は親で作った接続プールを引き継いでしまうので捨てる
+    mod = sys.modules.get("app")
+    # hasattr だと未作成のときに app.__getattr__ が作ってしまう
+    if mod is not None and "app" in vars(mod):
+        import dbconfig
+        dbconfig.dispose(mod.app)
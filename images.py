@@ -0,0 +1,167 @@
+"""アップロード画像の縮小版（サムネイル・中サイズ）生成
+
+保存直後に元画像から VARIANTS の幅で WebP と JPEG を作り、EXIF は捨てる
+（向きだけは反映してから捨てる）。元画像の寸法と作った形式は Entry に
+記録し、テンプレートは srcset / width / height をそこから組み立てる。
+処理はワーカースレッドで行い、/create の応答は画像サイズに依存しない。
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db, Entry
+import storage
+
+log = logging.getLogger(__name__)
+
+# 名前 -> 最大幅(px)。元画像より大きくはしない
+VARIANTS = {"thumb": 320, "medium": 1024}
+FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+# 元画像として受け付ける拡張子
+ORIGINAL_EXTS = ("png", "jpg", "jpeg", "gif", "webp")
+
+
+def variant_name(name: str, variant: str, ext: str) -> str:
+    return f"{name.rsplit('.', 1)[0]}_{variant}.{ext}"
+
+
+def variant_size(width: int, height: int, variant: str):
+    w = min(VARIANTS[variant], width)
+    return w, max(round(height * w / width), 1)
+
+
+def generate_variants(backend, name: str):
+    """縮小版を書き出して (幅, 高さ, 形式リスト) を返す。画像でなければ None。
+
+    画素数が Image.MAX_IMAGE_PIXELS を超える画像（展開するとメモリを食い尽くす
+    もの）は展開する前に断って None。
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+    try:
+        with backend.open(name) as f:
+            data = io.BytesIO(f.read())
+        with Image.open(data) as im:
+            # open はヘッダしか読まない。2倍を超えると open 自体が
+            # DecompressionBombError、それ未満でもここで止める
+            if im.width * im.height > (Image.MAX_IMAGE_PIXELS or float("inf")):
+                raise Image.DecompressionBombError(
+                    f"{im.width}x{im.height} は大きすぎます")
+            im = ImageOps.exif_transpose(im)
+            width, height = im.size
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+            formats = [ext for ext in FORMATS
+                       if ext != "webp" or features.check("webp")]
+            for variant in VARIANTS:
+                resized = im.resize(variant_size(width, height, variant),
+                                    Image.Resampling.LANCZOS)
+                for ext in formats:
+                    out = resized.convert("RGB") if ext == "jpg" else resized
+                    # exif を渡さないので EXIF/GPS は書き出されない
+                    buf = io.BytesIO()
+                    out.save(buf, FORMATS[ext], quality=82, optimize=True)
+                    backend.write(variant_name(name, variant, ext),
+                                  buf.getvalue())
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        log.warning("画像を処理できません %s: %s", name, e)
+        return None
+    return width, height, formats
+
+
+def process_entry_image(backend, entry_id: int) -> bool:
+    """Entry の画像の縮小版を作り、寸法を記録する（app_context 内で呼ぶ）。"""
+    e = db.session.get(Entry, entry_id)
+    if not e or not e.image_path:
+        return False
+    result = generate_variants(backend, e.image_path)
+    if result is None:
+        return False
+    e.image_width, e.image_height, formats = result
+    e.image_variants = ",".join(formats)
+    db.session.commit()
+    return True
+
+
+def srcset(e, url_for, ext: str) -> str:
+    """テンプレート用: 'url 320w, url 1024w'"""
+    parts = []
+    for variant in VARIANTS:
+        w, _ = variant_size(e.image_width, e.image_height, variant)
+        url = url_for("uploaded_file",
+                      filename=variant_name(e.image_path, variant, ext))
+        parts.append(f"{url} {w}w")
+    return ", ".join(parts)
+
+
+def _variant_base(filename: str):
+    """縮小版の名前なら元画像の拡張子を除いた名前、そうでなければ None。"""
+    stem, _, ext = filename.rpartition(".")
+    base, _, variant = stem.rpartition("_")
+    if variant not in VARIANTS or ext not in FORMATS or not base:
+        return None
+    return base
+
+
+def source_names(filename: str) -> list:
+    """filename を表示に使う日記の image_path の候補（縮小版なら元画像の名前も）。"""
+    base = _variant_base(filename)
+    if base is None:
+        return [filename]
+    return [filename] + [f"{base}.{ext}" for ext in ORIGINAL_EXTS]
+
+
+def ensure_variant(backend, filename: str) -> bool:
+    """縮小版が消えていたら元画像から作り直す（初回アクセス時の遅延生成）。"""
+    base = _variant_base(filename)
+    if base is None:
+        return False
+    for src_ext in ORIGINAL_EXTS:
+        original = f"{base}.{src_ext}"
+        if backend.exists(original):
+            return generate_variants(backend, original) is not None \
+                and backend.exists(filename)
+    return False
+
+
+class ImagePipeline:
+    """縮小版生成をリクエスト外で回す。
+
+    IMAGE_PROCESSING=thread（既定・スレッドプール）| queue（jobs.py 経由で
+    `flask worker` が処理）| sync | off。TESTING 中は thread でも同期実行する。
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["images"] = self
+
+    def submit(self, entry_id: int):
+        mode = self.app.config["IMAGE_PROCESSING"]
+        if mode == "off":
+            return None
+        if mode == "queue":
+            import jobs
+            job = jobs.enqueue("images.variants", entry_id=entry_id)
+            db.session.commit()
+            return job
+        if mode == "sync" or self.app.testing:
+            return self._run(entry_id)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.app.config["IMAGE_WORKERS"],
+                thread_name_prefix="images")
+        return self.executor.submit(self._run, entry_id)
+
+    def _run(self, entry_id: int):
+        with self.app.app_context():
+            try:
+                return process_entry_image(storage.get_storage(), entry_id)
+            except Exception:
+                log.exception("縮小版の生成に失敗しました entry=%s", entry_id)
+                db.session.rollback()
+                return False
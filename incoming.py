@@ -0,0 +1,126 @@
+"""アップロードの受信（multipart のファイル部分を一時ファイルへ直接書く）
+
+Werkzeug の既定では、ファイル部分は 500KB まではメモリに、それ以上は一時
+ファイルに溜められ、ビューの storage.put がそれをもう一度コピーしながら
+ハッシュを取っていた。しかも判定は拡張子だけで、中身が画像でなくても最後まで
+受け取っていた。
+
+UploadRequest（app.request_class）はファイル部分を受信しながら
+  - 先頭のマジックバイトで画像の種類を判定し、画像でなければその場で 415 にして
+    残りを読まない
+  - SHA-256 と大きさを数え、UPLOAD_MAX_FILE_MB を超えたらその場で 413 にする
+  - 保存先と同じファイルシステムの一時ファイル（UPLOAD_FOLDER/.tmp）に書く
+を行う。保存（IncomingFile.save）は一時ファイルを rename するだけでコピーしない。
+リクエスト全体の上限は MAX_CONTENT_LENGTH（MAX_CONTENT_LENGTH_MB）。
+使われなかった一時ファイルはリクエストの終わりに消す。
+"""
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+import storage
+
+# 判定に使う先頭のバイト数（WebP は 12 バイト目まで見る）
+SNIFF_BYTES = 16
+
+
+def sniff(head: bytes):
+    """先頭のバイト列から画像の種類（保存に使う拡張子）を返す。分からなければ None。"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class NotAnImage(UnsupportedMediaType):
+    description = "画像ファイル（PNG / JPEG / GIF / WebP）ではありません"
+
+
+class FileTooLarge(RequestEntityTooLarge):
+    def __init__(self, limit):
+        super().__init__(f"ファイルが大きすぎます（{limit / 1024 / 1024:g} MB まで）")
+
+
+class IncomingFile:
+    """受信中のファイル部分。
+
+    Werkzeug が write で書き込み、書き終わると seek(0) して FileStorage に包む。
+    読み出し（read / seek など）は中の一時ファイルにそのまま渡す。
+    """
+
+    def __init__(self, tmp_dir, max_bytes):
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir, prefix="in-")
+        self.file = os.fdopen(fd, "w+b")
+        self.max_bytes = max_bytes
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.kind = None
+
+    def write(self, data):
+        if self.size + len(data) > self.max_bytes:
+            raise FileTooLarge(self.max_bytes)
+        if self.kind is None and len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self._check()
+        self.hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def _check(self):
+        self.kind = sniff(self.head)
+        if self.kind is None:
+            raise NotAnImage()
+
+    def seek(self, offset, whence=0):
+        # 書き終わり（SNIFF_BYTES より短いファイル）もここで判定する。空は
+        # 「ファイル未選択」なのでそのまま通す
+        if self.kind is None and self.size:
+            self._check()
+        return self.file.seek(offset, whence)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    @property
+    def digest(self) -> str:
+        return self.hash.hexdigest()
+
+    def save(self, backend) -> str:
+        """保存先に置いてキーを返す（同じ内容が既にあれば一時ファイルは後で消える）。"""
+        self.file.close()
+        return backend.put_file(self.path, self.digest, self.kind)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadRequest(Request):
+    """ファイル部分を IncomingFile で受ける Request。"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        f = IncomingFile(storage.get_storage().tmp_dir(),
+                         current_app.config["UPLOAD_MAX_FILE_BYTES"])
+        # 途中で断った（files に入らなかった）分も close で消せるように覚えておく
+        self.__dict__.setdefault("_incoming", []).append(f)
+        return f
+
+    def close(self):
+        super().close()
+        for f in self.__dict__.pop("_incoming", ()):
+            f.discard()
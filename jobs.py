@@ -0,0 +1,307 @@
+"""DB をキューにしたバックグラウンドジョブ
+
+enqueue() は呼び出し側のセッションに Job を足すだけなので、Entry の保存と
+同じトランザクションでコミットされる（コミットされなければジョブも無い）。
+`flask --app app worker` が取り出して実行する。
+
+取り出し方:
+  - PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED で複数ワーカーが並行に取る
+  - SQLite: 行ロックが無いので、status を条件にした UPDATE の成否で取る。
+    書き込みは DB 全体で1つずつなので、ワーカーの並行数は 1 にする
+失敗したら attempts を増やして指数バックオフで再実行し、max_attempts で failed。
+
+実行中のワーカーは JOB_TIMEOUT の 1/3 ごとに locked_at を進める（別の接続で）。
+JOB_TIMEOUT を過ぎても locked_at が進まない running のジョブはワーカーが落ちた
+ものとして取り直し、失敗1回に数える（ワーカーごと落とすジョブも max_attempts で
+打ち切られる）。長いジョブが動いている間に別のワーカーが二重に取ることはない。
+locked_at を進められないまま取り直された場合に備えて、終わったときの書き込みは
+locked_by がまだ自分のときだけ行う（取り直した側の状態を上書きしない）。
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from models import db, Job
+
+log = logging.getLogger(__name__)
+
+HANDLERS = {}
+# `flask enqueue` で積める保守ジョブ（引数なし）
+MAINTENANCE = ["uploads.gc", "search.rebuild", "jobs.purge"]
+
+
+def task(kind):
+    """ジョブの処理関数を登録する。関数は payload を kwargs で受け取る。"""
+    def deco(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return deco
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, session=None, delay=0, max_attempts=None, **payload):
+    """ジョブを積む（コミットは呼び出し側）。"""
+    from flask import current_app
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    job = Job(kind=kind, payload=json.dumps(payload),
+              run_at=_now() + timedelta(seconds=delay),
+              max_attempts=max_attempts or current_app.config["JOB_MAX_ATTEMPTS"])
+    (session or db.session).add(job)
+    return job
+
+
+def enqueue_now(kind, **payload):
+    """コミット後のフックなど、セッションの外から積む（別トランザクション）。"""
+    from flask import current_app
+    if kind not in HANDLERS:
+        raise ValueError(f"unknown job kind: {kind}")
+    with db.engine.begin() as conn:
+        conn.execute(db.insert(Job).values(
+            kind=kind, payload=json.dumps(payload), status="queued", attempts=0,
+            max_attempts=current_app.config["JOB_MAX_ATTEMPTS"],
+            run_at=_now(), created_at=_now()))
+
+
+# --- 取り出し ---
+def _ready(timeout):
+    now = _now()
+    return db.or_(
+        db.and_(Job.status == "queued", Job.run_at <= now),
+        # ワーカーが落ちて running のまま残ったもの
+        db.and_(Job.status == "running", Job.locked_at < now - timedelta(seconds=timeout)),
+    )
+
+
+def _take(job, worker_id):
+    """取るときの新しい値。止まったワーカーから取り直すなら失敗1回に数え、
+    max_attempts に達していれば running にせず failed にする。"""
+    if job.status != "running":
+        return {"status": "running", "locked_by": worker_id, "locked_at": _now()}
+    attempts = job.attempts + 1
+    values = {"attempts": attempts,
+              "last_error": f"タイムアウト（{job.locked_by} が応答しない）"}
+    if attempts >= job.max_attempts:
+        log.error("ジョブを打ち切りました（ワーカーが止まった） id=%s kind=%s",
+                  job.id, job.kind)
+        return {**values, "status": "failed", "locked_by": None, "locked_at": None}
+    log.warning("止まったワーカーのジョブを取り直します id=%s kind=%s", job.id, job.kind)
+    return {**values, "status": "running", "locked_by": worker_id, "locked_at": _now()}
+
+
+def claim(worker_id, timeout=300):
+    """実行できるジョブを1つ取って running にする。無ければ None。"""
+    stmt = db.select(Job).where(_ready(timeout)).order_by(Job.run_at, Job.id).limit(1)
+    if db.engine.dialect.name == "postgresql":
+        while True:
+            job = db.session.execute(
+                stmt.with_for_update(skip_locked=True)).scalar_one_or_none()
+            if job is None:
+                db.session.rollback()
+                return None
+            for name, value in _take(job, worker_id).items():
+                setattr(job, name, value)
+            db.session.commit()
+            if job.status == "running":
+                return job
+    # SQLite: 候補を見てから条件つき UPDATE。別ワーカーに先を越されたら取り直す
+    # （取り直しと locked_at の更新に先を越されたことも locked_at で分かる）
+    for _ in range(5):
+        job = db.session.execute(stmt).scalar_one_or_none()
+        if job is None:
+            db.session.rollback()
+            return None
+        values = _take(job, worker_id)
+        res = db.session.execute(
+            db.update(Job).where(Job.id == job.id, Job.status == job.status,
+                                 Job.attempts == job.attempts,
+                                 Job.locked_at == job.locked_at)
+              .values(**values)
+              .execution_options(synchronize_session=False))
+        db.session.commit()
+        if res.rowcount == 1 and values["status"] == "running":
+            db.session.refresh(job)
+            return job
+    return None
+
+
+class _Heartbeat:
+    """ジョブの実行中、interval 秒ごとに locked_at を進める（別の接続で）。"""
+
+    def __init__(self, engine, job_id, worker_id, interval):
+        self.engine, self.job_id, self.worker_id = engine, job_id, worker_id
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True,
+                                       name=f"jobs-heartbeat-{job_id}")
+
+    def _loop(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(db.update(Job).where(
+                        Job.id == self.job_id, Job.status == "running",
+                        Job.locked_by == self.worker_id).values(locked_at=_now()))
+            except Exception:
+                # SQLite でジョブが長い書き込みを持っている間などは待ちきれない
+                log.warning("locked_at を更新できません id=%s", self.job_id, exc_info=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping.set()
+        self.thread.join()
+
+
+def _backoff(attempts):
+    return min(2 ** attempts, 3600)
+
+
+def run_one(worker_id="inline", timeout=300) -> bool:
+    """ジョブを1つ実行する（app_context 内で呼ぶ）。実行したら True。"""
+    job = claim(worker_id, timeout)
+    if job is None:
+        return False
+    job_id, kind = job.id, job.kind
+    try:
+        with _Heartbeat(db.engine, job_id, worker_id, timeout / 3):
+            HANDLERS[kind](**json.loads(job.payload))
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        attempts = job.attempts + 1
+        values = {"attempts": attempts, "locked_by": None, "locked_at": None,
+                  "last_error": "".join(traceback.format_exception_only(e)).strip()[:2000]}
+        if attempts >= job.max_attempts:
+            values["status"] = "failed"
+        else:
+            values.update(status="queued",
+                          run_at=_now() + timedelta(seconds=_backoff(attempts)))
+        if _finish(job_id, worker_id, values, attempts=job.attempts):
+            if values["status"] == "failed":
+                log.exception("ジョブが失敗しました（打ち切り） id=%s kind=%s", job_id, kind)
+            else:
+                log.warning("ジョブが失敗しました（再試行 %d 回目） id=%s kind=%s: %s",
+                            attempts, job_id, kind, values["last_error"])
+        db.session.commit()
+        return True
+    _finish(job_id, worker_id, {"status": "done", "locked_by": None})
+    db.session.commit()
+    return True
+
+
+def _finish(job_id, worker_id, values, **expected) -> bool:
+    """まだ自分が持っているジョブだけを values にする。取り直されていたら False。"""
+    where = [Job.id == job_id, Job.status == "running", Job.locked_by == worker_id]
+    where += [getattr(Job, name) == value for name, value in expected.items()]
+    res = db.session.execute(db.update(Job).where(*where).values(**values)
+                               .execution_options(synchronize_session=False))
+    if res.rowcount == 1:
+        return True
+    log.warning("ジョブは別のワーカーに取り直されていました（結果は書きません） "
+                "id=%s worker=%s", job_id, worker_id)
+    return False
+
+
+def run_pending(limit=None) -> int:
+    """今実行できるジョブを全部（最大 limit 件）実行して件数を返す。テストや cron 用。"""
+    n = 0
+    while (limit is None or n < limit) and run_one():
+        n += 1
+    return n
+
+
+def purge(older_than_days=7) -> int:
+    """終わったジョブを消す。"""
+    res = db.session.execute(db.delete(Job).where(
+        Job.status == "done", Job.created_at < _now() - timedelta(days=older_than_days)))
+    db.session.commit()
+    return res.rowcount
+
+
+class Worker:
+    """concurrency 本のスレッドで run_one() を回す。"""
+
+    def __init__(self, app, concurrency=1, poll_interval=1.0):
+        self.app = app
+        with app.app_context():
+            if db.engine.dialect.name == "sqlite" and concurrency > 1:
+                log.info("SQLite では並行数 1 で動かします")
+                concurrency = 1
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _loop(self, n):
+        worker_id = f"{self.prefix}:{n}"
+        timeout = self.app.config["JOB_TIMEOUT"]
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    did = run_one(worker_id, timeout)
+                except Exception:
+                    log.exception("ジョブの取り出しに失敗しました")
+                    db.session.rollback()
+                    did = False
+            if not did:
+                self.stopping.wait(self.poll_interval)
+
+    def run(self):
+        threads = [threading.Thread(target=self._loop, args=(i,), daemon=True,
+                                    name=f"jobs-{i}") for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                for t in threads:
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for t in threads:
+                t.join()
+
+    def stop(self):
+        self.stopping.set()
+
+
+# --- 定義済みのジョブ ---
+@task("images.variants")
+def _image_variants(entry_id):
+    import images, storage
+    if not images.process_entry_image(storage.get_storage(), entry_id):
+        # 画像が消えている（Entry 削除など）場合は成功扱い
+        log.info("縮小版を作る画像がありません entry=%s", entry_id)
+
+
+@task("uploads.collect")
+def _collect_uploads(keys=None):
+    import storage
+    storage.collect(keys)
+
+
+@task("uploads.gc")
+def _gc_uploads():
+    import storage
+    storage.collect()
+    storage.sweep_orphans()
+
+
+@task("search.rebuild")
+def _rebuild_search():
+    import search
+    search.rebuild_index()
+
+
+@task("jobs.purge")
+def _purge_jobs(older_than_days=7):
+    purge(older_than_days)
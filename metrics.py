@@ -0,0 +1,216 @@
+"""リクエスト単位の計測（METRICS=1 のときだけ有効）
+
+SQLAlchemy のカーソル実行イベントと Flask のリクエスト/テンプレート
+シグナルで、1リクエストごとの SQL 回数・SQL 時間・描画時間・全体時間を
+集める。結果は Server-Timing ヘッダと Prometheus 形式の /metrics で出す。
+無効時はイベントもルートも登録しないので、オーバーヘッドは無い。
+
+同じ SQL が1リクエスト内で METRICS_N_PLUS_ONE 回以上出たら N+1 として、
+METRICS_SLOW_QUERY_MS を超えた SQL は遅いクエリとしてログと件数に残す。
+集計はワーカープロセスごと。
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter as Tally, defaultdict
+
+from flask import g, has_request_context, request, abort
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_LITERALS = re.compile(r"'[^']*'|\b\d+\b")
+
+
+def _shape(statement: str) -> str:
+    """リテラルを伏せて、引数違いの同じ SQL を同一視する。"""
+    return _LITERALS.sub("?", " ".join(statement.split()))
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, v):
+        self.count += 1
+        self.sum += v
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(_Histogram)       # (endpoint, method)
+        self.requests = Tally()                      # (endpoint, method, status)
+        self.sql_count = Tally()                     # (endpoint,)
+        self.sql_seconds = defaultdict(float)
+        self.render_seconds = defaultdict(float)
+        self.slow_queries = Tally()
+        self.n_plus_one = Tally()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["metrics"] = self
+        if not app.config["METRICS_ENABLED"]:
+            return
+        with app.app_context():
+            from models import db
+            self.watch_engine(db.engine)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule("/metrics", "metrics", self.export)
+
+    def watch_engine(self, engine):
+        """SQL を数えるエンジンを足す（asgi.py の非同期エンジンは sync_engine を渡す）。"""
+        if not self.app.config["METRICS_ENABLED"]:
+            return
+        event.listen(engine, "before_cursor_execute", self._before_sql)
+        event.listen(engine, "after_cursor_execute", self._after_sql)
+
+    # --- 収集 ---
+    def _start(self):
+        g._m = {"start": time.perf_counter(), "sql_n": 0, "sql_t": 0.0,
+                "render_t": 0.0, "render_depth": 0, "shapes": Tally()}
+
+    def _before_sql(self, conn, cursor, statement, params, context, many):
+        conn.info.setdefault("_m_t0", []).append(time.perf_counter())
+
+    def _after_sql(self, conn, cursor, statement, params, context, many):
+        starts = conn.info.get("_m_t0")
+        if not starts:
+            return
+        dt = time.perf_counter() - starts.pop()
+        if not has_request_context() or "_m" not in g:
+            return
+        m = g._m
+        m["sql_n"] += 1
+        m["sql_t"] += dt
+        m["shapes"][_shape(statement)] += 1
+        if dt * 1000 >= self.app.config["METRICS_SLOW_QUERY_MS"]:
+            with self.lock:
+                self.slow_queries[request.endpoint] += 1
+            log.warning("slow query %.1fms on %s: %s", dt * 1000,
+                        request.endpoint, " ".join(statement.split())[:200])
+
+    def _before_render(self, sender, template, context, **extra):
+        m = g.get("_m")
+        if m is not None:
+            # 入れ子の描画（断片 → ページ）は一番外側だけ測る
+            if m["render_depth"] == 0:
+                m["render_t0"] = time.perf_counter()
+            m["render_depth"] += 1
+
+    def _after_render(self, sender, template, context, **extra):
+        m = g.get("_m")
+        if m is not None and m["render_depth"]:
+            m["render_depth"] -= 1
+            if m["render_depth"] == 0:
+                m["render_t"] += time.perf_counter() - m["render_t0"]
+
+    def _finish(self, response):
+        m = g.pop("_m", None)
+        if m is None:
+            return response
+        total = time.perf_counter() - m["start"]
+        endpoint = request.endpoint or "unknown"
+        repeated = [s for s, n in m["shapes"].items()
+                    if n >= self.app.config["METRICS_N_PLUS_ONE"]]
+        for s in repeated:
+            log.warning("possible N+1 on %s: %d x %s", endpoint,
+                        m["shapes"][s], s[:200])
+        with self.lock:
+            self.requests[(endpoint, request.method, response.status_code)] += 1
+            self.latency[(endpoint, request.method)].observe(total)
+            self.sql_count[endpoint] += m["sql_n"]
+            self.sql_seconds[endpoint] += m["sql_t"]
+            self.render_seconds[endpoint] += m["render_t"]
+            self.n_plus_one[endpoint] += len(repeated)
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={m["sql_t"] * 1000:.2f};desc="{m["sql_n"]} queries", '
+            f'render;dur={m["render_t"] * 1000:.2f}, '
+            f"total;dur={total * 1000:.2f}")
+        return response
+
+    # --- 出力 ---
+    def export(self):
+        token = self.app.config.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(403)
+        return self.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    def render(self) -> str:
+        out = []
+
+        def metric(name, kind, help_, samples):
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, v in samples:
+                lbl = ",".join(f'{k}="{val}"' for k, val in labels.items())
+                out.append(f"{name}{{{lbl}}} {v}" if lbl else f"{name} {v}")
+
+        with self.lock:
+            metric("diary_requests_total", "counter", "HTTP requests",
+                   [({"endpoint": e, "method": m, "status": s}, n)
+                    for (e, m, s), n in sorted(self.requests.items())])
+            samples = []
+            for (e, m), h in sorted(self.latency.items()):
+                for b, n in zip(BUCKETS, h.buckets):
+                    samples.append(({"endpoint": e, "method": m, "le": b}, n))
+                samples.append(({"endpoint": e, "method": m, "le": "+Inf"}, h.count))
+            out.append("# HELP diary_request_duration_seconds Request latency")
+            out.append("# TYPE diary_request_duration_seconds histogram")
+            for labels, v in samples:
+                lbl = ",".join(f'{k}="{val}"' for k, val in labels.items())
+                out.append(f"diary_request_duration_seconds_bucket{{{lbl}}} {v}")
+            for (e, m), h in sorted(self.latency.items()):
+                lbl = f'endpoint="{e}",method="{m}"'
+                out.append(f"diary_request_duration_seconds_sum{{{lbl}}} {h.sum:.6f}")
+                out.append(f"diary_request_duration_seconds_count{{{lbl}}} {h.count}")
+            metric("diary_sql_queries_total", "counter", "SQL statements executed",
+                   [({"endpoint": e}, n) for e, n in sorted(self.sql_count.items())])
+            metric("diary_sql_seconds_total", "counter", "Time spent in SQL",
+                   [({"endpoint": e}, f"{v:.6f}")
+                    for e, v in sorted(self.sql_seconds.items())])
+            metric("diary_render_seconds_total", "counter", "Time spent rendering templates",
+                   [({"endpoint": e}, f"{v:.6f}")
+                    for e, v in sorted(self.render_seconds.items())])
+            metric("diary_slow_queries_total", "counter",
+                   "SQL statements slower than METRICS_SLOW_QUERY_MS",
+                   [({"endpoint": e}, n) for e, n in sorted(self.slow_queries.items())])
+            metric("diary_n_plus_one_total", "counter",
+                   "Requests repeating one SQL shape METRICS_N_PLUS_ONE+ times",
+                   [({"endpoint": e}, n) for e, n in sorted(self.n_plus_one.items())])
+
+        cache = self.app.extensions.get("render_cache")
+        if cache:
+            metric("diary_render_cache_total", "counter", "Render cache lookups",
+                   [({"result": k}, v) for k, v in sorted(cache.stats.items())])
+        hasher = self.app.extensions.get("passwords")
+        if hasher:
+            metric("diary_password_verify_total", "counter", "Password checks",
+                   [({"result": k}, v) for k, v in sorted(hasher.stats.items())])
+        users = self.app.extensions.get("user_cache")
+        if users:
+            metric("diary_user_loader_total", "counter",
+                   "Logged-in user lookups (snapshot/hit/miss/revoked)",
+                   [({"result": k}, v) for k, v in sorted(users.stats.items())])
+        limiter = self.app.extensions.get("rate_limit")
+        if limiter:
+            metric("diary_login_throttled_total", "counter", "Rate-limited login attempts",
+                   [({"by": k}, v) for k, v in sorted(limiter.stats.items())])
+        import counts
+        metric("diary_count_cache_total", "counter", "Search count cache lookups",
+               [({"result": k}, v) for k, v in sorted(counts.stats.items())])
+        return "\n".join(out) + "\n"
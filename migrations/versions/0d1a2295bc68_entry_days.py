@@ -0,0 +1,54 @@
+"""entry_days (date archive)
+
+Revision ID: 0d1a2295bc68
+Revises: d812706c4e92
+Create Date: 2026-10-18 23:55:12.604118
+
+"""
+import os
+from typing import Sequence, Union
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+from archive import DEFAULT_TZ, tally_days
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0d1a2295bc68'
+down_revision: Union[str, Sequence[str], None] = 'd812706c4e92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 10000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('entry_days',
+    sa.Column('scope', sa.String(length=50), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'day')
+    )
+
+    # 既存の日記から作る（`flask rebuild_archive` と同じ集計）
+    conn = op.get_bind()
+    entries = sa.table('entries', sa.column('user_id', sa.Integer()),
+                       sa.column('is_public', sa.Boolean()),
+                       sa.column('created_at', sa.DateTime(timezone=True)))
+    rows = conn.execute(sa.select(entries.c.user_id, entries.c.is_public,
+                                  entries.c.created_at)).yield_per(BATCH)
+    tally = tally_days(rows, ZoneInfo(os.getenv('ARCHIVE_TZ', DEFAULT_TZ)))
+    items = [{'scope': name, 'day': day, 'count': n}
+             for (name, day), n in tally.items()]
+    days = sa.table('entry_days', sa.column('scope'), sa.column('day', sa.Date()),
+                    sa.column('count'))
+    for i in range(0, len(items), BATCH):
+        conn.execute(days.insert(), items[i:i + BATCH])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('entry_days')
@@ -0,0 +1,37 @@
+"""counters table for cached entry totals
+
+Revision ID: 2974230e090f
+Revises: a98e1be242df
+Create Date: 2026-10-18 13:05:27.551930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2974230e090f'
+down_revision: Union[str, Sequence[str], None] = 'a98e1be242df'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    counters = op.create_table('counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    total = op.get_bind().scalar(sa.text("SELECT count(*) FROM entries"))
+    op.bulk_insert(counters, [
+        {'name': 'entries', 'value': total or 0},
+        {'name': 'entries_version', 'value': 0},
+    ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('counters')
@@ -0,0 +1,42 @@
+"""entry_revisions (edit history as compressed deltas)
+
+Revision ID: 2e585f25a01f
+Revises: 0d1a2295bc68
+Create Date: 2026-10-19 00:41:37.218406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2e585f25a01f'
+down_revision: Union[str, Sequence[str], None] = '0d1a2295bc68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存の日記には版を作らない（最初の編集で版 1 に元の内容が入る）
+    op.create_table('entry_revisions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entry_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=5), nullable=False),
+    sa.Column('title', sa.String(length=120), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('body_length', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['entry_id'], ['entries.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_entry_revisions_entry_seq', 'entry_revisions', ['entry_id', 'seq'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_entry_revisions_entry_seq', table_name='entry_revisions')
+    op.drop_table('entry_revisions')
@@ -0,0 +1,53 @@
+"""tags, entry_tags and tag_counts
+
+Revision ID: 3d13037b8a40
+Revises: 2e585f25a01f
+Create Date: 2026-10-19 01:26:48.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d13037b8a40'
+down_revision: Union[str, Sequence[str], None] = '2e585f25a01f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=30), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('entry_tags',
+    sa.Column('entry_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['entry_id'], ['entries.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('entry_id', 'tag_id')
+    )
+    op.create_index('ix_entry_tags_tag_entry', 'entry_tags', ['tag_id', 'entry_id'], unique=False)
+    op.create_table('tag_counts',
+    sa.Column('scope', sa.String(length=50), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('scope', 'tag_id')
+    )
+    op.create_index('ix_tag_counts_scope_count', 'tag_counts', ['scope', 'count'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tag_counts_scope_count', table_name='tag_counts')
+    op.drop_table('tag_counts')
+    op.drop_index('ix_entry_tags_tag_entry', table_name='entry_tags')
+    op.drop_table('entry_tags')
+    op.drop_table('tags')
@@ -0,0 +1,34 @@
+"""entry image dimensions and variants
+
+Revision ID: 4b40ada03d20
+Revises: 2974230e090f
+Create Date: 2026-10-18 14:31:09.120554
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b40ada03d20'
+down_revision: Union[str, Sequence[str], None] = '2974230e090f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存画像の縮小版は `flask backfill_images` で作る
+    op.add_column('entries', sa.Column('image_width', sa.Integer(), nullable=True))
+    op.add_column('entries', sa.Column('image_height', sa.Integer(), nullable=True))
+    op.add_column('entries', sa.Column('image_variants', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # batch（表の作り直し）だと SQLite の FTS トリガが消えるので直接 DROP する
+    op.drop_column('entries', 'image_variants')
+    op.drop_column('entries', 'image_height')
+    op.drop_column('entries', 'image_width')
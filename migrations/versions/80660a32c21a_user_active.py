@@ -0,0 +1,29 @@
+"""users.active
+
+Revision ID: 80660a32c21a
+Revises: 82a40733067f
+Create Date: 2026-10-18 21:12:09.630517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '80660a32c21a'
+down_revision: Union[str, Sequence[str], None] = '82a40733067f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('active', sa.Boolean(), nullable=False,
+                                     server_default=sa.true()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'active')
@@ -0,0 +1,42 @@
+"""entries.user_id / is_public and (user_id, created_at DESC, id DESC) index
+
+Revision ID: 82a40733067f
+Revises: ba3527d3279a
+Create Date: 2026-10-18 20:05:37.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '82a40733067f'
+down_revision: Union[str, Sequence[str], None] = 'ba3527d3279a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite では batch（表の作り直し）にすると FTS のトリガが消えるので
+    # ADD COLUMN だけにする。外部キー制約は SQLite 以外で付ける
+    op.add_column('entries', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.add_column('entries', sa.Column('is_public', sa.Boolean(), nullable=False,
+                                       server_default=sa.true()))
+    if op.get_bind().dialect.name != 'sqlite':
+        op.create_foreign_key('entries_user_id_fkey', 'entries', 'users',
+                              ['user_id'], ['id'])
+    op.create_index('ix_entries_user_created_at_id', 'entries',
+                    ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+                    unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_entries_user_created_at_id', table_name='entries')
+    if op.get_bind().dialect.name != 'sqlite':
+        op.drop_constraint('entries_user_id_fkey', 'entries', type_='foreignkey')
+    op.drop_column('entries', 'is_public')
+    op.drop_column('entries', 'user_id')
@@ -0,0 +1,29 @@
+"""entries (created_at, id) index
+
+Revision ID: a98e1be242df
+Revises: c6d2e0d23738
+Create Date: 2026-10-18 11:20:43.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a98e1be242df'
+down_revision: Union[str, Sequence[str], None] = 'c6d2e0d23738'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_entries_created_at_id', 'entries',
+                    ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_entries_created_at_id', table_name='entries')
@@ -0,0 +1,50 @@
+"""index the last CJK character of each run for one-character search
+
+Revision ID: ba4fea98c2c8
+Revises: 3d13037b8a40
+Create Date: 2026-10-19 09:12:40.302117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from search import entry_tokens
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ba4fea98c2c8'
+down_revision: Union[str, Sequence[str], None] = '3d13037b8a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 1000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # search_tokens を作り直す（FTS5 はトリガ、PostgreSQL は生成列が追従する）
+    conn = op.get_bind()
+    entries = sa.table('entries', sa.column('id'), sa.column('title'),
+                       sa.column('body'), sa.column('search_tokens'))
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.select(entries.c.id, entries.c.title, entries.c.body)
+                              .where(entries.c.id > last_id)
+                              .order_by(entries.c.id).limit(BATCH)).all()
+        if not rows:
+            break
+        conn.execute(
+            entries.update().where(entries.c.id == sa.bindparam('_id'))
+                   .values(search_tokens=sa.bindparam('_tokens')),
+            [{'_id': r.id, '_tokens': entry_tokens(r.title, r.body)}
+             for r in rows],
+        )
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 増えたトークンは残っても検索結果を変えない
+    pass
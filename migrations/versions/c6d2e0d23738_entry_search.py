@@ -0,0 +1,64 @@
+"""entry full-text search
+
+Revision ID: c6d2e0d23738
+Revises: a94b8024fae3
+Create Date: 2026-10-18 10:02:11.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from search import (
+    SQLITE_DDL, SQLITE_DROP, POSTGRES_DDL, POSTGRES_DROP, entry_tokens
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6d2e0d23738'
+down_revision: Union[str, Sequence[str], None] = 'a94b8024fae3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('entries', sa.Column('search_tokens', sa.Text(),
+                                       nullable=False, server_default=''))
+
+    # 既存行のトークンを埋める（FTS 作成前に済ませ、rebuild で一括索引）
+    conn = op.get_bind()
+    entries = sa.table('entries', sa.column('id'), sa.column('title'),
+                       sa.column('body'), sa.column('search_tokens'))
+    rows = conn.execute(sa.select(entries.c.id, entries.c.title,
+                                  entries.c.body)).all()
+    if rows:
+        conn.execute(
+            entries.update().where(entries.c.id == sa.bindparam('_id'))
+                   .values(search_tokens=sa.bindparam('_tokens')),
+            [{'_id': r.id, '_tokens': entry_tokens(r.title, r.body)}
+             for r in rows],
+        )
+
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        for stmt in SQLITE_DDL:
+            op.execute(stmt)
+        op.execute("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        for stmt in POSTGRES_DDL:
+            op.execute(stmt)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for stmt in SQLITE_DROP:
+            op.execute(stmt)
+    elif dialect == 'postgresql':
+        for stmt in POSTGRES_DROP:
+            op.execute(stmt)
+    with op.batch_alter_table('entries') as batch_op:
+        batch_op.drop_column('search_tokens')
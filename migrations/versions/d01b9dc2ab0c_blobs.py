@@ -0,0 +1,34 @@
+"""blobs table for content-addressed uploads
+
+Revision ID: d01b9dc2ab0c
+Revises: 4b40ada03d20
+Create Date: 2026-10-18 15:47:52.301846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd01b9dc2ab0c'
+down_revision: Union[str, Sequence[str], None] = '4b40ada03d20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存ファイルの移行は `flask migrate_uploads` で行う
+    op.create_table('blobs',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('blobs')
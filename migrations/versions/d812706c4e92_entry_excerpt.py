@@ -0,0 +1,58 @@
+"""entries.excerpt / body_length
+
+Revision ID: d812706c4e92
+Revises: 80660a32c21a
+Create Date: 2026-10-18 22:40:51.208311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from excerpts import body_fields
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd812706c4e92'
+down_revision: Union[str, Sequence[str], None] = '80660a32c21a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH = 1000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('entries', sa.Column('excerpt', sa.String(length=200),
+                                       nullable=False, server_default=''))
+    op.add_column('entries', sa.Column('body_length', sa.Integer(),
+                                       nullable=False, server_default='0'))
+
+    # 既存行を埋める（本文を全件メモリに載せないよう id 順に区切って読む）
+    conn = op.get_bind()
+    entries = sa.table('entries', sa.column('id'), sa.column('body'),
+                       sa.column('excerpt'), sa.column('body_length'))
+    update = entries.update().where(entries.c.id == sa.bindparam('_id')) \
+                    .values(excerpt=sa.bindparam('_excerpt'),
+                            body_length=sa.bindparam('_length'))
+    last = 0
+    while True:
+        rows = conn.execute(sa.select(entries.c.id, entries.c.body)
+                              .where(entries.c.id > last)
+                              .order_by(entries.c.id).limit(BATCH)).all()
+        if not rows:
+            break
+        params = []
+        for r in rows:
+            f = body_fields(r.body)
+            params.append({'_id': r.id, '_excerpt': f['excerpt'],
+                           '_length': f['body_length']})
+        conn.execute(update, params)
+        last = rows[-1].id
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('entries', 'body_length')
+    op.drop_column('entries', 'excerpt')
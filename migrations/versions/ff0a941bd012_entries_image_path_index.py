@@ -0,0 +1,28 @@
+"""entries image_path index
+
+Revision ID: ff0a941bd012
+Revises: ba4fea98c2c8
+Create Date: 2026-10-19 10:31:07.518240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ff0a941bd012'
+down_revision: Union[str, Sequence[str], None] = 'ba4fea98c2c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_entries_image_path', 'entries', ['image_path'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_entries_image_path', table_name='entries')
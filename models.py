@@ -1,3 +1,4 @@
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -8,22 +9,147 @@ class Entry(db.Model):
     __tablename__ = "entries"
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
-    body = db.Column(db.Text, nullable=False)
+    # 本文と検索用トークンは一覧では読まない（詳細・編集で必要なときだけ）
+    body = db.deferred(db.Column(db.Text, nullable=False))
+    # 一覧用の抜粋と本文の文字数（excerpts.py が保存時に埋める）
+    excerpt = db.Column(db.String(200), nullable=False, default="", server_default="")
+    body_length = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     image_path = db.Column(db.String(255), nullable=True)
+    # 縮小版を作った後に埋まる（images.py）。未処理なら None
+    image_width = db.Column(db.Integer, nullable=True)
+    image_height = db.Column(db.Integer, nullable=True)
+    image_variants = db.Column(db.String(20), nullable=True)
+    # 全文検索用（search.py が保存時に更新する）
+    search_tokens = db.deferred(db.Column(db.Text, nullable=False, default=""))
+    # 書いた人。移行前の日記は None（公開・誰も編集できない。assign_owner で割り当てる）
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    # False なら本人にしか見えない
+    is_public = db.Column(db.Boolean, nullable=False, default=True,
+                          server_default=db.true())
     created_at = db.Column(
         db.DateTime(timezone=True),
         nullable=False,
         default=lambda: datetime.now(timezone.utc)
     )
+    # タグ（tags.py）。一覧では selectinload でまとめて読む
+    tags = db.relationship("Tag", secondary="entry_tags", order_by="Tag.name")
+
+    __table_args__ = (
+        # 一覧の (created_at DESC, id DESC) 順とキーセットページング用
+        db.Index("ix_entries_created_at_id", "created_at", "id"),
+        # 本人の一覧（user_id = ? ORDER BY created_at DESC, id DESC）用
+        db.Index("ix_entries_user_created_at_id",
+                 user_id, created_at.desc(), id.desc()),
+        # /uploads で画像を参照している日記を引く（公開範囲の確認）用
+        db.Index("ix_entries_image_path", "image_path"),
+    )
+
+class Counter(db.Model):
+    """件数などの集計値。Entry の追加・削除と同じトランザクションで更新する。"""
+    __tablename__ = "counters"
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class EntryRevision(db.Model):
+    """日記の版（revisions.py）。kind は full（全文）/ delta（前の版との差分）。data は zlib 圧縮。"""
+    __tablename__ = "entry_revisions"
+    id = db.Column(db.Integer, primary_key=True)
+    entry_id = db.Column(db.Integer, db.ForeignKey("entries.id", ondelete="CASCADE"),
+                         nullable=False)
+    # 1 から始まる版番号
+    seq = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(5), nullable=False)
+    title = db.Column(db.String(120), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    body_length = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                           default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index("ix_entry_revisions_entry_seq", "entry_id", "seq", unique=True),
+    )
+
+class EntryDay(db.Model):
+    """日付（ARCHIVE_TZ での暦日）ごとの件数。scope は counters と同じ範囲の行名（archive.py）。"""
+    __tablename__ = "entry_days"
+    scope = db.Column(db.String(50), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class Tag(db.Model):
+    """タグ。name は tags.normalize() した形で一意。"""
+    __tablename__ = "tags"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(30), unique=True, nullable=False)
+
+class EntryTag(db.Model):
+    """日記とタグの対応。"""
+    __tablename__ = "entry_tags"
+    entry_id = db.Column(db.Integer, db.ForeignKey("entries.id", ondelete="CASCADE"),
+                         primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id", ondelete="CASCADE"),
+                       primary_key=True)
+
+    __table_args__ = (
+        # タグでの絞り込み（tag_id = ? の entry_id）用
+        db.Index("ix_entry_tags_tag_entry", "tag_id", "entry_id"),
+    )
+
+class TagCount(db.Model):
+    """範囲ごと・タグごとの件数。scope は counters と同じ範囲の行名（tags.py）。"""
+    __tablename__ = "tag_counts"
+    scope = db.Column(db.String(50), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id", ondelete="CASCADE"),
+                       primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # タグクラウド（scope = ? ORDER BY count DESC）用
+        db.Index("ix_tag_counts_scope_count", "scope", "count"),
+    )
+
+class Blob(db.Model):
+    """内容アドレス方式で保存したアップロード。refcount は参照している Entry 数。"""
+    __tablename__ = "blobs"
+    key = db.Column(db.String(255), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False, default=0)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    """バックグラウンドジョブ（jobs.py）。status: queued / running / done / failed"""
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(10), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                       default=lambda: datetime.now(timezone.utc))
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                           default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # 取り出し（status='queued' AND run_at <= now ORDER BY run_at）用
+        db.Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
 
 class User(db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
+    # False にするとログインできず、ログイン中のセッションも切れる（usercache.py）
+    active = db.Column(db.Boolean, nullable=False, default=True,
+                       server_default=db.true())
 
     def set_password(self, raw: str):
-        self.password_hash = generate_password_hash(raw)
+        # アプリがあれば PASSWORD_HASH_METHOD の方式で（passwords.py）
+        hasher = current_app.extensions.get("passwords") if has_app_context() else None
+        self.password_hash = hasher.hash(raw) if hasher else generate_password_hash(raw)
 
     def check_password(self, raw: str) -> bool:
         return check_password_hash(self.password_hash, raw)
@@ -32,7 +158,7 @@ class User(db.Model):
     @property
     def is_authenticated(self): return True
     @property
-    def is_active(self): return True
+    def is_active(self): return bool(self.active)
     @property
     def is_anonymous(self): return False
     def get_id(self): return str(self.id)
@@ -0,0 +1,49 @@
+"""キーセット（カーソル）ページング
+
+一覧は (created_at DESC, id DESC) の順。カーソルは最後/最初に表示した行の
+(created_at, id) を base64url で包んだだけの不透明トークン。
+"""
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import Entry
+
+ORDER = (Entry.created_at.desc(), Entry.id.desc())
+
+
+def encode_cursor(e) -> str:
+    raw = f"{e.created_at.isoformat()}|{e.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str):
+    """トークンを (created_at, id) に戻す。壊れていれば None。"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        ts, _, id_ = raw.rpartition("|")
+        return datetime.fromisoformat(ts), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(session, stmt, per_page, after=None, before=None):
+    """after より古い / before より新しい per_page 件を新しい順で返す。
+
+    戻り値は (entries, has_more)。has_more は進んでいる方向にまだ行があるか。
+    """
+    key = tuple_(Entry.created_at, Entry.id)
+    if before is not None:
+        stmt = stmt.where(key > tuple_(*before)) \
+                   .order_by(Entry.created_at.asc(), Entry.id.asc())
+    else:
+        if after is not None:
+            stmt = stmt.where(key < tuple_(*after))
+        stmt = stmt.order_by(*ORDER)
+    rows = session.execute(stmt.limit(per_page + 1)).scalars().all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
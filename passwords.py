@@ -0,0 +1,141 @@
+"""パスワードのハッシュ方式と照合
+
+PASSWORD_HASH_METHOD は Werkzeug の method 文字列（scrypt:N:r:p /
+pbkdf2:sha256:回数）。保存済みのハッシュと方式・パラメータが違えば、
+ログイン成功時にその場で作り直す（needs_rehash）。
+
+照合（scrypt / pbkdf2 は1回 100ms 前後 CPU を使う）は
+  - PASSWORD_VERIFY_WORKERS > 0: 子プロセスのプールで行う。子は nice を
+    下げて動くので、ログインが集中しても他のリクエストの CPU を奪いにくい
+  - 0: リクエストのスレッドでそのまま行う
+どちらでも同時に照合待ちにできるのはプロセスあたり PASSWORD_VERIFY_MAX_PENDING
+件まで。超えたら Busy を投げ、呼び出し側はすぐ 503 を返す（ワーカーを
+照合待ちで埋めない）。
+
+プールはワーカープロセスで初めて使うときに作る（gunicorn の preload で親が
+作ったものを子が引き継がないように pid で見分ける）。子は spawn で起動するので
+app を import せず、このモジュールと werkzeug だけを読む。
+"""
+import multiprocessing
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash,
+)
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class Busy(Exception):
+    """照合待ちが上限に達した。"""
+
+
+def normalize_method(method: str) -> str:
+    """既定値を補った method 文字列（保存済みハッシュの先頭と同じ形）。"""
+    name, *args = (method or DEFAULT_METHOD).split(":")
+    if name == "scrypt":
+        return "scrypt:" + ":".join(args or ["32768", "8", "1"])
+    if name == "pbkdf2":
+        if len(args) < 1:
+            args.append("sha256")
+        if len(args) < 2:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        return "pbkdf2:" + ":".join(args)
+    raise ValueError(f"未対応のハッシュ方式です: {method}")
+
+
+def needs_rehash(stored: str, method: str) -> bool:
+    return stored.split("$", 1)[0] != normalize_method(method)
+
+
+def _lower_priority(nice):
+    if nice:
+        os.nice(nice)
+
+
+class PasswordHasher:
+    """PASSWORD_HASH_METHOD / PASSWORD_VERIFY_WORKERS / PASSWORD_VERIFY_MAX_PENDING"""
+
+    def __init__(self, app=None):
+        self.stats = {"verified": 0, "rehashed": 0, "busy": 0}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pool = (None, None)     # (pid, executor)
+        self._dummy = (None, None)    # (method, hash)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["passwords"] = self
+
+    @property
+    def method(self):
+        return normalize_method(self.app.config["PASSWORD_HASH_METHOD"])
+
+    def hash(self, raw: str) -> str:
+        return generate_password_hash(raw, method=self.method)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.method)
+
+    def _dummy_hash(self):
+        # ユーザーが居ないときも同じだけ時間をかける（ユーザー名の有無を漏らさない）
+        method = self.method
+        if self._dummy[0] != method:
+            self._dummy = (method, generate_password_hash(
+                secrets.token_urlsafe(16), method=method))
+        return self._dummy[1]
+
+    def _executor(self):
+        pid = os.getpid()
+        if self._pool[0] != pid:
+            cfg = self.app.config
+            self._pool = (pid, ProcessPoolExecutor(
+                max_workers=cfg["PASSWORD_VERIFY_WORKERS"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_lower_priority,
+                initargs=(cfg["PASSWORD_VERIFY_NICE"],)))
+        return self._pool[1]
+
+    def verify(self, stored, raw: str) -> bool:
+        """stored が None（ユーザーなし）でも照合の時間はかけて False を返す。"""
+        cfg = self.app.config
+        with self._lock:
+            if self._pending >= cfg["PASSWORD_VERIFY_MAX_PENDING"]:
+                self.stats["busy"] += 1
+                raise Busy()
+            self._pending += 1
+        future = None
+        try:
+            target = stored or self._dummy_hash()
+            if cfg["PASSWORD_VERIFY_WORKERS"] > 0:
+                future = self._executor().submit(check_password_hash, target, raw)
+                # 待ちきれなくても走り出した照合は止められないので、数は終わってから戻す
+                future.add_done_callback(self._release)
+                try:
+                    ok = future.result(timeout=cfg["PASSWORD_VERIFY_TIMEOUT"])
+                except FutureTimeout:
+                    future.cancel()
+                    self.stats["busy"] += 1
+                    raise Busy() from None
+            else:
+                ok = check_password_hash(target, raw)
+            self.stats["verified"] += 1
+            return ok and stored is not None
+        finally:
+            if future is None:
+                self._release()
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        pid, executor = self._pool
+        if executor is not None and pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._pool = (None, None)
@@ -0,0 +1,123 @@
+"""ログイン試行のレート制限（トークンバケット）
+
+ルールは "回数/秒数"（例: "10/60" は 60 秒で 10 回まで、まとめて 10 回まで可）。
+空にするとその制限は無し。
+  - LOGIN_RATE_IP: 送信元 IP ごと（プロキシの内側なら TRUSTED_PROXIES を設定）
+  - LOGIN_RATE_USER: ユーザー名ごと（IP を変えながらの総当たり対策）
+
+保存先は RATE_LIMIT_STORE=memory（プロセス内。ワーカーごとに別々に数える）/
+redis（全ワーカーで共有。REDIS_URL）/ off。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+def parse_rule(rule: str):
+    """"10/60" → (毎秒の補充量, バケットの容量)。空なら None。"""
+    if not rule:
+        return None
+    count, _, seconds = rule.partition("/")
+    count, seconds = float(count), float(seconds or 1)
+    return count / seconds, count
+
+
+class MemoryStore:
+    """プロセス内のバケット。max_keys を超えたら古いキーから捨てる。"""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()   # key -> (残り, 更新時刻)
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None) -> float:
+        """1つ取る。取れたら 0、取れなければあと何秒待てばよいかを返す。"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+class RedisStore:
+    """Redis のハッシュにバケットを置く（Lua で読み書きを1回にまとめる）。"""
+
+    SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+t = math.min(burst, t + math.max(0, now - ts) * rate)
+local wait = 0
+if t >= 1 then t = t - 1 else wait = (1 - t) / rate end
+redis.call('HSET', KEYS[1], 't', t, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, prefix="diary:rate:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, rate, burst, now=None) -> float:
+        # ワーカー間で共有するので壁時計を使う
+        now = time.time() if now is None else now
+        return float(self.client.eval(self.SCRIPT, 1, self.prefix + key,
+                                      rate, burst, now))
+
+
+class RateLimiter:
+    """RATE_LIMIT_STORE=memory | redis | off"""
+
+    def __init__(self, app=None):
+        self.stats = {"ip": 0, "user": 0}
+        self._store = (None, None)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["rate_limit"] = self
+
+    @property
+    def store(self):
+        # 設定は初回利用時に読む（create_app 後にテストが差し替えられるように）
+        mode = self.app.config["RATE_LIMIT_STORE"]
+        if self._store[0] != mode:
+            store = None
+            if mode == "redis":
+                client = self.app.config.get("RATE_LIMIT_CLIENT")
+                if client is None:
+                    import redis
+                    client = redis.Redis.from_url(self.app.config["REDIS_URL"])
+                store = RedisStore(client)
+            elif mode == "memory":
+                store = MemoryStore()
+            self._store = (mode, store)
+        return self._store[1]
+
+    def check_login(self, ip: str, username: str) -> float:
+        """ログインを試してよければ 0、だめなら待つべき秒数。"""
+        store = self.store
+        if store is None:
+            return 0.0
+        cfg = self.app.config
+        for kind, key, rule in (("ip", f"login:ip:{ip}", cfg["LOGIN_RATE_IP"]),
+                                ("user", f"login:user:{username.lower()}",
+                                 cfg["LOGIN_RATE_USER"])):
+            parsed = parse_rule(rule)
+            if parsed is None:
+                continue
+            wait = store.take(key, *parsed)
+            if wait > 0:
+                self.stats[kind] += 1
+                return wait
+        return 0.0
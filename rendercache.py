@@ -0,0 +1,186 @@
+"""一覧・詳細の描画結果キャッシュ
+
+キャッシュするのはページ本体の断片（_index_content.html / _entry_content.html）
+だけで、base.html（CSRF トークン・フラッシュ）やフォームは毎回描画する。
+そのため別ユーザーのトークンやメッセージが混ざることはない。
+
+キーには世代番号を含め、Entry の追加・更新・削除のコミット後に
+  - 一覧: "index" 世代（どの変更でもページ境界がずれるので全体）
+  - 詳細: "entry:<id>" 世代（その日記だけ）
+を進めて無効化する。
+
+RENDER_CACHE=local はプロセス内 LRU（サイズ上限つき）。世代番号がプロセス
+ごとなので、他ワーカーの書き込みに追従できるよう counters の
+entries_version もキーに含める。RENDER_CACHE=redis は世代番号も Redis に
+置くので、ワーカー間で詳細キャッシュを個別に無効化できる。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import Entry
+
+
+class LocalBackend:
+    """プロセス内 LRU。max_bytes を超えたら古いものから捨てる。"""
+    shared = False
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()   # key -> (value, 期限)
+        self.gens = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                self._drop(key)
+                return None
+            self.items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value: str, ttl: int):
+        with self.lock:
+            if key in self.items:
+                self._drop(key)
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes and self.items:
+                self._drop(next(iter(self.items)))
+
+    def _drop(self, key):
+        value, _ = self.items.pop(key)
+        self.size -= len(value)
+
+    def gen(self, name) -> int:
+        return self.gens.get(name, 0)
+
+    def bump(self, name):
+        with self.lock:
+            self.gens[name] = self.gens.get(name, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+class RedisBackend:
+    """Redis プロトコルのストア（redis-py 互換のクライアント）。"""
+    shared = True
+
+    def __init__(self, client, prefix="diary:render:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        v = self.client.get(self.prefix + key)
+        return v.decode() if isinstance(v, bytes) else v
+
+    def set(self, key, value: str, ttl: int):
+        self.client.setex(self.prefix + key, ttl, value)
+
+    def gen(self, name) -> int:
+        return int(self.client.get(self.prefix + "gen:" + name) or 0)
+
+    def bump(self, name):
+        self.client.incr(self.prefix + "gen:" + name)
+
+    def clear(self):
+        self.bump("all")
+
+
+class RenderCache:
+    """RENDER_CACHE=local | redis | off"""
+
+    def __init__(self, app=None):
+        self.stats = {"hits": 0, "misses": 0}
+        self._backend = (None, None)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["render_cache"] = self
+
+    @property
+    def backend(self):
+        # 設定は初回利用時に読む（create_app 後にテストが差し替えられるように）
+        mode = self.app.config["RENDER_CACHE"]
+        if self._backend[0] != mode:
+            backend = None
+            if mode == "redis":
+                client = self.app.config.get("RENDER_CACHE_CLIENT")
+                if client is None:
+                    import redis
+                    client = redis.Redis.from_url(self.app.config["REDIS_URL"])
+                backend = RedisBackend(client)
+            elif mode == "local":
+                backend = LocalBackend(self.app.config["RENDER_CACHE_MAX_BYTES"])
+            self._backend = (mode, backend)
+        return self._backend[1]
+
+    def _key(self, b, route, gen_name, parts):
+        from counts import entries_version
+        gens = [b.gen("all"), b.gen(gen_name)]
+        if not b.shared:
+            gens.append(entries_version())
+        raw = repr((route, tuple(parts), tuple(gens)))
+        return f"{route}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+    def fragment(self, route, gen_name, parts, render):
+        """キャッシュにあればそれを、無ければ render() の結果を保存して返す。"""
+        backend = self.backend
+        if backend is None:
+            return Markup(render())
+        key = self._key(backend, route, gen_name, parts)
+        html = backend.get(key)
+        if html is not None:
+            self.stats["hits"] += 1
+            return Markup(html)
+        self.stats["misses"] += 1
+        html = render()
+        backend.set(key, str(html), self.app.config["RENDER_CACHE_TTL"])
+        return Markup(html)
+
+    def invalidate(self, entry_ids):
+        backend = self.backend
+        if backend is None:
+            return
+        backend.bump("index")
+        for i in entry_ids:
+            backend.bump(f"entry:{i}")
+
+
+# --- Entry の変更をコミット後に反映 ---
+@event.listens_for(Session, "after_flush")
+def _collect_changed_entries(session, flush_context):
+    ids = session.info.setdefault("render_dirty", set())
+    for o in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(o, Entry) and o.id is not None:
+            ids.add(o.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    ids = session.info.pop("render_dirty", None)
+    if not ids:
+        return
+    from flask import current_app
+    cache = current_app.extensions.get("render_cache")
+    if cache:
+        cache.invalidate(ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_entries(session):
+    session.info.pop("render_dirty", None)
@@ -0,0 +1,152 @@
+"""日記の版の履歴（前の版との差分を圧縮して保存）
+
+title / body が変わるたびに entry_revisions に版を1つ足す（before_flush）。
+  - 版 1 は最初の編集前の内容。一度も編集されていない日記には版が無い
+  - 以後の版は前の版からの行単位の差分（置き換える行の範囲と新しい行）を
+    JSON にして zlib で圧縮したもの
+  - REVISION_SNAPSHOT_EVERY 版ごとに全文を置く（版 1, 1+N, 1+2N, ...）。どの版も
+    直前の全文から最大 N-1 個の差分を当てれば作れる
+最新の版は entries の内容と同じ。Core で直接 body を書き換えると履歴とずれる。
+
+同じ日記を同時に編集しても版番号がぶつからないように、版を足す前に entries の
+行を押さえ（PostgreSQL: SELECT ... FOR UPDATE / SQLite: 空の UPDATE で書き込み
+ロック）、押さえたあとの行を前の版として差分を取る。
+"""
+import difflib
+import json
+import zlib
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Entry, EntryRevision
+
+DEFAULT_SNAPSHOT_EVERY = 20
+
+
+def snapshot_every() -> int:
+    if has_app_context():
+        return current_app.config["REVISION_SNAPSHOT_EVERY"]
+    return DEFAULT_SNAPSHOT_EVERY
+
+
+def _lines(text):
+    return (text or "").splitlines(keepends=True)
+
+
+def make_delta(old: str, new: str) -> list:
+    """old を new にする行単位の差分 [[開始行, 終了行, 置き換える文字列], ...]"""
+    a, b = _lines(old), _lines(new)
+    return [[i1, i2, "".join(b[j1:j2])]
+            for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes()
+            if tag != "equal"]
+
+
+def _apply(a: list, ops) -> list:
+    out, pos = [], 0
+    for i1, i2, text in ops:
+        out.extend(a[pos:i1])
+        out.extend(_lines(text))
+        pos = i2
+    out.extend(a[pos:])
+    return out
+
+
+def apply_delta(old: str, ops) -> str:
+    return "".join(_apply(_lines(old), ops))
+
+
+def _revision(entry_id, seq, title, prev_body, body, every, **extra):
+    full = prev_body is None or (seq - 1) % every == 0
+    if full:
+        data = zlib.compress(body.encode())
+    else:
+        data = zlib.compress(json.dumps(make_delta(prev_body, body), ensure_ascii=False,
+                                        separators=(",", ":")).encode())
+    return EntryRevision(entry_id=entry_id, seq=seq, kind="full" if full else "delta",
+                         title=title, data=data, body_length=len(body), **extra)
+
+
+def _lock_current(session, entry_id):
+    """entries の行を押さえてから、まだ書き換わる前の (title, body) を読む。
+
+    読み込んだ後に別のリクエストが編集していても、その版の後ろにつなげる。
+    """
+    conn = session.connection()
+    current = db.select(Entry.title, Entry.body).where(Entry.id == entry_id)
+    if conn.dialect.name == "postgresql":
+        return tuple(conn.execute(current.with_for_update()).one())
+    # SQLite: 書き込みロックを取ってから読む（先に読むと他の版を見落とす）
+    conn.execute(db.update(Entry).where(Entry.id == entry_id).values(id=Entry.id)
+                   .execution_options(synchronize_session=False))
+    return tuple(conn.execute(current).one())
+
+
+@event.listens_for(Session, "before_flush")
+def _record_revisions(session, flush_context, instances):
+    every = None
+    for o in list(session.dirty):
+        if not isinstance(o, Entry):
+            continue
+        state = inspect(o)
+        title_hist, body_hist = state.attrs.title.history, state.attrs.body.history
+        if not (title_hist.has_changes() or body_hist.has_changes()):
+            continue
+        old_title, old_body = _lock_current(session, o.id)
+        if (old_title, old_body) == (o.title, o.body):
+            continue
+        every = every or snapshot_every()
+        last = session.connection().scalar(
+            db.select(func.max(EntryRevision.seq)).where(EntryRevision.entry_id == o.id))
+        if last is None:
+            # 初めての編集: 元の内容を版 1 として残す
+            session.add(_revision(o.id, 1, old_title, None, old_body, every,
+                                  created_at=o.created_at))
+            last = 1
+        session.add(_revision(o.id, last + 1, o.title, old_body, o.body, every))
+    for o in session.deleted:
+        # SQLite は外部キーの ON DELETE CASCADE を効かせていないので消しておく
+        if isinstance(o, Entry):
+            session.connection().execute(
+                db.delete(EntryRevision).where(EntryRevision.entry_id == o.id))
+
+
+# --- 読み込み ---
+def history(entry_id: int):
+    """版の一覧（新しい順。data は読まない）。"""
+    return db.session.execute(
+        db.select(EntryRevision.seq, EntryRevision.kind, EntryRevision.title,
+                  EntryRevision.body_length, EntryRevision.created_at)
+          .where(EntryRevision.entry_id == entry_id)
+          .order_by(EntryRevision.seq.desc())).all()
+
+
+def load(entry_id: int, seq: int):
+    """版 seq の (title, body, created_at)。無ければ None。
+
+    直前の全文の版から seq までを1回で読んで差分を当てる。
+    """
+    start = db.select(func.max(EntryRevision.seq)).where(
+        EntryRevision.entry_id == entry_id, EntryRevision.kind == "full",
+        EntryRevision.seq <= seq).scalar_subquery()
+    rows = db.session.execute(
+        db.select(EntryRevision.seq, EntryRevision.kind, EntryRevision.title,
+                  EntryRevision.data, EntryRevision.created_at)
+          .where(EntryRevision.entry_id == entry_id, EntryRevision.seq >= start,
+                 EntryRevision.seq <= seq)
+          .order_by(EntryRevision.seq)).all()
+    if not rows or rows[-1].seq != seq:
+        return None
+    # 差分は行のリストのまま当てて、最後に1回だけつなぐ
+    lines = None
+    for r in rows:
+        raw = zlib.decompress(r.data)
+        lines = _lines(raw.decode()) if r.kind == "full" else _apply(lines, json.loads(raw))
+    return rows[-1].title, "".join(lines), rows[-1].created_at
+
+
+def diff_lines(old: str, new: str):
+    """表示用の unified diff の行（"+" / "-" / " " / "@@" で始まる）。"""
+    lines = difflib.unified_diff(_lines(old), _lines(new), lineterm="", n=2)
+    return [line.rstrip("\r\n") for line in lines][2:]
@@ -0,0 +1,192 @@
+"""全文検索（SQLite: FTS5 / PostgreSQL: tsvector + GIN）
+
+日本語は分かち書きせず、CJK の連続部分を文字 bigram に分解して索引する。
+1文字の検索は前方一致（"雨"*）で引くので、bigram の先頭に来ない連続部分の
+最後の文字（「大雨」の「雨」）も1文字のトークンとして索引に入れる。
+英数字は単語単位。索引用テキストは Entry.search_tokens に保存し、
+DB 側の索引（FTS5 仮想表 / 生成列 tsvector）はそこから作る。
+"""
+import re
+import unicodedata
+
+from sqlalchemy import (
+    DDL, column, event, func, inspect, literal_column, or_, select, table, text,
+)
+
+from models import db, Entry
+
+# ひらがな・カタカナ・CJK 統合漢字（拡張A・互換漢字を含む）
+_CJK = r"々〆\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"(?P<cjk>[{_CJK}]+)|(?P<word>[^\W_{_CJK}]+)")
+
+
+def tokenize(*texts: str, tails=False) -> list[str]:
+    """NFKC 正規化・小文字化したうえで CJK は bigram、その他は単語に分ける。
+
+    tails=True（索引用）なら2文字以上の CJK の連続部分の最後の文字も加える。
+    """
+    tokens = []
+    for t in texts:
+        if not t:
+            continue
+        norm = unicodedata.normalize("NFKC", t).lower()
+        for m in _TOKEN_RE.finditer(norm):
+            run = m.group()
+            if m.lastgroup == "cjk" and len(run) > 1:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+                if tails:
+                    tokens.append(run[-1])
+            else:
+                tokens.append(run)
+    return tokens
+
+
+def normalize_query(q: str) -> str:
+    """同じ検索結果になるクエリを同じ文字列に揃える（件数キャッシュのキー）。"""
+    tokens = tokenize(q)
+    return " ".join(tokens) if tokens else q.lower()
+
+
+def entry_tokens(title: str, body: str) -> str:
+    return " ".join(tokenize(title, body, tails=True))
+
+
+@event.listens_for(Entry, "before_insert")
+@event.listens_for(Entry, "before_update")
+def _sync_search_tokens(mapper, connection, target):
+    # 題名・本文が変わったときだけ（本文は deferred なので、他の列の更新で読ませない）
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.body.history.has_changes():
+        target.search_tokens = entry_tokens(target.title, target.body)
+
+
+# --- DDL: create_all() でも Alembic でも同じ定義を使う ---
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+    "search_tokens, content='entries', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 0')",
+    "CREATE TRIGGER IF NOT EXISTS entries_fts_ai AFTER INSERT ON entries BEGIN "
+    "INSERT INTO entries_fts(rowid, search_tokens) "
+    "VALUES (new.id, new.search_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS entries_fts_ad AFTER DELETE ON entries BEGIN "
+    "INSERT INTO entries_fts(entries_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); END",
+    "CREATE TRIGGER IF NOT EXISTS entries_fts_au AFTER UPDATE OF search_tokens "
+    "ON entries BEGIN "
+    "INSERT INTO entries_fts(entries_fts, rowid, search_tokens) "
+    "VALUES ('delete', old.id, old.search_tokens); "
+    "INSERT INTO entries_fts(rowid, search_tokens) "
+    "VALUES (new.id, new.search_tokens); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS entries_fts_au",
+    "DROP TRIGGER IF EXISTS entries_fts_ad",
+    "DROP TRIGGER IF EXISTS entries_fts_ai",
+    "DROP TABLE IF EXISTS entries_fts",
+]
+POSTGRES_DDL = [
+    "ALTER TABLE entries ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', search_tokens)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_entries_search_vector "
+    "ON entries USING gin (search_vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS ix_entries_search_vector",
+    "ALTER TABLE entries DROP COLUMN IF EXISTS search_vector",
+]
+
+for _stmt in SQLITE_DDL:
+    event.listen(Entry.__table__, "after_create",
+                 DDL(_stmt).execute_if(dialect="sqlite"))
+for _stmt in POSTGRES_DDL:
+    event.listen(Entry.__table__, "after_create",
+                 DDL(_stmt).execute_if(dialect="postgresql"))
+for _stmt in SQLITE_DROP:
+    event.listen(Entry.__table__, "before_drop",
+                 DDL(_stmt).execute_if(dialect="sqlite"))
+
+
+# --- 検索 ---
+_fts = table("entries_fts", column("rowid"), column("search_tokens"))
+
+
+def _fts5_query(tokens):
+    # トークンは英数字/CJK のみなので引用符のエスケープは不要。
+    # CJK の bigram は索引側も必ず2文字なので前方一致にしなくても同じ結果になり、
+    # 前方一致（doclist の併合）より1件あたりの照合が軽い。1文字は前方一致で、
+    # その文字で始まる bigram と連続部分の最後の文字（entry_tokens）に当たる
+    return " ".join(f'"{t}"' if len(t) == 2 and _is_cjk(t) else f'"{t}"*'
+                    for t in tokens)
+
+
+def _is_cjk(token):
+    return re.fullmatch(f"[{_CJK}]+", token) is not None
+
+
+def _tsquery(tokens):
+    return " & ".join(f"'{t}':*" for t in tokens)
+
+
+def apply_search(stmt, q: str, narrow: bool = False):
+    """stmt に検索条件を付けて (stmt, 関連度順の order_by リスト) を返す。
+
+    索引に載らないクエリ（記号のみ等）や未対応 DB では従来の LIKE に戻す。
+    narrow=True は stmt の絞り込み（本人の日記など）が十分狭いとき。SQLite では
+    FTS の全ヒットを読んでから捨てる代わりに、絞り込んだ行ごとに FTS を引く
+    （PostgreSQL はプランナが統計から選ぶので同じ）。
+    """
+    tokens = tokenize(q)
+    dialect = db.engine.dialect.name
+    if tokens and dialect == "sqlite":
+        match = _fts.c.search_tokens.match(_fts5_query(tokens))
+        if narrow:
+            rank = (select(func.bm25(literal_column("entries_fts"))).select_from(_fts)
+                      .where(_fts.c.rowid == Entry.id, match).scalar_subquery())
+            return stmt.where(rank.is_not(None)), [rank]
+        stmt = stmt.join(_fts, _fts.c.rowid == Entry.id).where(match)
+        return stmt, [func.bm25(literal_column("entries_fts"))]
+    if tokens and dialect == "postgresql":
+        vec = literal_column("entries.search_vector")
+        tsq = func.to_tsquery("simple", _tsquery(tokens))
+        stmt = stmt.where(vec.op("@@")(tsq))
+        return stmt, [func.ts_rank(vec, tsq).desc()]
+
+    like = f"%{q.lower()}%"
+    stmt = stmt.where(or_(func.lower(Entry.title).like(like),
+                          func.lower(Entry.body).like(like)))
+    return stmt, []
+
+
+def rebuild_index(batch_size: int = 1000) -> int:
+    """search_tokens を全件再計算し、DB 側の索引を作り直す。件数を返す。"""
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        # 索引とずれた状態でトリガが 'delete' を打つと FTS が壊れるので外しておく
+        for stmt in SQLITE_DROP:
+            db.session.execute(text(stmt))
+    n = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Entry.id, Entry.title, Entry.body)
+              .where(Entry.id > last_id).order_by(Entry.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            db.update(Entry).execution_options(synchronize_session=False),
+            [{"id": r.id, "search_tokens": entry_tokens(r.title, r.body)}
+             for r in rows],
+        )
+        n += len(rows)
+        last_id = rows[-1].id
+    if dialect == "sqlite":
+        for stmt in SQLITE_DDL:
+            db.session.execute(text(stmt))
+        db.session.execute(
+            text("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for stmt in POSTGRES_DDL:
+            db.session.execute(text(stmt))
+    db.session.commit()
+    return n
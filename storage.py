@@ -0,0 +1,395 @@
+"""アップロードの保存先（内容アドレス方式・重複排除）
+
+ファイルは受信しながら SHA-256 を計算し `ab/cd/<sha256>.<ext>` に置く。
+同じ内容は1つだけ保存し、blobs 表の refcount で Entry からの参照数を
+数える（Entry.image_path の増減と同じトランザクションで更新）。
+参照が0になったファイルと縮小版はコミット後に消す（UPLOAD_GC=queue なら
+ジョブに回して `flask worker` が消す）。
+
+置く（put）ときは、ファイルを見る前に blobs の行を upsert して（reserve）
+そのトランザクションが終わるまで行を押さえる。collect は行を消してから
+ファイルを消し終えるまでコミットしないので、押さえた後にファイルが無ければ
+消された後であり、put が置き直す。押さえている間は collect は消せない。
+コミット前のファイルは blobs に見えないので、sweep_orphans は
+UPLOAD_ORPHAN_MIN_AGE 秒より新しいファイルを消さない。
+
+保存先は UPLOAD_BACKEND で選ぶ: local（UPLOAD_FOLDER）/ s3（S3 互換）。
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from werkzeug.security import safe_join
+
+from models import db, Entry, Blob
+
+log = logging.getLogger(__name__)
+
+CHUNK = 64 * 1024
+
+
+def blob_key(digest: str, ext: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def _hash_copy(src, dst):
+    """src を dst に書き写しながら (sha256, バイト数) を返す。"""
+    h = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(CHUNK)
+        if not chunk:
+            break
+        h.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return h.hexdigest(), size
+
+
+class LocalStorage:
+    """UPLOAD_FOLDER 配下に保存する。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def local_path(self, key: str):
+        p = safe_join(str(self.root), key)
+        return Path(p) if p else None
+
+    def exists(self, key: str) -> bool:
+        p = self.local_path(key)
+        return bool(p and p.is_file())
+
+    def size(self, key: str) -> int:
+        return self.local_path(key).stat().st_size
+
+    def mtime(self, key: str) -> float:
+        return self.local_path(key).stat().st_mtime
+
+    def open(self, key: str):
+        p = self.local_path(key)
+        if p is None:
+            raise FileNotFoundError(key)
+        return p.open("rb")
+
+    def tmp_dir(self):
+        """受信中の一時ファイルの置き場所（rename で置けるよう同じファイルシステム）。"""
+        tmp_dir = self.root / ".tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        return tmp_dir
+
+    def put(self, stream, ext: str) -> str:
+        tmp = self.tmp_dir() / uuid.uuid4().hex
+        try:
+            with tmp.open("wb") as f:
+                digest, size = _hash_copy(stream, f)
+            key = blob_key(digest, ext)
+            reserve(key, size)
+            dest = self.root / key
+            if dest.exists():
+                return key
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dest)
+            return key
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def put_file(self, path, digest: str, ext: str) -> str:
+        """ハッシュ済みの一時ファイル（tmp_dir の中）をそのまま置く。"""
+        key = blob_key(digest, ext)
+        reserve(key, os.path.getsize(path))
+        dest = self.root / key
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(path, dest)
+        return key
+
+    def write(self, key: str, data: bytes):
+        dest = self.local_path(key)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}")
+        tmp.write_bytes(data)
+        os.replace(tmp, dest)
+
+    def delete(self, key: str):
+        p = self.local_path(key)
+        if p:
+            p.unlink(missing_ok=True)
+
+    def keys(self):
+        for p in self.root.rglob("*"):
+            rel = p.relative_to(self.root)
+            if p.is_file() and rel.parts[0] != ".tmp" \
+                    and not p.name.startswith("."):
+                yield rel.as_posix()
+
+
+class S3Storage:
+    """S3 互換ストレージ。client は boto3 の S3 クライアント（テストでは代替品）。"""
+
+    def __init__(self, bucket, prefix="", client=None, **client_kwargs):
+        if client is None:
+            import boto3
+            client = boto3.client("s3", **client_kwargs)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _k(self, key):
+        return self.prefix + key
+
+    def local_path(self, key):
+        return None
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._k(key))
+            return True
+        except Exception as e:
+            code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(
+            Bucket=self.bucket, Key=self._k(key))["ContentLength"]
+
+    def mtime(self, key: str) -> float:
+        return self.client.head_object(
+            Bucket=self.bucket, Key=self._k(key))["LastModified"].timestamp()
+
+    def open(self, key: str):
+        return self.client.get_object(
+            Bucket=self.bucket, Key=self._k(key))["Body"]
+
+    def tmp_dir(self):
+        return None
+
+    def put(self, stream, ext: str) -> str:
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as tmp:
+            digest, size = _hash_copy(stream, tmp)
+            key = blob_key(digest, ext)
+            reserve(key, size)
+            if not self.exists(key):
+                tmp.seek(0)
+                self.client.upload_fileobj(tmp, self.bucket, self._k(key))
+            return key
+
+    def put_file(self, path, digest: str, ext: str) -> str:
+        key = blob_key(digest, ext)
+        reserve(key, os.path.getsize(path))
+        if not self.exists(key):
+            with open(path, "rb") as f:
+                self.client.upload_fileobj(f, self.bucket, self._k(key))
+        return key
+
+    def write(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._k(key), Body=data)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._k(key))
+
+    def keys(self):
+        token = None
+        while True:
+            kw = {"Bucket": self.bucket, "Prefix": self.prefix}
+            if token:
+                kw["ContinuationToken"] = token
+            res = self.client.list_objects_v2(**kw)
+            for obj in res.get("Contents", []):
+                yield obj["Key"][len(self.prefix):]
+            if not res.get("IsTruncated"):
+                break
+            token = res["NextContinuationToken"]
+
+
+def get_storage(app=None):
+    """設定に応じたバックエンド。設定が変われば作り直す（テストで UPLOAD_FOLDER を差し替える）。"""
+    app = app or current_app
+    cfg = app.config
+    if cfg.get("UPLOAD_STORAGE") is not None:
+        return cfg["UPLOAD_STORAGE"]
+    sig = (cfg["UPLOAD_BACKEND"], cfg["UPLOAD_FOLDER"], cfg.get("S3_BUCKET"))
+    cached = app.extensions.get("storage")
+    if cached and cached[0] == sig:
+        return cached[1]
+    if cfg["UPLOAD_BACKEND"] == "s3":
+        backend = S3Storage(cfg["S3_BUCKET"], prefix=cfg.get("S3_PREFIX", ""),
+                            endpoint_url=cfg.get("S3_ENDPOINT_URL") or None)
+    else:
+        backend = LocalStorage(cfg["UPLOAD_FOLDER"])
+    app.extensions["storage"] = (sig, backend)
+    return backend
+
+
+# --- 参照カウント ---
+def _insert(conn):
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(Blob)
+
+
+def reserve(key: str, size: int):
+    """blobs の行を（無ければ refcount 0 で）作り、リクエストのトランザクションが
+    終わるまで押さえる（PostgreSQL は行ロック、SQLite は書き込みロック）。"""
+    conn = db.session.connection()
+    stmt = _insert(conn).values(key=key, size=size, refcount=0)
+    conn.execute(stmt.on_conflict_do_update(index_elements=["key"],
+                                            set_={"size": stmt.excluded.size}))
+
+
+def _image_path_changes(session):
+    for o in session.new:
+        if isinstance(o, Entry) and o.image_path:
+            yield o.image_path, +1
+    for o in session.deleted:
+        if isinstance(o, Entry) and o.image_path:
+            yield o.image_path, -1
+    for o in session.dirty:
+        if not isinstance(o, Entry):
+            continue
+        hist = inspect(o).attrs.image_path.history
+        for key in hist.deleted or ():
+            if key:
+                yield key, -1
+        for key in hist.added or ():
+            if key:
+                yield key, +1
+
+
+@event.listens_for(Session, "after_flush")
+def _track_blob_refs(session, flush_context):
+    adjust_refs(session, _image_path_changes(session))
+
+
+def adjust_refs(session, changes):
+    """(key, 増減) を blobs に反映する。Core で一括投入した後にも呼ぶ。"""
+    conn = session.connection()
+    for key, delta in changes:
+        res = conn.execute(db.update(Blob).where(Blob.key == key)
+                             .values(refcount=Blob.refcount + delta))
+        if res.rowcount == 0 and delta > 0:
+            # put を通らずに参照した（行がまだ無い）とき。同じ内容を同時に
+            # 参照し始めても一意制約で落ちないように upsert
+            backend = get_storage()
+            size = backend.size(key) if backend.exists(key) else 0
+            stmt = _insert(conn).values(key=key, size=size, refcount=delta)
+            conn.execute(stmt.on_conflict_do_update(
+                index_elements=["key"], set_={"refcount": Blob.refcount + delta}))
+        elif delta < 0:
+            session.info.setdefault("released_blobs", set()).add(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _collect_released(session):
+    keys = session.info.pop("released_blobs", None)
+    if not keys:
+        return
+    if current_app.config.get("UPLOAD_GC") == "queue":
+        import jobs
+        jobs.enqueue_now("uploads.collect", keys=sorted(keys))
+    else:
+        collect(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_released(session):
+    session.info.pop("released_blobs", None)
+
+
+def _delete_files(backend, key):
+    from images import VARIANTS, FORMATS, variant_name
+    backend.delete(key)
+    for variant in VARIANTS:
+        for ext in FORMATS:
+            backend.delete(variant_name(key, variant, ext))
+
+
+def collect(keys=None) -> int:
+    """refcount が0以下の blob を消して、消したバイト数を返す。"""
+    backend = get_storage()
+    stmt = db.select(Blob.key, Blob.size).where(Blob.refcount <= 0)
+    if keys is not None:
+        stmt = stmt.where(Blob.key.in_(list(keys)))
+    freed = 0
+    with db.engine.begin() as conn:
+        for key, size in conn.execute(stmt).all():
+            # 別リクエストが同時に参照を増やしていたら消さない
+            res = conn.execute(db.delete(Blob).where(Blob.key == key,
+                                                     Blob.refcount <= 0))
+            if res.rowcount:
+                _delete_files(backend, key)
+                freed += size or 0
+    return freed
+
+
+def sweep_orphans(min_age=None) -> int:
+    """blobs にも Entry にも無いファイル（旧形式の残骸など）を消す。
+
+    min_age 秒（既定 UPLOAD_ORPHAN_MIN_AGE）より新しいファイルは、置いた
+    トランザクションがまだコミットしていないかもしれないので残す。
+    """
+    from images import VARIANTS
+    if min_age is None:
+        min_age = current_app.config["UPLOAD_ORPHAN_MIN_AGE"]
+    backend = get_storage()
+    live = set(db.session.execute(db.select(Blob.key)).scalars())
+    live |= set(db.session.execute(
+        db.select(Entry.image_path).where(Entry.image_path.is_not(None))
+    ).scalars())
+    live_stems = {k.rsplit(".", 1)[0] for k in live}
+    cutoff = time.time() - min_age
+    freed = 0
+    for key in list(backend.keys()):
+        stem = key.rsplit(".", 1)[0]
+        base, _, variant = stem.rpartition("_")
+        if key in live or (variant in VARIANTS and base in live_stems):
+            continue
+        if backend.mtime(key) > cutoff:
+            continue
+        freed += backend.size(key)
+        backend.delete(key)
+    return freed
+
+
+def migrate_legacy(process_image=None):
+    """旧形式（UPLOAD_FOLDER 直下の uuid 名）を内容アドレス方式へ移す。
+
+    戻り値は (移行件数, 解放バイト数)。
+    """
+    backend = get_storage()
+    entries = db.session.execute(
+        db.select(Entry).where(Entry.image_path.is_not(None),
+                               Entry.image_path.not_like("%/%"))
+    ).scalars().all()
+    freed = 0
+    migrated = 0
+    for e in entries:
+        old = e.image_path
+        if not backend.exists(old):
+            continue
+        old_size = backend.size(old)
+        with closing(backend.open(old)) as f:
+            key = backend.put(f, old.rsplit(".", 1)[-1].lower())
+        if db.session.get(Blob, key).refcount > 0:
+            freed += old_size   # 既にある内容と同じだった
+        e.image_path = key
+        e.image_width = e.image_height = e.image_variants = None
+        db.session.commit()
+        _delete_files(backend, old)
+        migrated += 1
+        if process_image:
+            process_image(e.id)
+    freed += sweep_orphans()
+    return migrated, freed
@@ -0,0 +1,239 @@
+"""日記のタグと、タグごとの件数（タグクラウド・絞り込みの件数）
+
+tags（名前）と entry_tags（日記 × タグ）で持つ。名前は normalize() した形
+（NFKC・小文字・先頭の # を除く）で一意にし、入力は空白・カンマ・読点で区切る。
+
+tag_counts に (範囲, タグ) ごとの件数を持ち、タグクラウドと「タグで絞り込んだ
+一覧」の件数はここを読む。範囲は counts と同じ行名（entries_public /
+entries_user:<id>）。日記の追加・削除・タグの付け替え・公開設定の変更と同じ
+トランザクションで増減する（before_flush で集めて after_flush で反映。新しい
+タグは flush まで id が無いため）。Core で一括操作したときは bump を呼ぶ。
+ずれたら `flask rebuild_tags` で作り直す。
+"""
+import re
+import unicodedata
+from collections import Counter as Tally
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Entry, EntryTag, Tag, TagCount
+import counts
+
+MAX_LENGTH = 30
+MAX_PER_ENTRY = 10
+_SPLIT = re.compile(r"[\s,、]+")
+
+
+def normalize(name: str) -> str:
+    return unicodedata.normalize("NFKC", name).strip().lstrip("#").lower()
+
+
+def parse(text: str) -> list:
+    """入力欄の文字列をタグ名のリストにする（重複を除き、入力順）。不正なら ValueError。"""
+    names = []
+    for raw in _SPLIT.split(text or ""):
+        name = normalize(raw)
+        if name and name not in names:
+            names.append(name)
+    if any(len(n) > MAX_LENGTH for n in names):
+        raise ValueError(f"タグは{MAX_LENGTH}文字までです")
+    if len(names) > MAX_PER_ENTRY:
+        raise ValueError(f"タグは{MAX_PER_ENTRY}個までです")
+    return names
+
+
+def _insert_missing(names):
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    # 別のリクエストが同時に同じタグを作っても一意制約で落ちないように
+    db.session.execute(insert(Tag).on_conflict_do_nothing(index_elements=["name"]),
+                       [{"name": n} for n in names])
+
+
+def resolve(names) -> list:
+    """タグ名のリストを Tag のリストにする（無いタグは作る）。"""
+    if not names:
+        return []
+    stmt = db.select(Tag).where(Tag.name.in_(names))
+    found = {t.name: t for t in db.session.scalars(stmt)}
+    missing = [n for n in names if n not in found]
+    if missing:
+        _insert_missing(missing)
+        found.update((t.name, t) for t in db.session.scalars(stmt))
+    return [found[n] for n in names]
+
+
+def find(name: str):
+    """タグ名から Tag（無ければ None）。"""
+    name = normalize(name or "")
+    if not name:
+        return None
+    return db.session.execute(db.select(Tag).where(Tag.name == name)).scalar_one_or_none()
+
+
+def is_dense(tag_total: int, scope_total: int, rows: int) -> bool:
+    """一覧の並び順に辿って rows 件見つけるまでに読む行（およそ rows × 範囲 / タグ）が
+    タグの件数より少ないか。"""
+    return tag_total * tag_total >= rows * scope_total
+
+
+def filter_entries(stmt, tag_id: int, dense=False):
+    """stmt（Entry の select）をこのタグの付いた日記に絞る。
+
+    dense（範囲の中でよく付いているタグ）なら created_at の索引を辿りながら1件ずつ
+    対応表を引く（EXISTS。1ページ分見つかれば止まる）。少ないタグはタグの索引から
+    全件引いて並べ替える（IN）。SQLite は件数で選べないので呼ぶ側が is_dense で決める。
+    """
+    if dense:
+        return stmt.where(db.select(EntryTag.entry_id)
+                            .where(EntryTag.entry_id == Entry.id, EntryTag.tag_id == tag_id)
+                            .exists())
+    return stmt.where(Entry.id.in_(
+        db.select(EntryTag.entry_id).where(EntryTag.tag_id == tag_id)))
+
+
+# --- 書き込み側 ---
+def _tally(changes, user_id, is_public, tag_list, sign):
+    for name in counts.scope_names(user_id, is_public):
+        for t in tag_list:
+            changes[name, t] += sign
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_tag_changes(session, flush_context, instances):
+    changes = session.info.setdefault("tag_changes", Tally())
+    for o in session.new:
+        if isinstance(o, Entry):
+            _tally(changes, o.user_id, o.is_public, o.tags, +1)
+    for o in session.deleted:
+        if isinstance(o, Entry):
+            _tally(changes, o.user_id, o.is_public, o.tags, -1)
+    for o in list(session.dirty):
+        if not isinstance(o, Entry):
+            continue
+        # tags を読み込んでいなければ付け替えは無い（ここで読みには行かない）
+        hist = inspect(o).attrs.tags.history
+        (old_user, new_user), (old_pub, new_pub) = (
+            counts.before_after(o, "user_id"), counts.before_after(o, "is_public"))
+        if (old_user, old_pub) == (new_user, new_pub) and not hist.has_changes():
+            continue
+        if hist.has_changes():
+            old_tags = list(hist.unchanged) + list(hist.deleted)
+            new_tags = list(hist.unchanged) + list(hist.added)
+        else:
+            old_tags = new_tags = list(o.tags)
+        _tally(changes, old_user, old_pub, old_tags, -1)
+        _tally(changes, new_user, new_pub, new_tags, +1)
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_tag_changes(session, flush_context):
+    changes = session.info.pop("tag_changes", None)
+    if changes:
+        # 新しいタグにもここでは id が振られている
+        bump(session, Tally({(name, t.id): n for (name, t), n in changes.items()}))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_tag_changes(session):
+    session.info.pop("tag_changes", None)
+
+
+def bump(session, changes):
+    """{(範囲, tag_id): 増減} を tag_counts に反映する。Core で一括操作した後にも呼ぶ。"""
+    conn = session.connection()
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    for (name, tag_id), delta in changes.items():
+        if delta > 0:
+            # 同じ範囲でタグを同時に使い始めても主キーで落ちないように upsert
+            conn.execute(insert(TagCount).values(scope=name, tag_id=tag_id, count=delta)
+                           .on_conflict_do_update(index_elements=["scope", "tag_id"],
+                                                  set_={"count": TagCount.count + delta}))
+        elif delta < 0:
+            conn.execute(db.update(TagCount)
+                           .where(TagCount.scope == name, TagCount.tag_id == tag_id)
+                           .values(count=TagCount.count + delta))
+
+
+def rows_for(entry_ids):
+    """entry_ids に付いている (entry_id, tag_id)。"""
+    return db.session.execute(
+        db.select(EntryTag.entry_id, EntryTag.tag_id)
+          .where(EntryTag.entry_id.in_(entry_ids))).all()
+
+
+def names_for(entry_ids) -> dict:
+    """{entry_id: [タグ名（名前順）]}（タグの無い日記は入らない）。"""
+    out = {}
+    rows = db.session.execute(
+        db.select(EntryTag.entry_id, Tag.name)
+          .join(Tag, Tag.id == EntryTag.tag_id)
+          .where(EntryTag.entry_id.in_(entry_ids)).order_by(Tag.name))
+    for entry_id, name in rows:
+        out.setdefault(entry_id, []).append(name)
+    return out
+
+
+def add_rows(session, user_id, entries) -> int:
+    """Core で入れた日記 [(entry_id, is_public, [タグ名])] にタグを付けて件数を増やす。
+
+    付けた対応の数を返す。
+    """
+    by_name = {t.name: t.id for t in resolve(
+        list(dict.fromkeys(n for _, _, names in entries for n in names)))}
+    rows, changes = [], Tally()
+    for entry_id, is_public, names in entries:
+        for n in names:
+            rows.append({"entry_id": entry_id, "tag_id": by_name[n]})
+        _tally(changes, user_id, is_public, [by_name[n] for n in names], +1)
+    if rows:
+        session.execute(db.insert(EntryTag), rows)
+        bump(session, changes)
+    return len(rows)
+
+
+def rebuild(batch=10_000) -> int:
+    """tag_counts を entry_tags から作り直して行数を返す。"""
+    rows = db.session.execute(
+        db.select(Entry.user_id, Entry.is_public, EntryTag.tag_id,
+                  db.func.count())
+          .join(EntryTag, EntryTag.entry_id == Entry.id)
+          .group_by(Entry.user_id, Entry.is_public, EntryTag.tag_id))
+    tally = Tally()
+    for user_id, is_public, tag_id, n in rows:
+        for name in counts.scope_names(user_id, is_public):
+            tally[name, tag_id] += n
+    db.session.execute(db.delete(TagCount))
+    items = [{"scope": name, "tag_id": tag_id, "count": n}
+             for (name, tag_id), n in tally.items()]
+    for i in range(0, len(items), batch):
+        db.session.execute(db.insert(TagCount), items[i:i + batch])
+    db.session.commit()
+    return len(items)
+
+
+# --- 読み込み側 ---
+def total(scope_name, tag_id) -> int:
+    """このタグの付いた、範囲内の日記の件数。"""
+    return db.session.scalar(
+        db.select(TagCount.count)
+          .where(TagCount.scope == scope_name, TagCount.tag_id == tag_id)) or 0
+
+
+def cloud(scope_name, limit=30):
+    """件数の多い順に [(タグ名, 件数, 濃さ 1〜4)]（表示は名前順）。"""
+    rows = db.session.execute(
+        db.select(Tag.name, TagCount.count)
+          .join(Tag, Tag.id == TagCount.tag_id)
+          .where(TagCount.scope == scope_name, TagCount.count > 0)
+          .order_by(TagCount.count.desc(), Tag.name)
+          .limit(limit)).all()
+    top = rows[0][1] if rows else 0
+    return sorted((name, n, min(4, -(-n * 4 // top))) for name, n in rows)
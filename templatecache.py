@@ -0,0 +1,56 @@
+"""テンプレートのバイトコードキャッシュと本番向けの設定
+
+Jinja はテンプレートを初めて使うときに Python のコードへ変換してコンパイルする。
+ワーカーごと・入れ替えのたびにこれが最初のリクエストに乗るので、
+TEMPLATE_CACHE_DIR を指定するとコンパイル結果をそのディレクトリに置き、
+同じホストのワーカーで共有する（FileSystemBytecodeCache。書き込みは一時ファイル
+から rename するので同時に書いても壊れない）。ビルド時に
+`flask compile_templates` で全テンプレートを入れておけば、ワーカーは読むだけになる。
+キャッシュはテンプレートの名前・パスとソースのハッシュで引くので、テンプレートを
+変えれば古いものは使われない（ビルドとは別のパスに置くと効かない）。
+
+TEMPLATES_AUTO_RELOAD=0（gunicorn.conf.py の既定）は本番向けで、FLASK_DEBUG でも
+テンプレートの更新を見に行かない（一度読んだテンプレートは描画のたびに stat しない）。
+空なら Flask の既定（デバッグ時だけ見る）。
+"""
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "instance", "jinja_cache")
+
+
+def auto_reload_setting(value: str):
+    """TEMPLATES_AUTO_RELOAD の値: "1" / "0" / 空（None = Flask に任せる）。"""
+    return None if value == "" else value == "1"
+
+
+def configure(app):
+    """jinja_env が作られる前に呼ぶ（作られた後の jinja_options は効かない）。"""
+    directory = app.config["TEMPLATE_CACHE_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_options = {**app.jinja_options,
+                             "bytecode_cache": FileSystemBytecodeCache(directory)}
+
+
+def compile_all(app, directory=None, clear=False):
+    """全テンプレートを読み込んでバイトコードキャッシュ（directory を渡せばそこ）に
+    入れる。(テンプレート数, かかった ms, [(名前, エラー)]) を返す。
+    """
+    env = app.jinja_env
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(directory)
+    if clear and env.bytecode_cache is not None:
+        env.bytecode_cache.clear()
+    t0 = time.perf_counter()
+    names, errors = env.list_templates(), []
+    for name in names:
+        try:
+            env.get_template(name)
+        except TemplateSyntaxError as e:
+            errors.append((name, f"{e.lineno} 行目: {e.message}"))
+    return len(names), (time.perf_counter() - t0) * 1000, errors
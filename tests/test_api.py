@@ -0,0 +1,156 @@
+import os, re, gzip, json
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, User
+import api
+import tags
+
+FAST = "pbkdf2:sha256:1000"
+
+def make_app(n=5, **config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off")
+    app.config.update(config)
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        for i in range(n):
+            db.session.add(Entry(title=f"E{i+1}", body="本文" * 500, user_id=u.id))
+        db.session.add(Entry(title="Secret", body="private", user_id=u.id, is_public=False))
+        db.session.commit()
+    return app
+
+def login(app, c):
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"',
+                      c.get("/login").data, re.S).group(1).decode()
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+
+def sql_log(app):
+    seen = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *a: seen.append(a[2]))
+    return seen
+
+def test_list_and_detail():
+    app = make_app()
+    c = app.test_client()
+    r = c.get("/api/v1/entries")
+    assert r.status_code == 200 and r.mimetype == "application/json"
+    data = r.get_json()
+    assert [e["title"] for e in data["entries"]] == ["E5", "E4", "E3", "E2", "E1"]
+    assert set(data["entries"][0]) == set(api.LIST_FIELDS)
+    assert data["total"] == 5 and not data["has_next"]
+
+    r = c.get("/api/v1/entries/1")
+    assert r.get_json()["body"].startswith("本文")
+    assert c.get("/api/v1/entries/6").status_code == 404     # 他人の非公開
+    r = c.get("/api/v1/entries/999")
+    assert r.status_code == 404 and r.get_json()["error"] == "Not Found"
+
+def test_owner_sees_private_entries():
+    app = make_app()
+    c = app.test_client()
+    login(app, c)
+    titles = [e["title"] for e in c.get("/api/v1/entries").get_json()["entries"]]
+    assert "Secret" in titles
+    assert c.get("/api/v1/entries/6").status_code == 200
+    public = c.get("/api/v1/entries?scope=public").get_json()["entries"]
+    assert "Secret" not in [e["title"] for e in public]
+
+def test_cursor_pagination():
+    app = make_app(n=5)
+    c = app.test_client()
+    first = c.get("/api/v1/entries?limit=2").get_json()
+    assert [e["title"] for e in first["entries"]] == ["E5", "E4"]
+    second = c.get(f"/api/v1/entries?limit=2&after={first['next_cursor']}").get_json()
+    assert [e["title"] for e in second["entries"]] == ["E3", "E2"]
+    back = c.get(f"/api/v1/entries?limit=2&before={second['prev_cursor']}").get_json()
+    assert [e["title"] for e in back["entries"]] == ["E5", "E4"]
+
+def test_omitted_fields_are_not_loaded():
+    app = make_app()
+    c = app.test_client()
+    c.get("/api/v1/entries")            # 件数の行などを作っておく
+    seen = sql_log(app)
+    r = c.get("/api/v1/entries?fields=id,title")
+    assert set(r.get_json()["entries"][0]) == {"id", "title"}
+    r = c.get("/api/v1/entries/1?fields=title")
+    assert r.get_json() == {"title": "E1"}
+    entry_sql = [s for s in seen if "FROM entries" in s]
+    assert entry_sql and not any(re.search(r"entries\.body\b", s) for s in entry_sql)
+
+def test_tags_field():
+    app = make_app(n=1)
+    with app.app_context():
+        e = db.session.get(Entry, 1)
+        e.tags = tags.resolve(["旅行", "料理"])
+        db.session.commit()
+    c = app.test_client()
+    data = c.get("/api/v1/entries?fields=id,tags").get_json()
+    assert data["entries"] == [{"id": 1, "tags": ["料理", "旅行"]}]
+    assert c.get("/api/v1/entries/1").get_json()["tags"] == ["料理", "旅行"]
+
+def test_unknown_field_is_400():
+    r = make_app().test_client().get("/api/v1/entries?fields=id,password_hash")
+    assert r.status_code == 400 and "password_hash" in r.get_json()["message"]
+
+def test_etag_304_until_entries_change():
+    app = make_app()
+    c = app.test_client()
+    r = c.get("/api/v1/entries?fields=id,title")
+    tag = r.headers["ETag"]
+    assert tag.startswith('W/"') and "no-cache" in r.headers["Cache-Control"]
+
+    seen = sql_log(app)
+    r = c.get("/api/v1/entries?fields=id,title", headers={"If-None-Match": tag})
+    assert r.status_code == 304 and r.data == b""
+    # 変更番号を読むだけで、一覧の SQL は流さない
+    assert not any("FROM entries" in s for s in seen)
+    # 引数が違えば別の ETag
+    assert c.get("/api/v1/entries?fields=id",
+                 headers={"If-None-Match": tag}).status_code == 200
+
+    detail_tag = c.get("/api/v1/entries/1").headers["ETag"]
+    assert c.get("/api/v1/entries/1",
+                 headers={"If-None-Match": detail_tag}).status_code == 304
+
+    with app.app_context():
+        db.session.get(Entry, 1).title = "changed"
+        db.session.commit()
+    assert c.get("/api/v1/entries?fields=id,title",
+                 headers={"If-None-Match": tag}).status_code == 200
+    r = c.get("/api/v1/entries/1", headers={"If-None-Match": detail_tag})
+    assert r.status_code == 200 and r.get_json()["title"] == "changed"
+
+def test_etag_depends_on_viewer():
+    app = make_app()
+    anon = app.test_client()
+    tag = anon.get("/api/v1/entries").headers["ETag"]
+    alice = app.test_client()
+    login(app, alice)
+    assert alice.get("/api/v1/entries", headers={"If-None-Match": tag}).status_code == 200
+
+def test_compression():
+    app = make_app()
+    c = app.test_client()
+    plain = c.get("/api/v1/entries/1")
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    r = c.get("/api/v1/entries/1", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(r.data)) == plain.get_json()
+    assert len(r.data) < len(plain.data)
+
+    if api.brotli is not None:
+        r = c.get("/api/v1/entries/1", headers={"Accept-Encoding": "gzip, br"})
+        assert r.headers["Content-Encoding"] == "br"
+        assert json.loads(api.brotli.decompress(r.data)) == plain.get_json()
+
+    # 小さい応答は圧縮しない
+    r = c.get("/api/v1/entries/1?fields=id", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in r.headers
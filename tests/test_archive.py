@@ -0,0 +1,166 @@
+import os, re
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from collections import Counter as Tally
+from datetime import date, datetime, timezone
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, EntryDay, User
+import archive, transfer
+
+FAST = "pbkdf2:sha256:1000"
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off",
+                      RENDER_CACHE="off", **config)
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.commit()
+    return app
+
+def login(app):
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+    return c
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def add(app, title, created_at, is_public=True, user_id=1):
+    with app.app_context():
+        e = Entry(title=title, body="b", created_at=created_at,
+                  is_public=is_public, user_id=user_id)
+        db.session.add(e); db.session.commit()
+        return e.id
+
+def table(app):
+    with app.app_context():
+        return {(d.scope, d.day): d.count for d in db.session.query(EntryDay)
+                if d.count}
+
+def test_days_are_bucketed_in_jst():
+    app = make_app()
+    add(app, "深夜", utc(2024, 3, 1, 14, 59))   # JST 3/1 23:59
+    add(app, "日付が変わった", utc(2024, 3, 1, 15, 0))   # JST 3/2 00:00
+    assert table(app) == {
+        ("entries_public", date(2024, 3, 1)): 1, ("entries_public", date(2024, 3, 2)): 1,
+        ("entries_user:1", date(2024, 3, 1)): 1, ("entries_user:1", date(2024, 3, 2)): 1}
+
+    c = app.test_client()
+    html = c.get("/archive/2024/3/2").get_data(as_text=True)
+    assert "日付が変わった" in html and "深夜" not in html
+    html = c.get("/archive/2024/3/1").get_data(as_text=True)
+    assert "深夜" in html and "日付が変わった" not in html
+
+def test_other_timezone(monkeypatch):
+    monkeypatch.setenv("ARCHIVE_TZ", "UTC")
+    app = make_app()
+    add(app, "a", utc(2024, 3, 1, 15, 0))
+    assert ("entries_public", date(2024, 3, 1)) in table(app)
+
+def test_updated_on_create_update_delete():
+    app = make_app()
+    c = login(app)
+    token = csrf(c.get("/new").data)
+    r = c.post("/create", data={"title": "t", "body": "b", "csrf_token": token})
+    entry_id = int(r.headers["Location"].rsplit("/", 1)[-1])
+    with app.app_context():
+        today = archive.today()
+    assert table(app) == {("entries_public", today): 1, ("entries_user:1", today): 1}
+
+    # 非公開にすると公開分からだけ減る
+    token = csrf(c.get(f"/entry/{entry_id}/edit").data)
+    c.post(f"/entry/{entry_id}/update",
+           data={"title": "t", "body": "b", "private": "y", "csrf_token": token})
+    assert table(app) == {("entries_user:1", today): 1}
+
+    token = csrf(c.get("/").data)
+    c.post(f"/entry/{entry_id}/delete", data={"csrf_token": token})
+    assert table(app) == {}
+
+def test_rebuild_matches_incremental():
+    app = make_app()
+    for i in range(30):
+        add(app, f"e{i}", utc(2023, 12, 31, i % 24, i), is_public=i % 3 != 0,
+            user_id=None if i % 5 == 0 else 1)
+    before = table(app)
+    with app.app_context():
+        db.session.execute(db.delete(EntryDay)); db.session.commit()
+    r = app.test_cli_runner().invoke(args=["rebuild_archive"])
+    assert r.exit_code == 0, r.output
+    assert table(app) == before
+
+def test_import_updates_days():
+    app = make_app()
+    with app.app_context():
+        transfer.import_rows([
+            {"title": "a", "body": "b", "created_at": "2022-05-05T00:00:00+09:00"},
+            {"title": "b", "body": "b", "created_at": "2022-05-04T15:30:00+00:00",
+             "is_public": False},
+        ], user_id=1)
+    assert table(app) == {("entries_public", date(2022, 5, 5)): 1,
+                          ("entries_user:1", date(2022, 5, 5)): 2}
+
+def test_first_entry_of_a_day_is_upserted():
+    app = make_app()
+    day = date(2024, 1, 1)
+    with app.app_context():
+        # 別のトランザクションが先にその日の行を作っていても主キーで落ちない
+        db.session.add(EntryDay(scope="entries_public", day=day, count=1))
+        db.session.commit()
+        seen = []
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, *args):
+            if "entry_days" in statement:
+                seen.append(statement)
+        archive.bump_days(db.session, Tally({("entries_public", day): 2,
+                                             ("entries_user:1", day): 1}))
+        db.session.commit()
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(seen) == 2 and all("ON CONFLICT" in s for s in seen)
+    assert table(app) == {("entries_public", day): 3, ("entries_user:1", day): 1}
+
+def test_year_page_and_scopes():
+    app = make_app()
+    add(app, "公開", utc(2024, 1, 10, 3))
+    add(app, "非公開", utc(2024, 1, 10, 4), is_public=False)
+    add(app, "去年", utc(2023, 6, 1, 3))
+
+    anon = app.test_client()
+    html = anon.get("/archive").get_data(as_text=True)
+    assert "2024年のアーカイブ" in html and "2023年（1）" in html
+    assert "全1件" in html and 'class="level-4"' in html
+    html = anon.get("/archive/2024/1").get_data(as_text=True)
+    assert "公開" in html and "非公開" not in html
+
+    c = login(app)
+    html = c.get("/archive/2024").get_data(as_text=True)
+    assert "全2件" in html
+    assert "非公開" in c.get("/archive/2024/1/10").get_data(as_text=True)
+    assert "全1件" in c.get("/archive/2024?scope=public").get_data(as_text=True)
+
+def test_invalid_dates_are_404():
+    app = make_app()
+    c = app.test_client()
+    assert c.get("/archive/2024/2/30").status_code == 404
+    assert c.get("/archive/2024/13").status_code == 404
+    assert c.get("/archive/0").status_code == 404
+
+def test_heatmap_levels():
+    days = {date(2024, 1, 1): 1, date(2024, 1, 2): 4, date(2024, 12, 31): 2}
+    rows = archive.heatmap(days, 2024)
+    assert len(rows) == 7 and len({len(r) for r in rows}) == 1
+    cells = {c["day"]: c for r in rows for c in r if c}
+    assert len(cells) == 366
+    assert [cells[d]["level"] for d in days] == [1, 4, 2]
+    # 2024/1/1 は月曜なので1列目の先頭
+    assert rows[0][0]["day"] == date(2024, 1, 1)
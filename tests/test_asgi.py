@@ -0,0 +1,167 @@
+import os, re, asyncio
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, User
+import asgi
+
+FAST = "pbkdf2:sha256:1000"
+CONTENT = b"\x89PNG\r\n\x1a\n" + b"0123456789" * 5000
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(monkeypatch, tmp_path, **config):
+    # 非同期エンジンは別接続なので、メモリ上ではなくファイルの DB にする
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path}/asgi.db")
+    flask_app = create_app()
+    flask_app.config.update(TESTING=True, UPLOAD_FOLDER=str(tmp_path / "up"),
+                            PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off")
+    flask_app.config.update(config)
+    with flask_app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        db.session.add(Entry(title="Pub", body="public body", user_id=u.id,
+                             image_path="abc123.png"))
+        db.session.add(Entry(title="Secret", body="private body", user_id=u.id,
+                             is_public=False))
+        db.session.commit()
+    (tmp_path / "up").mkdir(exist_ok=True)
+    (tmp_path / "up" / "abc123.png").write_bytes(CONTENT)
+    return asgi.create_asgi(flask_app)
+
+class Client:
+    """ASGI アプリを直接呼ぶ。Set-Cookie は覚えて次に送る。"""
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies = {}
+
+    async def request(self, method, path, body=b"", headers=()):
+        path, _, query = path.partition("?")
+        headers = list(headers)
+        if self.cookies:
+            headers.append(("cookie", "; ".join(f"{k}={v}" for k, v in self.cookies.items())))
+        if body:
+            headers += [("content-type", "application/x-www-form-urlencoded"),
+                        ("content-length", str(len(body)))]
+        scope = {"type": "http", "method": method, "path": path, "root_path": "",
+                 "query_string": query.encode(), "http_version": "1.1", "scheme": "http",
+                 "server": ("testserver", 80), "client": ("127.0.0.1", 1234),
+                 "headers": [(k.encode(), v.encode()) for k, v in headers]}
+        sent, received = [], False
+
+        async def receive():
+            nonlocal received
+            if received:
+                await asyncio.sleep(3600)
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+        start = sent[0]
+        out = {}
+        for k, v in start["headers"]:
+            k, v = k.decode(), v.decode()
+            if k == "set-cookie":
+                name, _, value = v.split(";", 1)[0].partition("=")
+                self.cookies[name] = value
+            out[k] = v
+        return start["status"], out, b"".join(m.get("body", b"") for m in sent[1:])
+
+def run(app, *coros):
+    async def main():
+        try:
+            return [await c for c in coros]
+        finally:
+            await app.aclose()
+    return asyncio.run(main())
+
+def login_cookie(app):
+    c = app.flask.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+    return c.get_cookie("session").value
+
+def test_async_url():
+    assert asgi.async_url("sqlite:////tmp/x.db") == "sqlite+aiosqlite:////tmp/x.db"
+    assert asgi.async_url("postgresql://u:p@h/db") == "postgresql+psycopg://u:p@h/db"
+    assert asgi.async_url("postgresql+psycopg://u:p@h/db") == "postgresql+psycopg://u:p@h/db"
+    with pytest.raises(ValueError):
+        asgi.async_url("sqlite:///:memory:")
+
+def test_read_routes_use_async_engine(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, tmp_path)
+    sync_sql = []
+    with app.flask.app_context():
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda *a: sync_sql.append(a[2]))
+    c = Client(app)
+    (s1, _, index), (s2, _, detail), (s3, _, _) = run(
+        app, c.request("GET", "/"), c.request("GET", "/entry/1"),
+        c.request("GET", "/entry/2"))
+    assert s1 == 200 and b"Pub" in index and b"Secret" not in index
+    assert s2 == 200 and b"public body" in detail
+    assert s3 == 404                      # 他人の非公開
+    assert app.stats["async"] == 3 and sync_sql == []
+
+def test_json_api_is_served_async(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, tmp_path)
+    c = Client(app)
+    (status, headers, body), = run(app, c.request("GET", "/api/v1/entries?fields=id,title"))
+    assert status == 200 and headers["content-type"] == "application/json"
+    assert b'"title":"Pub"' in body and b"Secret" not in body
+    assert app.stats["async"] == 1
+
+def test_concurrent_reads(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, tmp_path, RENDER_CACHE="off")
+    c = Client(app)
+
+    async def many():
+        return await asyncio.gather(*[c.request("GET", f"/entry/{1 + i % 2}")
+                                      for i in range(20)])
+    (results,) = run(app, many())
+    assert [s for s, _, _ in results] == [200, 404] * 10
+
+def test_session_user_and_writes_through_wsgi(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, tmp_path)
+    c = Client(app)
+    c.cookies["session"] = login_cookie(app)
+
+    async def flow():
+        _, _, index = await c.request("GET", "/")
+        assert b"Secret" in index
+        status, _, detail = await c.request("GET", "/entry/2")
+        assert status == 200 and b"private body" in detail
+        # 書き込みは従来の Flask（スレッド）で。描画キャッシュの無効化も効く
+        _, _, form = await c.request("GET", "/new")
+        body = f"title=Fresh&body=b&csrf_token={csrf(form)}".encode()
+        status, headers, _ = await c.request("POST", "/create", body)
+        assert status == 302
+        _, _, index = await c.request("GET", "/")
+        assert b"Fresh" in index
+    run(app, flow())
+    assert app.stats["wsgi"] == 2 and app.stats["async"] == 3
+
+def test_uploads_streamed_with_cache_headers(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, tmp_path)
+    c = Client(app)
+    (s1, h1, b1), (s2, _, b2), (s3, h3, b3), (s4, _, _) = run(
+        app, c.request("GET", "/uploads/abc123.png"),
+        c.request("GET", "/uploads/abc123.png", headers=[("if-none-match", '"abc123.png"')]),
+        c.request("HEAD", "/uploads/abc123.png"),
+        c.request("GET", "/uploads/nope.png"))
+    assert s1 == 200 and b1 == CONTENT and "immutable" in h1["cache-control"]
+    assert s2 == 304 and b2 == b""
+    assert s3 == 200 and b3 == b"" and h3["content-length"] == str(len(CONTENT))
+    assert s4 == 404
+    assert app.stats["thread"] == 4
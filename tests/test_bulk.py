@@ -0,0 +1,187 @@
+import os, re, io, json, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, EntryDay, EntryRevision, Blob, User
+import bulk, counts, search, transfer
+
+FAST = "pbkdf2:sha256:1000"
+PNG = b"\x89PNG\r\n\x1a\n" + b"bulk" * 500
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off",
+                      IMAGE_PROCESSING="off", UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"),
+                      **config)
+    with app.app_context():
+        db.create_all()
+        for name in ("alice", "bob"):
+            u = User(username=name); u.set_password("pass1234")
+            db.session.add(u)
+        db.session.commit()
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+    return app, c
+
+def create(c, title, image=None, private=False):
+    token = csrf(c.get("/new").data)
+    data = {"title": title, "body": f"{title} の本文", "csrf_token": token}
+    if image:
+        data["image"] = (io.BytesIO(image), "x.png")
+    if private:
+        data["private"] = "y"
+    r = c.post("/create", data=data, content_type="multipart/form-data")
+    assert r.status_code == 302
+    return int(r.headers["Location"].rsplit("/", 1)[-1])
+
+def add(app, title, user_id):
+    with app.app_context():
+        e = Entry(title=title, body="b", user_id=user_id)
+        db.session.add(e); db.session.commit()
+        return e.id
+
+def bulk_post(c, op, ids, **extra):
+    token = csrf(c.get("/").data)
+    return c.post("/entries/bulk", data={"op": op, "ids": [str(i) for i in ids],
+                                         "csrf_token": token, **extra})
+
+def files(app):
+    root = Path(app.config["UPLOAD_FOLDER"])
+    return sorted(p.name for p in root.rglob("*") if p.is_file() and ".tmp" not in p.parts)
+
+def state(app):
+    """(残っている id, 件数カウンタ, entry_days, blobs)"""
+    with app.app_context():
+        counts.clear_cache()
+        # 範囲の行は初めて読まれたときに作られ、以後は増減で保たれる
+        for owner in (None, 1):
+            counts.scope_total(counts.scope(owner))
+        return (sorted(db.session.scalars(db.select(Entry.id))),
+                {c.name: c.value for c in db.session.query(counts.Counter)
+                 if c.name != counts.VERSION},
+                {(d.scope, d.day): d.count for d in db.session.query(EntryDay) if d.count},
+                {b.key: b.refcount for b in db.session.query(Blob)})
+
+def test_bulk_delete_updates_counts_and_removes_files():
+    app, c = make_app()
+    shared = create(c, "共有1", PNG)
+    keep = create(c, "共有2", PNG)
+    solo = create(c, "単独", PNG + b"solo")
+    plain = create(c, "画像なし", private=True)
+    others = add(app, "bob の日記", 2)
+    # 版の履歴も一緒に消える
+    with app.app_context():
+        db.session.get(Entry, plain).body = "編集"
+        db.session.commit()
+    assert len(files(app)) == 2
+    state(app)
+
+    r = bulk_post(c, "delete", [shared, solo, plain, others, 9999])
+    assert r.status_code == 302
+    assert "3件を削除しました（2件はそのまま）" in c.get(r.headers["Location"]).get_data(as_text=True)
+
+    ids, counters, days, blobs = state(app)
+    assert ids == [keep, others]
+    assert counters["entries"] == 2 and counters["entries_user:1"] == 1
+    assert counters["entries_public"] == 2
+    assert sum(n for (scope, _), n in days.items() if scope == "entries_user:1") == 1
+    assert list(blobs.values()) == [1]
+    # 共有していた画像は残り、単独の画像はコミット後に消える
+    assert len(files(app)) == 1
+    with app.app_context():
+        assert db.session.query(EntryRevision).count() == 0
+        stmt, _ = search.apply_search(db.select(Entry.id), "単独")
+        assert db.session.scalars(stmt).all() == []
+    # 一覧（描画キャッシュ）からも消える
+    html = c.get("/").get_data(as_text=True)
+    assert "単独" not in html and "共有2" in html
+
+def test_failure_in_a_later_chunk_rolls_everything_back():
+    app, c = make_app()
+    ids = [create(c, f"e{i}", PNG + bytes([i])) for i in range(5)]
+    before, before_files = state(app), files(app)
+
+    with app.app_context():
+        seen = []
+
+        def fail_second_chunk(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("DELETE FROM entries "):
+                seen.append(statement)
+                if len(seen) == 2:
+                    raise RuntimeError("disk full")
+
+        event.listen(db.engine, "before_cursor_execute", fail_second_chunk)
+        try:
+            with pytest.raises(RuntimeError):
+                bulk.delete(ids, user_id=1, chunk_size=2)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", fail_second_chunk)
+    assert len(seen) == 2
+    assert state(app) == before
+    assert files(app) == before_files
+
+    with app.app_context():
+        assert bulk.delete(ids, user_id=1, chunk_size=2) == 5
+    assert state(app)[0] == [] and files(app) == []
+
+def test_bulk_visibility():
+    app, c = make_app()
+    a, b = create(c, "一つ目"), create(c, "二つ目", private=True)
+    others = add(app, "bob の日記", 2)
+    state(app)
+
+    r = bulk_post(c, "private", [a, b, others])
+    assert "1件を非公開にしました（2件はそのまま）" in c.get(r.headers["Location"]).get_data(as_text=True)
+    _, counters, days, _ = state(app)
+    assert counters["entries_public"] == 1 and counters["entries_user:1"] == 2
+    assert sum(n for (scope, _), n in days.items() if scope == "entries_public") == 1
+    anon = app.test_client().get("/?scope=public").get_data(as_text=True)
+    assert "一つ目" not in anon and "bob の日記" in anon
+
+    bulk_post(c, "public", [a, b])
+    _, counters, days, _ = state(app)
+    assert counters["entries_public"] == 3
+    assert sum(n for (scope, _), n in days.items() if scope == "entries_public") == 3
+
+def test_export_selected():
+    app, c = make_app()
+    a, b = create(c, "選ぶ"), create(c, "選ばない")
+    others = add(app, "bob の日記", 2)
+    r = bulk_post(c, "export.jsonl", [a, others])
+    assert r.status_code == 200
+    rows = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert [row["title"] for row in rows] == ["選ぶ"]
+
+    # 区切って引いても（bulk.CHUNK 件ずつ）選んだ分だけが1回ずつ
+    with app.app_context():
+        data = b"".join(transfer.export("jsonl", user_id=1, ids=range(1, 1200)))
+    assert len(data.splitlines()) == 2
+
+def test_requires_csrf_and_valid_input():
+    app, c = make_app()
+    a = create(c, "t")
+    assert c.post("/entries/bulk", data={"op": "delete", "ids": [str(a)]}).status_code == 400
+    assert bulk_post(c, "drop", [a]).status_code == 400
+    assert bulk_post(c, "delete", ["x"]).status_code == 400
+    r = bulk_post(c, "delete", [])
+    assert "日記を選んでください" in c.get(r.headers["Location"]).get_data(as_text=True)
+    assert state(app)[0] == [a]
+    assert app.test_client().post("/entries/bulk").status_code in (302, 400, 401)
+
+def test_checkboxes_only_on_own_list():
+    app, c = make_app()
+    a = create(c, "t")
+    html = c.get("/").get_data(as_text=True)
+    assert f'name="ids" value="{a}" form="bulk"' in html and 'id="bulk"' in html
+    html = c.get("/?scope=public").get_data(as_text=True)
+    assert 'form="bulk"' not in html and 'id="bulk"' not in html
@@ -0,0 +1,150 @@
+import os, sqlite3
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, Counter
+import counts
+
+def make_app_with_entries(n=3):
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        for i in range(n):
+            db.session.add(Entry(title=f"日記{i+1}", body="今日は晴れ"))
+        db.session.commit()
+    return app
+
+def get_html(client, path):
+    r = client.get(path)
+    assert r.status_code == 200
+    return r.get_data(as_text=True)
+
+class CountQueries:
+    """entries に対する count(*) の発行回数を数える"""
+    def __init__(self, app):
+        self.n = 0
+        with app.app_context():
+            self.engine = db.engine
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on)
+        return self
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on)
+    def _on(self, conn, cursor, statement, *args):
+        if "count(*)" in statement.lower():
+            self.n += 1
+
+def test_total_uses_maintained_counter():
+    app = make_app_with_entries(3)
+    c = app.test_client()
+    assert "全3件" in get_html(c, "/")
+
+    with CountQueries(app) as cq:
+        assert "全3件" in get_html(c, "/")
+        with app.app_context():
+            db.session.add(Entry(title="追加", body="x"))
+            db.session.commit()
+        assert "全4件" in get_html(c, "/")
+        with app.app_context():
+            db.session.delete(db.session.get(Entry, 1))
+            db.session.commit()
+        assert "全3件" in get_html(c, "/")
+    assert cq.n == 0
+
+def test_search_count_memoized_and_invalidated():
+    app = make_app_with_entries(3)
+    c = app.test_client()
+    assert "全3件" in get_html(c, "/?q=晴れ")
+
+    with CountQueries(app) as cq:
+        # 表記ゆれも同じキー
+        assert "全3件" in get_html(c, "/?q=晴れ")
+        assert "全3件" in get_html(c, "/?q=晴れ！")
+    assert cq.n == 0
+
+    # 更新で検索結果が変わればキャッシュは使わない
+    with app.app_context():
+        db.session.get(Entry, 1).body = "今日は雨"
+        db.session.commit()
+    assert "全2件" in get_html(c, "/?q=晴れ")
+
+    with app.app_context():
+        db.session.delete(db.session.get(Entry, 2))
+        db.session.commit()
+    assert "全1件" in get_html(c, "/?q=晴れ")
+
+def test_other_process_write_invalidates_by_version():
+    app = make_app_with_entries(2)
+    c = app.test_client()
+    assert "全2件" in get_html(c, "/?q=晴れ")
+    # 別ワーカーの書き込み: このプロセスのキャッシュは消えず version だけ進む
+    with app.app_context():
+        db.session.execute(db.insert(Entry).values(
+            title="別", body="晴れ", search_tokens="晴れ"))
+        db.session.execute(db.update(Counter)
+                             .where(Counter.name == counts.VERSION)
+                             .values(value=Counter.value + 1))
+        db.session.commit()
+    assert "全3件" in get_html(c, "/?q=晴れ")
+
+def test_recount_repairs_missing_counters():
+    app = make_app_with_entries(5)
+    with app.app_context():
+        db.session.execute(db.delete(Counter))
+        db.session.commit()
+    assert "全5件" in get_html(app.test_client(), "/")
+
+def test_scope_row_created_outside_request_session():
+    app = make_app_with_entries(2)
+    with app.app_context():
+        pending = Entry(title="未保存", body="b")
+        db.session.add(pending)
+        assert counts.scope_total(counts.scope(None)) == 2
+        # 数えて行を作っても、セッションの中身はコミットも破棄もしない
+        assert pending in db.session.new
+        db.session.rollback()
+        assert db.session.get(Counter, counts.PUBLIC).value == 2
+
+def test_writes_wait_while_scope_is_counted(monkeypatch, tmp_path):
+    path = tmp_path / "t.db"
+    monkeypatch.setenv("DB_URL", f"sqlite:///{path}")
+    app = make_app_with_entries(2)
+    blocked = []
+
+    def write_meanwhile(conn, cursor, statement, *args):
+        if "count(*)" in statement.lower() and not blocked:
+            other = sqlite3.connect(path, timeout=0.1)
+            try:
+                other.execute("UPDATE counters SET value = value + 1")
+                blocked.append(False)
+            except sqlite3.OperationalError:
+                blocked.append(True)
+            finally:
+                other.close()
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", write_meanwhile)
+        assert counts.scope_total(counts.scope(None)) == 2
+    # 数えてから行を作るまでの間、別の接続からは書けない
+    assert blocked == [True]
+
+def test_recount_command_repairs_drift():
+    app = make_app_with_entries(4)
+    with app.app_context():
+        counts.scope_total(counts.scope(None))
+        db.session.execute(db.update(Counter).values(value=99))
+        db.session.commit()
+    r = app.test_cli_runner().invoke(args=["recount"])
+    assert r.exit_code == 0, r.output
+    html = get_html(app.test_client(), "/")
+    assert "全4件" in html
+    with app.app_context():
+        assert db.session.get(Counter, counts.PUBLIC).value == 4
+
+def test_estimated_mode_falls_back_to_exact_on_sqlite():
+    app = make_app_with_entries(2)
+    app.config["COUNT_MODE"] = "estimated"
+    html = get_html(app.test_client(), "/")
+    assert "全2件" in html and "約" not in html
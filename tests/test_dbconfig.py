@@ -0,0 +1,44 @@
+import os, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import text
+
+from app import create_app
+from models import db
+import dbconfig
+
+def test_pool_options_for_server_databases(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "12")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "3000")
+    opts = dbconfig.engine_options("postgresql+psycopg://u:p@db/diary")
+    assert opts["pool_size"] == 12 and opts["pool_pre_ping"] is True
+    assert opts["connect_args"] == {"options": "-c statement_timeout=3000"}
+    assert dbconfig.engine_options("sqlite:///diary.db") == {}
+
+def test_sqlite_pragmas_applied_on_connect(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), "t.db")
+    monkeypatch.setenv("DB_URL", f"sqlite:///{path}")
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "1234")
+    app = create_app()
+    with app.app_context():
+        pragma = lambda name: db.session.execute(text(f"PRAGMA {name}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("busy_timeout") == 1234
+        assert pragma("synchronous") == 1   # NORMAL
+
+def test_empty_pragma_keeps_driver_default(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), "t.db")
+    monkeypatch.setenv("DB_URL", f"sqlite:///{path}")
+    monkeypatch.setenv("SQLITE_JOURNAL_MODE", "")
+    app = create_app()
+    with app.app_context():
+        assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+
+def test_dispose_after_fork(monkeypatch):
+    app = create_app()
+    with app.app_context():
+        db.session.execute(text("SELECT 1"))
+        db.session.remove()
+    dbconfig.dispose(app)
+    with app.app_context():
+        assert db.session.execute(text("SELECT 1")).scalar() == 1
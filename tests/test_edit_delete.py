@@ -20,7 +20,10 @@ def make_app_with_one():
     app.config.update(TESTING=True)  # CSRFは有効のまま
     with app.app_context():
         db.create_all()
-        e = Entry(title="Before", body="Old body")
+        # 編集・削除できるのは所有者だけなので alice の日記にしておく
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        e = Entry(title="Before", body="Old body", user_id=u.id)
         db.session.add(e)
         db.session.commit()
     return app
@@ -0,0 +1,98 @@
+import os, re, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, User
+import excerpts
+import transfer
+
+LONG = "一行目の本文。\n\n  二行目   も続く。" + "あ" * 3000
+
+def make_app():
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD="pbkdf2:sha256:1000",
+                      RATE_LIMIT_STORE="off", RENDER_CACHE="off")
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        db.session.add(Entry(title="Long", body=LONG, user_id=u.id))
+        db.session.add(Entry(title="Short", body="短い", user_id=u.id))
+        db.session.commit()
+    return app
+
+def login(c):
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"',
+                      c.get("/login").data, re.S).group(1).decode()
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+
+def sql_log(app):
+    seen = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda *a: seen.append(a[2]))
+    return seen
+
+def test_make_excerpt():
+    assert excerpts.make_excerpt(" a\n\n b\tc ") == "a b c"
+    assert len(excerpts.make_excerpt("x" * 1000)) == excerpts.EXCERPT_CHARS
+    assert excerpts.body_fields("本文") == {"excerpt": "本文", "body_length": 2}
+
+def test_saved_with_entry_and_shown_in_list():
+    app = make_app()
+    with app.app_context():
+        e = db.session.execute(db.select(Entry).where(Entry.title == "Long")).scalar_one()
+        assert e.excerpt.startswith("一行目の本文。 二行目 も続く。")
+        assert e.body_length == len(LONG)
+    html = app.test_client().get("/").get_data(as_text=True)
+    assert "一行目の本文。 二行目 も続く。" in html and "…" in html
+    assert "短い" in html
+
+def test_list_does_not_load_body():
+    app = make_app()
+    c = app.test_client()
+    c.get("/")
+    seen = sql_log(app)
+    c.get("/")
+    c.get("/?q=本文")
+    listing = [s for s in seen if "FROM entries" in s]
+    assert listing
+    assert not any(re.search(r"entries\.(body|search_tokens)\b", s) for s in listing)
+    # 詳細は本文を1回で読む
+    seen.clear()
+    assert "二行目" in c.get("/entry/1").get_data(as_text=True)
+    assert sum("FROM entries" in s for s in seen) == 2   # 権限の確認 + 本文
+
+def test_update_refreshes_excerpt_but_other_changes_do_not_read_body():
+    app = make_app()
+    c = app.test_client()
+    login(c)
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"',
+                      c.get("/entry/1/edit").data, re.S).group(1).decode()
+    c.post("/entry/1/update", data={"title": "Long", "body": "書き直した", "csrf_token": token})
+    with app.app_context():
+        e = db.session.get(Entry, 1)
+        assert (e.excerpt, e.body_length) == ("書き直した", 5)
+        seen = sql_log(app)
+        e.is_public = False
+        db.session.commit()
+        assert not any(re.search(r"SELECT .*entries\.body\b", s, re.S) for s in seen)
+        assert db.session.get(Entry, 1).excerpt == "書き直した"
+
+def test_import_fills_excerpt():
+    src = make_app()
+    with src.app_context():
+        data = b"".join(transfer.export("jsonl"))
+    path = os.path.join(tempfile.mkdtemp(), "entries.jsonl")
+    Path(path).write_bytes(data)
+    dst = create_app()
+    dst.config.update(TESTING=True)
+    with dst.app_context():
+        db.create_all()
+        transfer.import_file(path)
+        rows = db.session.execute(
+            db.select(Entry.title, Entry.excerpt, Entry.body_length).order_by(Entry.id)).all()
+    assert rows[0].excerpt.startswith("一行目") and rows[0].body_length == len(LONG)
+    assert rows[1] == ("Short", "短い", 2)
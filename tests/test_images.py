@@ -0,0 +1,130 @@
+import os, re, io, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+from PIL import Image
+
+from app import create_app
+from models import db, Entry, User
+import images
+import storage
+
+def login_as_alice(app, client):
+    with app.app_context():
+        if not db.session.execute(db.select(User).where(User.username=="alice")).scalar_one_or_none():
+            u = User(username="alice"); u.set_password("pass1234")
+            db.session.add(u); db.session.commit()
+    r = client.get("/login")
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', r.data, re.S).group(1).decode()
+    client.post("/login", data={"username":"alice","password":"pass1234","csrf_token":token}, follow_redirects=True)
+
+def extract_csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app_tmp_upload():
+    app = create_app()
+    app.config.update(TESTING=True)
+    app.config["UPLOAD_FOLDER"] = tempfile.mkdtemp(prefix="up_")
+    with app.app_context():
+        db.create_all()
+    return app
+
+def jpeg_with_exif(size=(2000, 1500)) -> bytes:
+    im = Image.new("RGB", size, (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x010F] = "TestCamera"   # Make
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", exif=exif)
+    return buf.getvalue()
+
+def upload(app, c, content, name="photo.jpg"):
+    login_as_alice(app, c)
+    token = extract_csrf(c.get("/new").data)
+    return c.post("/create", data={
+        "title": "写真", "body": "body", "csrf_token": token,
+        "image": (io.BytesIO(content), name),
+    }, content_type="multipart/form-data", follow_redirects=True)
+
+def test_variants_generated_and_exif_stripped():
+    app = make_app_tmp_upload()
+    c = app.test_client()
+    r = upload(app, c, jpeg_with_exif())
+    assert r.status_code == 200
+
+    folder = Path(app.config["UPLOAD_FOLDER"])
+    with app.app_context():
+        e = db.session.query(Entry).first()
+        assert (e.image_width, e.image_height) == (2000, 1500)
+        assert e.image_variants == "webp,jpg"
+        name = e.image_path
+
+    for variant, width in images.VARIANTS.items():
+        for ext in ("webp", "jpg"):
+            with Image.open(folder / images.variant_name(name, variant, ext)) as im:
+                assert im.width == width
+                assert not im.getexif()
+
+    html = r.get_data(as_text=True)
+    assert 'srcset="' in html and "320w" in html and "1024w" in html
+    assert 'width="1024" height="768"' in html
+    assert 'type="image/webp"' in html
+
+def test_small_image_is_not_upscaled():
+    app = make_app_tmp_upload()
+    c = app.test_client()
+    upload(app, c, jpeg_with_exif((200, 100)))
+    with app.app_context():
+        e = db.session.query(Entry).first()
+        assert images.variant_size(e.image_width, e.image_height, "medium") == (200, 100)
+
+def test_non_image_keeps_original_only():
+    app = make_app_tmp_upload()
+    c = app.test_client()
+    r = upload(app, c, b"\x89PNG\r\n\x1a\nfakepng", name="x.png")
+    assert r.status_code == 200
+    with app.app_context():
+        e = db.session.query(Entry).first()
+        assert e.image_path and e.image_variants is None
+    assert "srcset" not in r.get_data(as_text=True)
+
+def test_missing_variant_is_regenerated_on_request():
+    app = make_app_tmp_upload()
+    c = app.test_client()
+    upload(app, c, jpeg_with_exif())
+    with app.app_context():
+        name = db.session.query(Entry).first().image_path
+    thumb = images.variant_name(name, "thumb", "webp")
+    (Path(app.config["UPLOAD_FOLDER"]) / thumb).unlink()
+
+    r = c.get(f"/uploads/{thumb}")
+    assert r.status_code == 200
+    assert r.mimetype == "image/webp"
+
+def test_oversized_image_is_refused_without_500(monkeypatch):
+    app = make_app_tmp_upload()
+    folder = Path(app.config["UPLOAD_FOLDER"])
+    (folder / "big.jpg").write_bytes(jpeg_with_exif((640, 480)))
+    with app.app_context():
+        db.session.add(Entry(title="big", body="x", image_path="big.jpg"))
+        db.session.commit()
+    c = app.test_client()
+    # 2倍を超える（open で DecompressionBombError）と、上限を少し超えるだけの場合
+    for limit in (100_000, 300_000):
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", limit)
+        with app.app_context():
+            assert images.generate_variants(storage.get_storage(), "big.jpg") is None
+        assert c.get("/uploads/big_thumb.webp").status_code == 404
+    assert not (folder / "big_thumb.webp").exists()
+
+def test_backfill_processes_existing_uploads():
+    app = make_app_tmp_upload()
+    folder = Path(app.config["UPLOAD_FOLDER"])
+    (folder / "old.jpg").write_bytes(jpeg_with_exif((640, 480)))
+    with app.app_context():
+        e = Entry(title="old", body="x", image_path="old.jpg")
+        db.session.add(e); db.session.commit()
+        assert images.process_entry_image(storage.get_storage(), e.id)
+        assert db.session.get(Entry, e.id).image_width == 640
+    assert (folder / "old_thumb.jpg").exists()
@@ -0,0 +1,188 @@
+import os, re, io, tempfile, threading, time
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from PIL import Image
+
+from app import create_app
+from models import db, Entry, User, Job
+import jobs
+
+def login_as_alice(app, client):
+    with app.app_context():
+        if not db.session.execute(db.select(User).where(User.username=="alice")).scalar_one_or_none():
+            u = User(username="alice"); u.set_password("pass1234")
+            db.session.add(u); db.session.commit()
+    r = client.get("/login")
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', r.data, re.S).group(1).decode()
+    client.post("/login", data={"username":"alice","password":"pass1234","csrf_token":token}, follow_redirects=True)
+
+def extract_csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"),
+                      IMAGE_PROCESSING="queue", **config)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def png():
+    buf = io.BytesIO()
+    Image.new("RGB", (800, 600), (10, 200, 30)).save(buf, "PNG")
+    return buf.getvalue()
+
+def create_with_image(c):
+    token = extract_csrf(c.get("/new").data)
+    r = c.post("/create", data={"title": "t", "body": "b", "csrf_token": token,
+                                "image": (io.BytesIO(png()), "a.png")},
+               content_type="multipart/form-data")
+    assert r.status_code == 302
+    return int(r.headers["Location"].rsplit("/", 1)[-1])
+
+calls = []
+
+@jobs.task("test.flaky")
+def flaky(fail_times):
+    calls.append(1)
+    if len(calls) <= fail_times:
+        raise RuntimeError("boom")
+
+def test_image_variants_run_out_of_band():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    entry_id = create_with_image(c)
+    with app.app_context():
+        assert db.session.get(Entry, entry_id).image_variants is None
+        job = db.session.execute(db.select(Job)).scalar_one()
+        assert (job.kind, job.status) == ("images.variants", "queued")
+        assert jobs.run_pending() == 1
+        assert db.session.get(Entry, entry_id).image_variants
+        assert db.session.get(Job, job.id).status == "done"
+
+def test_retry_with_backoff_then_fail():
+    app = make_app(JOB_MAX_ATTEMPTS=2)
+    calls.clear()
+    with app.app_context():
+        job = jobs.enqueue("test.flaky", fail_times=5)
+        db.session.commit()
+        assert jobs.run_one()
+        job = db.session.get(Job, job.id)
+        assert (job.status, job.attempts) == ("queued", 1)
+        assert "boom" in job.last_error
+        assert not jobs.run_one()             # バックオフ中
+        job.run_at = datetime.now(timezone.utc)
+        db.session.commit()
+        assert jobs.run_one()
+        assert db.session.get(Job, job.id).status == "failed"
+        assert len(calls) == 2
+
+def test_stale_running_job_is_reclaimed():
+    app = make_app()
+    calls.clear()
+    with app.app_context():
+        job = jobs.enqueue("test.flaky", fail_times=0)
+        db.session.commit()
+        assert jobs.claim("dead-worker") is not None
+        assert jobs.claim("other") is None        # 実行中は取らない
+        job.locked_at = datetime.now(timezone.utc) - timedelta(seconds=600)
+        db.session.commit()
+        assert jobs.run_one("other", timeout=300)
+        job = db.session.get(Job, job.id)
+        assert job.status == "done"
+        assert job.attempts == 1                  # 取り直しは失敗1回に数える
+
+def test_job_that_keeps_killing_workers_is_given_up():
+    app = make_app()
+    calls.clear()
+    with app.app_context():
+        job = jobs.enqueue("test.flaky", max_attempts=2, fail_times=0)
+        db.session.commit()
+        for _ in range(2):
+            assert jobs.claim("dead-worker") is not None
+            job.locked_at = datetime.now(timezone.utc) - timedelta(seconds=600)
+            db.session.commit()
+        assert jobs.claim("other") is None
+        job = db.session.get(Job, job.id)
+        assert job.status == "failed" and job.attempts == 2
+        assert "dead-worker" in job.last_error
+        assert calls == []
+
+@jobs.task("test.reclaimed")
+def reclaimed(fail):
+    # locked_at を進められないうちに別のワーカーが取り直した、という状態にする
+    db.session.execute(db.update(Job).where(Job.kind == "test.reclaimed")
+                         .values(locked_by="other", attempts=Job.attempts + 1))
+    db.session.commit()
+    if fail:
+        raise RuntimeError("boom")
+
+def test_reclaimed_job_is_not_overwritten_by_old_worker():
+    app = make_app()
+    with app.app_context():
+        for fail in (False, True):
+            job = jobs.enqueue("test.reclaimed", fail=fail)
+            db.session.commit()
+            assert jobs.run_one("w1")
+            job = db.session.get(Job, job.id)
+            assert (job.status, job.locked_by, job.attempts) == ("running", "other", 1)
+            assert job.last_error is None
+            db.session.delete(job); db.session.commit()
+
+def test_heartbeat_keeps_long_job_claimed(monkeypatch, tmp_path):
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path / 't.db'}")
+    app = make_app()
+    seen = []
+
+    @jobs.task("test.slow")
+    def slow():
+        time.sleep(0.5)                           # timeout の3倍以上かかる
+        with db.engine.connect() as conn:
+            seen.append(conn.execute(db.select(db.func.count()).select_from(Job)
+                                     .where(jobs._ready(0.15))).scalar())
+
+    with app.app_context():
+        job = jobs.enqueue("test.slow")
+        db.session.commit()
+        assert jobs.run_one("w1", timeout=0.15)
+        assert db.session.get(Job, job.id).status == "done"
+    assert seen == [0]                            # 実行中に別のワーカーからは取れない
+
+def test_upload_cleanup_can_be_queued():
+    app = make_app(UPLOAD_GC="queue")
+    c = app.test_client()
+    login_as_alice(app, c)
+    entry_id = create_with_image(c)
+    root = Path(app.config["UPLOAD_FOLDER"])
+    token = extract_csrf(c.get("/").data)
+    c.post(f"/entry/{entry_id}/delete", data={"csrf_token": token})
+    uploads = lambda: [p for p in root.rglob("*") if p.is_file() and ".tmp" not in p.parts]
+    assert uploads()                              # まだ消えていない
+    with app.app_context():
+        jobs.run_pending()
+    assert uploads() == []
+
+def test_worker_thread_in_process():
+    app = make_app()
+    done = threading.Event()
+
+    @jobs.task("test.signal")
+    def signal():
+        done.set()
+
+    with app.app_context():
+        jobs.enqueue("test.signal")
+        db.session.commit()
+    w = jobs.Worker(app, concurrency=4, poll_interval=0.01)
+    assert w.concurrency == 1                     # SQLite は単一ライター
+    t = threading.Thread(target=w.run)
+    t.start()
+    assert done.wait(5)
+    w.stop(); t.join(5)
+    with app.app_context():
+        assert db.session.execute(db.select(Job.status)).scalar_one() == "done"
@@ -0,0 +1,71 @@
+import os, re
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry
+
+def make_app(monkeypatch, enabled=True, **env):
+    monkeypatch.setenv("METRICS", "1" if enabled else "0")
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        for i in range(3):
+            db.session.add(Entry(title=f"E{i+1}", body=f"body{i+1}"))
+        db.session.commit()
+    return app
+
+def test_server_timing_header(monkeypatch):
+    app = make_app(monkeypatch)
+    r = app.test_client().get("/entry/1")
+    timing = r.headers["Server-Timing"]
+    m = re.search(r'db;dur=[\d.]+;desc="(\d+) queries"', timing)
+    assert m and int(m.group(1)) >= 1
+    assert "render;dur=" in timing and "total;dur=" in timing
+
+def test_prometheus_export(monkeypatch):
+    app = make_app(monkeypatch)
+    c = app.test_client()
+    c.get("/"); c.get("/")
+    text = c.get("/metrics").get_data(as_text=True)
+    assert 'diary_requests_total{endpoint="index",method="GET",status="200"} 2' in text
+    assert 'diary_request_duration_seconds_count{endpoint="index",method="GET"} 2' in text
+    assert re.search(r'diary_sql_queries_total\{endpoint="index"\} [1-9]', text)
+    assert 'diary_render_cache_total{result="hits"} 1' in text
+    assert "diary_count_cache_total" in text
+
+def test_metrics_token(monkeypatch):
+    app = make_app(monkeypatch, METRICS_TOKEN="secret")
+    c = app.test_client()
+    assert c.get("/metrics").status_code == 403
+    assert c.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+def test_n_plus_one_and_slow_queries_are_flagged(monkeypatch, caplog):
+    app = make_app(monkeypatch, METRICS_N_PLUS_ONE="3", METRICS_SLOW_QUERY_MS="0")
+
+    @app.route("/_loop")
+    def loop():
+        for i in range(1, 4):
+            db.session.get(Entry, i)
+        return "ok"
+
+    c = app.test_client()
+    with caplog.at_level("WARNING", logger="metrics"):
+        c.get("/_loop")
+    assert any("N+1" in r.message for r in caplog.records)
+    text = c.get("/metrics").get_data(as_text=True)
+    assert 'diary_n_plus_one_total{endpoint="loop"} 1' in text
+    assert re.search(r'diary_slow_queries_total\{endpoint="loop"\} [3-9]', text)
+
+def test_disabled_adds_nothing(monkeypatch):
+    app = make_app(monkeypatch, enabled=False)
+    c = app.test_client()
+    assert "Server-Timing" not in c.get("/").headers
+    assert c.get("/metrics").status_code == 404
+    m = app.extensions["metrics"]
+    with app.app_context():
+        assert not event.contains(db.engine, "after_cursor_execute", m._after_sql)
@@ -0,0 +1,145 @@
+import os, re
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from app import create_app
+from models import db, Entry, User, Counter
+import counts
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def login(client, username):
+    token = csrf(client.get("/login").data)
+    client.post("/login", data={"username": username, "password": "pass1234",
+                                "csrf_token": token})
+
+def make_app():
+    """alice: 公開1・非公開1、bob: 公開1、所有者なし（移行前）: 1"""
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        users = {}
+        for name in ("alice", "bob"):
+            u = User(username=name); u.set_password("pass1234")
+            db.session.add(u); db.session.flush()
+            users[name] = u.id
+        db.session.add_all([
+            Entry(title="alice-public", body="天気のいい日", user_id=users["alice"]),
+            Entry(title="alice-private", body="天気の秘密", user_id=users["alice"], is_public=False),
+            Entry(title="bob-public", body="天気が悪い", user_id=users["bob"]),
+            Entry(title="legacy", body="移行前"),
+        ])
+        db.session.commit()
+    return app
+
+def entry_id(app, title):
+    with app.app_context():
+        return db.session.scalar(db.select(Entry.id).where(Entry.title == title))
+
+def test_anonymous_sees_public_entries_only():
+    app = make_app()
+    c = app.test_client()
+    html = c.get("/").get_data(as_text=True)
+    assert "alice-public" in html and "bob-public" in html and "legacy" in html
+    assert "alice-private" not in html and "全3件" in html
+    assert c.get(f"/entry/{entry_id(app, 'alice-private')}").status_code == 404
+    assert c.get(f"/entry/{entry_id(app, 'alice-public')}").status_code == 200
+
+def test_index_lists_own_entries_when_logged_in():
+    app = make_app()
+    c = app.test_client()
+    login(c, "alice")
+    html = c.get("/").get_data(as_text=True)
+    assert "alice-public" in html and "alice-private" in html and "［非公開］" in html
+    assert "bob-public" not in html and "legacy" not in html and "全2件" in html
+    html = c.get("/?scope=public").get_data(as_text=True)
+    assert "bob-public" in html and "alice-private" not in html
+
+def test_search_is_scoped():
+    app = make_app()
+    alice, bob = app.test_client(), app.test_client()
+    login(alice, "alice"); login(bob, "bob")
+    html = alice.get("/", query_string={"q": "天気"}).get_data(as_text=True)
+    assert "alice-private" in html and "bob-public" not in html and "全2件" in html
+    html = bob.get("/", query_string={"q": "天気"}).get_data(as_text=True)
+    assert "bob-public" in html and "alice" not in html
+    html = bob.get("/", query_string={"q": "天気", "scope": "public"}).get_data(as_text=True)
+    assert "alice-public" in html and "alice-private" not in html
+
+def test_narrow_search_matches_fts_search():
+    app = make_app()
+    c = app.test_client()
+    login(c, "alice")
+    pages = []
+    for narrow_max in (0, 1000):   # 全文索引から / 本人の行から
+        app.config["SEARCH_NARROW_MAX"] = narrow_max
+        app.extensions["render_cache"].backend.clear()
+        html = c.get("/", query_string={"q": "天気"}).get_data(as_text=True)
+        pages.append(re.findall(r'<a href="/entry/\d+">([^<]+)</a>', html))
+    assert pages[0] == pages[1] and "alice-private" in pages[1]
+
+def test_only_owner_can_edit_or_delete():
+    app = make_app()
+    c = app.test_client()
+    login(c, "bob")
+    token = csrf(c.get("/new").data)
+    for title in ("alice-public", "alice-private", "legacy"):
+        i = entry_id(app, title)
+        assert c.get(f"/entry/{i}/edit").status_code == 404
+        assert c.post(f"/entry/{i}/update", data={"title": "x", "body": "y", "csrf_token": token}).status_code == 404
+        assert c.post(f"/entry/{i}/delete", data={"csrf_token": token}).status_code == 404
+    assert entry_id(app, "alice-public") and entry_id(app, "legacy")
+    assert "編集" not in c.get(f"/entry/{entry_id(app, 'alice-public')}").get_data(as_text=True)
+    assert "編集" in c.get(f"/entry/{entry_id(app, 'bob-public')}").get_data(as_text=True)
+
+def test_create_private_and_toggle_keeps_scoped_counts():
+    app = make_app()
+    c = app.test_client()
+    login(c, "alice")
+    anon = app.test_client()
+    assert "全3件" in anon.get("/").get_data(as_text=True)
+    assert "全2件" in c.get("/").get_data(as_text=True)
+
+    token = csrf(c.get("/new").data)
+    c.post("/create", data={"title": "secret", "body": "b", "private": "y", "csrf_token": token})
+    i = entry_id(app, "secret")
+    assert "全3件" in c.get("/").get_data(as_text=True)
+    assert "全3件" in anon.get("/").get_data(as_text=True)
+    assert anon.get(f"/entry/{i}").status_code == 404
+
+    # 公開に切り替える（チェックを外して送る）
+    c.post(f"/entry/{i}/update", data={"title": "secret", "body": "b", "csrf_token": token})
+    assert "全4件" in anon.get("/").get_data(as_text=True)
+    assert anon.get(f"/entry/{i}").status_code == 200
+
+    c.post(f"/entry/{i}/delete", data={"csrf_token": token})
+    assert "全3件" in anon.get("/").get_data(as_text=True)
+    assert "全2件" in c.get("/").get_data(as_text=True)
+    with app.app_context():
+        names = dict(db.session.execute(db.select(Counter.name, Counter.value)).all())
+        assert names[counts.PUBLIC] == 3
+
+def test_assign_owner_claims_legacy_entries():
+    app = make_app()
+    r = app.test_cli_runner().invoke(args=["assign_owner", "bob"])
+    assert "1 件" in r.output
+    c = app.test_client()
+    login(c, "bob")
+    html = c.get("/").get_data(as_text=True)
+    assert "legacy" in html and "全2件" in html
+    assert c.get(f"/entry/{entry_id(app, 'legacy')}/edit").status_code == 200
+    r = app.test_cli_runner().invoke(args=["assign_owner", "nobody"])
+    assert r.exit_code != 0
+
+def test_owner_listing_uses_owner_index():
+    app = make_app()
+    with app.app_context():
+        uid = db.session.scalar(db.select(User.id).where(User.username == "alice"))
+        stmt = db.select(Entry).where(counts.scope(uid)[1]) \
+                 .order_by(Entry.created_at.desc(), Entry.id.desc()).limit(10)
+        sql = str(stmt.compile(db.engine, compile_kwargs={"literal_binds": True}))
+        plan = " ".join(str(r) for r in db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)))
+        assert "ix_entries_user_created_at_id" in plan and "TEMP B-TREE" not in plan
@@ -0,0 +1,126 @@
+import os, re, time
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from models import db, User
+import passwords
+import ratelimit
+
+FAST = "pbkdf2:sha256:1000"   # テストでは軽い方式にする
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(stored_method=FAST, **config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST)
+    app.config.update(config)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="alice", password_hash=generate_password_hash(
+            "pass1234", method=stored_method)))
+        db.session.commit()
+    return app
+
+def post_login(client, username="alice", password="pass1234"):
+    token = csrf(client.get("/login").data)
+    return client.post("/login", data={"username": username, "password": password,
+                                       "csrf_token": token})
+
+def stored_hash(app):
+    with app.app_context():
+        return db.session.scalar(db.select(User.password_hash).where(User.username == "alice"))
+
+def test_normalize_and_needs_rehash():
+    assert passwords.normalize_method("scrypt") == "scrypt:32768:8:1"
+    assert passwords.normalize_method("pbkdf2").startswith("pbkdf2:sha256:")
+    h = generate_password_hash("x", method="scrypt:16384:8:1")
+    assert passwords.needs_rehash(h, "scrypt:16384:8:1") is False
+    assert passwords.needs_rehash(h, "scrypt") is True
+    assert passwords.needs_rehash(h, FAST) is True
+
+def test_login_rehashes_when_policy_changed():
+    app = make_app(stored_method="pbkdf2:sha256:2000")
+    r = post_login(app.test_client())
+    assert r.status_code == 302
+    assert stored_hash(app).startswith(FAST + "$")
+    assert app.extensions["passwords"].stats["rehashed"] == 1
+    # 作り直した後も同じパスワードで入れる
+    assert post_login(app.test_client()).status_code == 302
+    assert app.extensions["passwords"].stats["rehashed"] == 1
+
+def test_wrong_password_and_unknown_user():
+    app = make_app()
+    before = stored_hash(app)
+    assert post_login(app.test_client(), password="nope").status_code == 400
+    assert post_login(app.test_client(), username="nobody").status_code == 400
+    assert stored_hash(app) == before
+    # 居ないユーザーでも照合はする（時間でユーザー名の有無が分からないように）
+    assert app.extensions["passwords"].stats["verified"] == 2
+
+def test_busy_returns_503_without_verifying():
+    app = make_app(PASSWORD_VERIFY_MAX_PENDING=0)
+    r = post_login(app.test_client())
+    assert r.status_code == 503 and r.headers["Retry-After"] == "1"
+    assert app.extensions["passwords"].stats == {"verified": 0, "rehashed": 0, "busy": 1}
+
+def test_verify_in_process_pool():
+    app = make_app(PASSWORD_VERIFY_WORKERS=1, PASSWORD_VERIFY_NICE=0)
+    hasher = app.extensions["passwords"]
+    try:
+        assert post_login(app.test_client()).status_code == 302
+        assert post_login(app.test_client(), password="nope").status_code == 400
+    finally:
+        hasher.shutdown()
+
+def test_timed_out_verify_counts_as_pending_until_it_finishes():
+    app = make_app(PASSWORD_VERIFY_WORKERS=1, PASSWORD_VERIFY_NICE=0,
+                   PASSWORD_VERIFY_TIMEOUT=0.01, PASSWORD_VERIFY_MAX_PENDING=1)
+    hasher = app.extensions["passwords"]
+    stored = stored_hash(app)
+    try:
+        with app.app_context():
+            with pytest.raises(passwords.Busy):
+                hasher.verify(stored, "pass1234")
+            # 待つのはやめても照合はまだ走っている。その分は空けない
+            assert hasher._pending == 1
+            assert post_login(app.test_client()).status_code == 503
+            deadline = time.monotonic() + 30
+            while hasher._pending and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert hasher._pending == 0
+    finally:
+        hasher.shutdown()
+
+def test_login_rate_limited_per_account_and_ip():
+    app = make_app(LOGIN_RATE_USER="2/60", LOGIN_RATE_IP="4/60")
+    c = app.test_client()
+    assert post_login(c, password="nope").status_code == 400
+    assert post_login(c, password="nope").status_code == 400
+    r = post_login(c)
+    assert r.status_code == 429 and int(r.headers["Retry-After"]) >= 1
+    assert "試行が多すぎます" in r.get_data(as_text=True)
+    # 別のアカウントは IP の上限まで
+    assert post_login(c, username="bob").status_code == 400
+    assert post_login(c, username="carol").status_code == 429
+    assert app.extensions["rate_limit"].stats == {"ip": 1, "user": 1}
+
+def test_rate_limit_off():
+    app = make_app(RATE_LIMIT_STORE="off", LOGIN_RATE_USER="1/60")
+    c = app.test_client()
+    for _ in range(3):
+        assert post_login(c, password="nope").status_code == 400
+
+def test_memory_token_bucket_refills():
+    store = ratelimit.MemoryStore()
+    rate, burst = ratelimit.parse_rule("2/10")     # 5 秒に 1 回、まとめて 2 回
+    assert store.take("k", rate, burst, now=0) == 0
+    assert store.take("k", rate, burst, now=0) == 0
+    assert store.take("k", rate, burst, now=1) == 4.0
+    assert store.take("k", rate, burst, now=6) == 0
+    assert ratelimit.parse_rule("") is None
@@ -0,0 +1,134 @@
+import os, re
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from app import create_app
+from models import db, Entry, User, Counter
+import counts
+import rendercache
+
+def login_as_alice(app, client, username="alice"):
+    with app.app_context():
+        if not db.session.execute(db.select(User).where(User.username==username)).scalar_one_or_none():
+            u = User(username=username); u.set_password("pass1234")
+            db.session.add(u); db.session.commit()
+    r = client.get("/login")
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', r.data, re.S).group(1).decode()
+    client.post("/login", data={"username":username,"password":"pass1234","csrf_token":token}, follow_redirects=True)
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(n=2, **config):
+    app = create_app()
+    app.config.update(TESTING=True)
+    app.config.update(config)
+    with app.app_context():
+        db.create_all()
+        # 公開のまま alice の日記にする（編集・削除は所有者だけ）
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        for i in range(n):
+            db.session.add(Entry(title=f"E{i+1}", body=f"body{i+1}", user_id=u.id))
+        db.session.commit()
+    return app
+
+def stats(app):
+    return dict(app.extensions["render_cache"].stats)
+
+def test_index_and_detail_are_served_from_cache():
+    app = make_app()
+    c = app.test_client()
+    assert "E2" in c.get("/").get_data(as_text=True)
+    assert "body1" in c.get("/entry/1").get_data(as_text=True)
+    before = stats(app)
+    assert "E2" in c.get("/").get_data(as_text=True)
+    assert "body1" in c.get("/entry/1").get_data(as_text=True)
+    after = stats(app)
+    assert after["hits"] == before["hits"] + 2
+    assert after["misses"] == before["misses"]
+
+def test_writes_invalidate():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    c.get("/"); c.get("/entry/1")
+
+    token = csrf(c.get("/new").data)
+    c.post("/create", data={"title": "New", "body": "b", "csrf_token": token})
+    assert "New" in c.get("/").get_data(as_text=True)
+
+    token = csrf(c.get("/entry/1/edit").data)
+    c.post("/entry/1/update", data={"title": "E1", "body": "changed", "csrf_token": token})
+    assert "changed" in c.get("/entry/1").get_data(as_text=True)
+
+    token = csrf(c.get("/entry/1").data)
+    c.post("/entry/1/delete", data={"csrf_token": token})
+    assert c.get("/entry/1").status_code == 404
+    # CSRF トークンに "E1" が含まれることがあるのでリンクの形で見る
+    assert ">E1</a>" not in c.get("/").get_data(as_text=True)
+
+def test_csrf_and_flash_are_never_cached():
+    app = make_app()
+    alice, bob = app.test_client(), app.test_client()
+    login_as_alice(app, alice)
+    login_as_alice(app, bob, "bob")
+    bob.get("/entry/1")          # キャッシュを温める
+    r_alice = alice.get("/entry/1")
+    r_bob = bob.get("/entry/1")
+    assert csrf(r_alice.data) != csrf(r_bob.data)
+
+    token = csrf(alice.get("/new").data)
+    r = alice.post("/create", data={"title": "x", "body": "y", "csrf_token": token},
+                   follow_redirects=True)
+    assert "作成しました" in r.get_data(as_text=True)
+    assert "作成しました" not in bob.get("/").get_data(as_text=True)
+    anon = app.test_client()
+    assert "ログアウト" not in anon.get("/").get_data(as_text=True)
+
+def test_other_worker_write_invalidates_local_cache():
+    app = make_app()
+    c = app.test_client()
+    assert "body1" in c.get("/entry/1").get_data(as_text=True)
+    with app.app_context():
+        # 別プロセスの更新: このプロセスの世代番号は動かず entries_version だけ進む
+        db.session.execute(db.update(Entry).where(Entry.id == 1).values(body="remote"))
+        db.session.execute(db.update(Counter).where(Counter.name == counts.VERSION)
+                             .values(value=Counter.value + 1))
+        db.session.commit()
+    assert "remote" in c.get("/entry/1").get_data(as_text=True)
+
+def test_local_backend_is_size_bounded():
+    b = rendercache.LocalBackend(max_bytes=100)
+    for i in range(10):
+        b.set(f"k{i}", "x" * 30, ttl=60)
+    assert b.size <= 100
+    assert b.get("k0") is None and b.get("k9") == "x" * 30
+
+
+class FakeRedis:
+    """Redis クライアントの代替（get/setex/incr だけ）"""
+    def __init__(self):
+        self.data = {}
+    def get(self, k):
+        return self.data.get(k)
+    def setex(self, k, ttl, v):
+        self.data[k] = v.encode()
+    def incr(self, k):
+        self.data[k] = int(self.data.get(k, 0)) + 1
+        return self.data[k]
+
+def test_redis_backend_invalidates_only_changed_entry():
+    app = make_app(RENDER_CACHE="redis", RENDER_CACHE_CLIENT=FakeRedis())
+    c = app.test_client()
+    c.get("/entry/1"); c.get("/entry/2")
+    with app.app_context():
+        db.session.get(Entry, 1).body = "edited"
+        db.session.commit()
+    before = stats(app)
+    assert "edited" in c.get("/entry/1").get_data(as_text=True)
+    assert "body2" in c.get("/entry/2").get_data(as_text=True)
+    after = stats(app)
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
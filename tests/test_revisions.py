@@ -0,0 +1,173 @@
+import os, re, threading, time
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from app import create_app
+from models import db, Entry, EntryRevision, User
+import revisions
+
+FAST = "pbkdf2:sha256:1000"
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off",
+                      RENDER_CACHE="off", **config)
+    with app.app_context():
+        db.create_all()
+        for name in ("alice", "bob"):
+            u = User(username=name); u.set_password("pass1234")
+            db.session.add(u)
+        db.session.commit()
+    return app
+
+def login(app, username="alice"):
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": username, "password": "pass1234", "csrf_token": token})
+    return c
+
+def add(app, title="t", body="b"):
+    with app.app_context():
+        e = Entry(title=title, body=body, user_id=1)
+        db.session.add(e); db.session.commit()
+        return e.id
+
+def edit(app, entry_id, **values):
+    with app.app_context():
+        e = db.session.get(Entry, entry_id)
+        for k, v in values.items():
+            setattr(e, k, v)
+        db.session.commit()
+
+def kinds(app, entry_id):
+    with app.app_context():
+        return [k for (k,) in db.session.execute(
+            db.select(EntryRevision.kind).where(EntryRevision.entry_id == entry_id)
+              .order_by(EntryRevision.seq))]
+
+def test_delta_roundtrip():
+    old = "一行目\n二行目\n三行目\n"
+    for new in ("一行目\n変更\n三行目\n", "", "追加\n" + old + "末尾", "改行なし"):
+        assert revisions.apply_delta(old, revisions.make_delta(old, new)) == new
+
+def test_history_starts_on_first_edit():
+    app = make_app()
+    entry_id = add(app, body="最初")
+    assert kinds(app, entry_id) == []
+    # 公開設定だけの変更や同じ内容の代入では版は増えない
+    edit(app, entry_id, is_public=False)
+    edit(app, entry_id, body="最初")
+    assert kinds(app, entry_id) == []
+
+    edit(app, entry_id, body="二回目")
+    assert kinds(app, entry_id) == ["full", "delta"]
+    with app.app_context():
+        assert revisions.load(entry_id, 1)[:2] == ("t", "最初")
+        assert revisions.load(entry_id, 2)[:2] == ("t", "二回目")
+        assert revisions.load(entry_id, 3) is None
+
+def test_every_version_reconstructs_across_snapshots():
+    app = make_app(REVISION_SNAPSHOT_EVERY=10)
+    lines = [f"{i} 行目" for i in range(40)]
+    entry_id = add(app, body="\n".join(lines))
+    versions = ["\n".join(lines)]
+    for n in range(45):
+        lines[(n * 7) % len(lines)] = f"編集 {n}"
+        if n % 5 == 0:
+            lines.insert(n % 3, "挿入")
+        if n % 4 == 0:
+            del lines[-1]
+        versions.append("\n".join(lines))
+        edit(app, entry_id, body=versions[-1], title=f"t{n}")
+
+    assert [i + 1 for i, k in enumerate(kinds(app, entry_id)) if k == "full"] == [1, 11, 21, 31, 41]
+    with app.app_context():
+        for seq, body in enumerate(versions, 1):
+            assert revisions.load(entry_id, seq)[1] == body
+        assert revisions.load(entry_id, 46)[0] == "t44"
+        # 最新の版は日記の内容と同じ
+        assert [r.seq for r in revisions.history(entry_id)][:2] == [46, 45]
+
+def test_deferred_body_update_keeps_old_version():
+    # 一覧と同じく body を読まずに書き換えても、前の内容が版 1 に残る
+    app = make_app()
+    entry_id = add(app, body="元の本文")
+    with app.app_context():
+        e = db.session.execute(db.select(Entry).where(Entry.id == entry_id)
+                                 .options(db.defer(Entry.body))).scalar_one()
+        e.body = "新しい本文"
+        db.session.commit()
+        assert revisions.load(entry_id, 1)[1] == "元の本文"
+
+def test_concurrent_edits_get_consecutive_versions(monkeypatch, tmp_path):
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path / 't.db'}")
+    app = make_app()
+    entry_id = add(app, body="元\n")
+    flushed = threading.Event()
+
+    def first():
+        with app.app_context():
+            db.session.get(Entry, entry_id).body = "一人目\n"
+            db.session.flush()
+            flushed.set()
+            time.sleep(0.3)                   # その間にもう一人が書こうとする
+            db.session.commit()
+
+    t = threading.Thread(target=first)
+    t.start()
+    flushed.wait()
+    # 一人目がコミットする前に読んだ日記を書き換える
+    edit(app, entry_id, body="二人目\n")
+    t.join()
+    with app.app_context():
+        assert [revisions.load(entry_id, seq)[1] for seq in (1, 2, 3)] == \
+            ["元\n", "一人目\n", "二人目\n"]
+
+def test_history_pages_and_restore():
+    app = make_app()
+    c = login(app)
+    entry_id = add(app, title="題", body="一\n二\n三")
+    token = csrf(c.get(f"/entry/{entry_id}/edit").data)
+    c.post(f"/entry/{entry_id}/update",
+           data={"title": "題2", "body": "一\n2\n三", "csrf_token": token})
+
+    assert "履歴" in c.get(f"/entry/{entry_id}").get_data(as_text=True)
+    html = c.get(f"/entry/{entry_id}/history").get_data(as_text=True)
+    assert "第1版" in html and "第2版" in html
+    html = c.get(f"/entry/{entry_id}/history/2").get_data(as_text=True)
+    assert '<span class="del">-二</span>' in html and '<span class="add">+2</span>' in html
+    assert "題 → 題2" in html
+
+    token = csrf(html.encode())
+    r = c.post(f"/entry/{entry_id}/history/1/restore", data={"csrf_token": token})
+    assert r.status_code == 302
+    assert "第1版に戻しました" in c.get(r.headers["Location"]).get_data(as_text=True)
+    with app.app_context():
+        e = db.session.get(Entry, entry_id)
+        assert (e.title, e.body) == ("題", "一\n二\n三")
+    assert kinds(app, entry_id) == ["full", "delta", "delta"]
+
+def test_history_is_owner_only():
+    app = make_app()
+    entry_id = add(app)
+    edit(app, entry_id, body="b2")
+    c = login(app, "bob")
+    assert c.get(f"/entry/{entry_id}/history").status_code == 404
+    assert c.get(f"/entry/{entry_id}/history/1").status_code == 404
+    token = csrf(c.get("/").data)
+    assert c.post(f"/entry/{entry_id}/history/1/restore",
+                  data={"csrf_token": token}).status_code == 404
+    assert app.test_client().get(f"/entry/{entry_id}/history").status_code in (302, 401)
+
+def test_revisions_deleted_with_entry():
+    app = make_app()
+    entry_id = add(app)
+    edit(app, entry_id, body="b2")
+    c = login(app)
+    token = csrf(c.get("/").data)
+    c.post(f"/entry/{entry_id}/delete", data={"csrf_token": token})
+    assert kinds(app, entry_id) == []
@@ -0,0 +1,91 @@
+import os
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from app import create_app
+from models import db, Entry
+import search
+
+def make_app_with_entries():
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Entry(title="散歩", body="今日は良い天気だった。公園を歩いた。"),
+            Entry(title="雨の日", body="一日中雨。天気予報は外れた。"),
+            Entry(title="Flask Diary", body="searchable text"),
+        ])
+        db.session.commit()
+    return app
+
+def get_html(client, path):
+    r = client.get(path)
+    assert r.status_code == 200
+    return r.get_data(as_text=True)
+
+def test_tokenize_bigram_and_words():
+    assert search.tokenize("天気予報") == ["天気", "気予", "予報"]
+    assert search.tokenize("Flask Diary！") == ["flask", "diary"]
+    # 1文字の漢字はそのまま（前方一致で検索される）
+    assert search.tokenize("雨") == ["雨"]
+    # 半角カナも NFKC で全角に揃える
+    assert search.tokenize("ﾃﾝｷ") == ["テン", "ンキ"]
+    # 索引用は連続部分の最後の文字も入れる（1文字の前方一致で当たるように）
+    assert search.entry_tokens("大雨", "") == "大雨 雨"
+
+def test_single_character_matches_end_of_run():
+    app = create_app()
+    app.config.update(TESTING=True)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Entry(title="a", body="今日は大雨"), Entry(title="b", body="雨"),
+                            Entry(title="c", body="雨上がり"), Entry(title="d", body="晴れ")])
+        db.session.commit()
+    html = get_html(app.test_client(), "/?q=雨")
+    assert "全3件" in html and ">d</a>" not in html
+
+def test_japanese_search_hits():
+    app = make_app_with_entries()
+    c = app.test_client()
+
+    html = get_html(c, "/?q=天気")
+    assert "散歩" in html and "雨の日" in html
+    assert "Flask Diary" not in html
+
+    html = get_html(c, "/?q=公園")
+    assert "散歩" in html and "雨の日" not in html
+
+    html = get_html(c, "/?q=雨")
+    assert "雨の日" in html and "散歩" not in html
+
+    # 英単語は前方一致
+    html = get_html(c, "/?q=search")
+    assert "Flask Diary" in html and "全1件" in html
+
+def test_index_follows_update_and_delete():
+    app = make_app_with_entries()
+    c = app.test_client()
+    with app.app_context():
+        e = db.session.execute(
+            db.select(Entry).where(Entry.title == "散歩")).scalar_one()
+        e.body = "海を見に行った"
+        db.session.commit()
+        rain = db.session.execute(
+            db.select(Entry).where(Entry.title == "雨の日")).scalar_one()
+        db.session.delete(rain)
+        db.session.commit()
+
+    html = get_html(c, "/?q=天気")
+    assert "散歩" not in html and "雨の日" not in html
+    assert "全0件" in html
+    assert "散歩" in get_html(c, "/?q=海")
+
+def test_rebuild_index():
+    app = make_app_with_entries()
+    with app.app_context():
+        # 索引が壊れた状態を作ってから作り直す
+        db.session.execute(db.text(
+            "INSERT INTO entries_fts(entries_fts) VALUES ('delete-all')"))
+        db.session.commit()
+        assert search.rebuild_index() == 3
+    assert "散歩" in get_html(app.test_client(), "/?q=公園")
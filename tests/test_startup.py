@@ -0,0 +1,36 @@
+import os, sys, subprocess, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import inspect
+
+from app import create_app
+from models import db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_module_does_not_build_app():
+    code = "import app, sys; print('app' in vars(app)); app.app; print('app' in vars(app))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                         text=True, env=dict(os.environ, DB_URL="sqlite:///:memory:"),
+                         check=True).stdout.split()
+    assert out == ["False", "True"]
+
+def test_schema_left_to_alembic(monkeypatch):
+    path = os.path.join(tempfile.mkdtemp(), "t.db")
+    monkeypatch.setenv("DB_URL", f"sqlite:///{path}")
+    monkeypatch.setenv("DB_AUTO_CREATE", "0")
+    app = create_app()
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+
+def test_procfile_flask_commands_leave_schema_to_alembic():
+    with open(os.path.join(ROOT, "Procfile")) as f:
+        commands = [c.strip() for line in f for c in line.split(":", 1)[1].split("&&")]
+    flask = [c for c in commands if " flask " in f" {c} "]
+    assert flask and all(c.startswith("DB_AUTO_CREATE=0 ") for c in flask)
+
+def test_boot_profile_and_cli_registered():
+    app = create_app()
+    phases = [p for p, _ in app.extensions["boot_profile"]]
+    assert phases == ["config", "extensions", "schema", "routes"]
+    assert {"create_admin", "worker", "export_entries"} <= set(app.cli.commands)
@@ -0,0 +1,214 @@
+import os, re, io, hashlib, tempfile, time
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+from app import create_app
+from models import db, Entry, User, Blob
+import storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"same bytes" * 100
+
+def login_as_alice(app, client):
+    with app.app_context():
+        if not db.session.execute(db.select(User).where(User.username=="alice")).scalar_one_or_none():
+            u = User(username="alice"); u.set_password("pass1234")
+            db.session.add(u); db.session.commit()
+    r = client.get("/login")
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', r.data, re.S).group(1).decode()
+    client.post("/login", data={"username":"alice","password":"pass1234","csrf_token":token}, follow_redirects=True)
+
+def extract_csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"),
+                      **config)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def create(app, c, content, name="x.png"):
+    token = extract_csrf(c.get("/new").data)
+    r = c.post("/create", data={
+        "title": "t", "body": "b", "csrf_token": token,
+        "image": (io.BytesIO(content), name),
+    }, content_type="multipart/form-data")
+    assert r.status_code == 302
+    return int(r.headers["Location"].rsplit("/", 1)[-1])
+
+def post(c, path, **data):
+    token = extract_csrf(c.get("/").data)
+    return c.post(path, data={"csrf_token": token, **data},
+                  content_type="multipart/form-data")
+
+def files(app):
+    root = Path(app.config["UPLOAD_FOLDER"])
+    return sorted(p.relative_to(root).as_posix() for p in root.rglob("*")
+                  if p.is_file() and ".tmp" not in p.parts)
+
+def test_identical_uploads_are_stored_once():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    id2 = create(app, c, PNG, name="copy.png")
+
+    digest = hashlib.sha256(PNG).hexdigest()
+    key = f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+    assert files(app) == [key]
+    with app.app_context():
+        assert db.session.get(Entry, id1).image_path == key
+        assert db.session.get(Entry, id2).image_path == key
+        assert db.session.get(Blob, key).refcount == 2
+        assert db.session.get(Blob, key).size == len(PNG)
+    assert c.get(f"/uploads/{key}").data == PNG
+
+def test_files_removed_when_last_reference_goes():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    id2 = create(app, c, PNG)
+
+    post(c, f"/entry/{id1}/delete")
+    assert len(files(app)) == 1
+    post(c, f"/entry/{id2}/delete")
+    assert files(app) == []
+    with app.app_context():
+        assert db.session.query(Blob).count() == 0
+
+def test_replacing_image_releases_old_blob():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    other = PNG + b"!"
+    r = post(c, f"/entry/{id1}/update", title="t", body="b",
+             image=(io.BytesIO(other), "y.png"))
+    assert r.status_code == 302
+    digest = hashlib.sha256(other).hexdigest()
+    assert files(app) == [f"{digest[:2]}/{digest[2:4]}/{digest}.png"]
+
+def test_rollback_keeps_files():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    with app.app_context():
+        db.session.delete(db.session.get(Entry, id1))
+        db.session.flush()
+        db.session.rollback()
+        assert db.session.get(Blob, db.session.get(Entry, id1).image_path).refcount == 1
+    assert len(files(app)) == 1
+
+def test_migrate_legacy_layout_and_gc():
+    app = make_app()
+    root = Path(app.config["UPLOAD_FOLDER"])
+    (root / "aaa.png").write_bytes(PNG)
+    (root / "bbb.png").write_bytes(PNG)         # aaa と同じ内容
+    (root / "orphan.png").write_bytes(b"x" * 50)  # どの Entry からも参照なし
+    old = time.time() - 2 * 3600
+    os.utime(root / "orphan.png", (old, old))
+    with app.app_context():
+        db.session.add_all([Entry(title="a", body="x", image_path="aaa.png"),
+                            Entry(title="b", body="x", image_path="bbb.png")])
+        db.session.commit()
+        migrated, freed = storage.migrate_legacy()
+        assert migrated == 2
+        assert freed == len(PNG) + 50
+        keys = {e.image_path for e in db.session.query(Entry)}
+        assert len(keys) == 1 and "/" in keys.pop()
+    assert len(files(app)) == 1
+
+
+def test_upload_recreates_file_collected_meanwhile():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    with app.app_context():
+        key = db.session.get(Entry, id1).image_path
+        # 最後の参照が消えて、collect が行とファイルを消す直前
+        db.session.execute(db.update(Blob).values(refcount=0))
+        db.session.commit()
+        backend = storage.get_storage()
+        # 同じ内容を置く（行を押さえてからファイルを見る）→ その後の collect は消せない
+        assert backend.put(io.BytesIO(PNG), "png") == key
+        db.session.add(Entry(title="again", body="b", image_path=key))
+        db.session.commit()
+        assert storage.collect([key]) == 0
+        assert db.session.get(Blob, key).refcount == 1
+        # collect が先に消していた場合は put が置き直す
+        db.session.execute(db.update(Blob).values(refcount=0))
+        db.session.commit()
+        storage.collect([key])
+        assert not backend.exists(key)
+        backend.put(io.BytesIO(PNG), "png")
+        db.session.commit()
+        assert backend.exists(key) and db.session.get(Blob, key).size == len(PNG)
+
+def test_first_reference_is_upserted():
+    app = make_app()
+    with app.app_context():
+        # 別のリクエストが先に行を作っていても（put を通らない参照）一意制約で落ちない
+        db.session.add(Blob(key="k.png", size=1, refcount=1))
+        db.session.commit()
+        storage.adjust_refs(db.session, [("k.png", 1)])
+        storage.adjust_refs(db.session, [("new.png", 2)])
+        db.session.commit()
+        assert db.session.get(Blob, "k.png").refcount == 2
+        assert db.session.get(Blob, "new.png").refcount == 2
+
+def test_sweep_keeps_fresh_files():
+    app = make_app()
+    root = Path(app.config["UPLOAD_FOLDER"])
+    (root / "fresh.png").write_bytes(b"x" * 10)
+    (root / "stale.png").write_bytes(b"y" * 20)
+    old = time.time() - 2 * 3600
+    os.utime(root / "stale.png", (old, old))
+    with app.app_context():
+        assert storage.sweep_orphans() == 20
+    assert files(app) == ["fresh.png"]
+
+class FakeS3:
+    """S3 クライアントの代替（必要なメソッドだけ）"""
+    class NotFound(Exception):
+        response = {"Error": {"Code": "404"}}
+
+    def __init__(self):
+        self.objects = {}
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.NotFound()
+        return {"ContentLength": len(self.objects[Key])}
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+    def upload_fileobj(self, f, bucket, key):
+        self.objects[key] = f.read()
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+    def list_objects_v2(self, Bucket, Prefix, **kw):
+        return {"Contents": [{"Key": k} for k in self.objects if k.startswith(Prefix)],
+                "IsTruncated": False}
+
+def test_s3_backend_with_stand_in():
+    s3 = FakeS3()
+    app = make_app(UPLOAD_STORAGE=storage.S3Storage("bucket", prefix="u/", client=s3))
+    c = app.test_client()
+    login_as_alice(app, c)
+    id1 = create(app, c, PNG)
+    create(app, c, PNG)
+    assert len(s3.objects) == 1 and next(iter(s3.objects)).startswith("u/")
+
+    with app.app_context():
+        key = db.session.get(Entry, id1).image_path
+    r = c.get(f"/uploads/{key}")
+    assert r.status_code == 200 and r.data == PNG
+    assert "immutable" in r.headers["Cache-Control"]
+    r2 = c.get(f"/uploads/{key}", headers={"If-None-Match": r.headers["ETag"]})
+    assert r2.status_code == 304
@@ -0,0 +1,188 @@
+import os, re
+from collections import Counter as Tally
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, Entry, EntryTag, Tag, TagCount, User
+import bulk, tags
+
+FAST = "pbkdf2:sha256:1000"
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off",
+                      RENDER_CACHE="off", **config)
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.commit()
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+    return app, c
+
+def create(c, title, tag_names="", private=False):
+    token = csrf(c.get("/new").data)
+    data = {"title": title, "body": "b", "tag_names": tag_names, "csrf_token": token}
+    if private:
+        data["private"] = "y"
+    r = c.post("/create", data=data)
+    assert r.status_code == 302, r.data
+    return int(r.headers["Location"].rsplit("/", 1)[-1])
+
+def update(c, entry_id, tag_names, private=False):
+    token = csrf(c.get(f"/entry/{entry_id}/edit").data)
+    data = {"title": "t", "body": "b", "tag_names": tag_names, "csrf_token": token}
+    if private:
+        data["private"] = "y"
+    return c.post(f"/entry/{entry_id}/update", data=data)
+
+def table(app):
+    with app.app_context():
+        return {(scope, name): n for scope, name, n in db.session.execute(
+            db.select(TagCount.scope, Tag.name, TagCount.count)
+              .join(Tag, Tag.id == TagCount.tag_id).where(TagCount.count != 0))}
+
+def test_parse_normalizes_and_limits():
+    assert tags.parse("#旅行 料理、ＰＹＴＨＯＮ,旅行  ") == ["旅行", "料理", "python"]
+    assert tags.parse("") == []
+    for bad in ("a" * 31, " ".join(f"t{i}" for i in range(11))):
+        try:
+            tags.parse(bad)
+        except ValueError:
+            continue
+        raise AssertionError(bad)
+
+def test_counts_follow_create_edit_visibility_and_delete():
+    app, c = make_app()
+    a = create(c, "a", "旅行 料理")
+    create(c, "b", "旅行", private=True)
+    assert table(app) == {("entries_public", "旅行"): 1, ("entries_public", "料理"): 1,
+                          ("entries_user:1", "旅行"): 2, ("entries_user:1", "料理"): 1}
+
+    # 付け替え
+    update(c, a, "料理 温泉")
+    assert table(app) == {("entries_public", "料理"): 1, ("entries_public", "温泉"): 1,
+                          ("entries_user:1", "旅行"): 1, ("entries_user:1", "料理"): 1,
+                          ("entries_user:1", "温泉"): 1}
+    # 非公開にすると公開分からだけ減る
+    update(c, a, "料理 温泉", private=True)
+    assert {k for k in table(app) if k[0] == "entries_public"} == set()
+
+    token = csrf(c.get("/").data)
+    c.post(f"/entry/{a}/delete", data={"csrf_token": token})
+    assert table(app) == {("entries_user:1", "旅行"): 1}
+    with app.app_context():
+        assert db.session.query(EntryTag).count() == 1
+
+def test_filter_combines_with_search_and_pagination():
+    app, c = make_app()
+    for i in range(13):
+        create(c, f"散歩 {i}" if i % 2 else f"読書 {i}", "休日" if i < 12 else "")
+    html = c.get("/?tag=休日").get_data(as_text=True)
+    assert "全12件" in html and "#休日" in html
+    assert html.count('class="tag">#休日') == 10
+    # 次のページ（カーソル）もタグを保つ
+    nxt = re.search(r'href="([^"]*after=[^"]*)"', html).group(1).replace("&amp;", "&")
+    assert "tag=" in nxt
+    html = c.get(nxt).get_data(as_text=True)
+    assert html.count('class="tag">#休日') == 2 and "散歩 12" not in html
+
+    html = c.get("/?tag=休日&q=散歩").get_data(as_text=True)
+    assert "全6件" in html and "読書" not in html
+    # 先頭の # があっても同じタグ
+    assert "全12件" in c.get("/?tag=%23休日").get_data(as_text=True)
+    assert "全0件" in c.get("/?tag=無いタグ").get_data(as_text=True)
+
+def test_cloud_and_scopes():
+    app, c = make_app()
+    create(c, "a", "旅行 料理")
+    create(c, "b", "旅行", private=True)
+    html = c.get("/").get_data(as_text=True)
+    assert "#旅行</a><small>(2)" in html and 'class="level-4' in html
+    html = app.test_client().get("/").get_data(as_text=True)
+    assert "#旅行</a><small>(1)" in html
+    html = app.test_client().get("/?tag=旅行").get_data(as_text=True)
+    assert "全1件" in html and ">a</a>" in html and ">b</a>" not in html
+
+def test_edit_form_shows_tags_and_rejects_too_many():
+    app, c = make_app()
+    a = create(c, "a", "旅行 料理")
+    assert 'value="料理 旅行"' in c.get(f"/entry/{a}/edit").get_data(as_text=True)
+    r = update(c, a, " ".join(f"t{i}" for i in range(11)))
+    assert r.status_code == 400
+    assert "タグは10個までです" in r.get_data(as_text=True)
+
+def test_first_use_in_a_scope_is_upserted():
+    app, _ = make_app()
+    with app.app_context():
+        tag = tags.resolve(["旅行"])[0]
+        # 別のトランザクションが先に行を作っていても主キーで落ちない
+        db.session.add(TagCount(scope="entries_public", tag_id=tag.id, count=1))
+        db.session.commit()
+        seen = []
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, *args):
+            if "tag_counts" in statement:
+                seen.append(statement)
+        tags.bump(db.session, Tally({("entries_public", tag.id): 2,
+                                     ("entries_user:1", tag.id): 1}))
+        db.session.commit()
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len(seen) == 2 and all("ON CONFLICT" in s for s in seen)
+    assert table(app) == {("entries_public", "旅行"): 3, ("entries_user:1", "旅行"): 1}
+
+def test_rebuild_matches_incremental():
+    app, c = make_app()
+    for i in range(6):
+        create(c, f"e{i}", "a b" if i % 2 else "b c", private=i % 3 == 0)
+    before = table(app)
+    with app.app_context():
+        db.session.execute(db.delete(TagCount)); db.session.commit()
+    r = app.test_cli_runner().invoke(args=["rebuild_tags"])
+    assert r.exit_code == 0, r.output
+    assert table(app) == before
+
+def test_bulk_tag_delete_and_visibility_keep_counts():
+    app, c = make_app()
+    ids = [create(c, f"e{i}", "x" if i == 0 else "") for i in range(4)]
+    token = csrf(c.get("/").data)
+    r = c.post("/entries/bulk", data={"op": "tag", "tag_name": "#X", "ids": ids,
+                                      "csrf_token": token})
+    assert "3件に #x を付けました（1件はそのまま）" in c.get(r.headers["Location"]).get_data(as_text=True)
+    assert table(app) == {("entries_public", "x"): 4, ("entries_user:1", "x"): 4}
+
+    with app.app_context():
+        bulk.set_public(ids[:2], 1, False)
+    assert table(app) == {("entries_public", "x"): 2, ("entries_user:1", "x"): 4}
+    with app.app_context():
+        bulk.delete(ids[1:3], 1)
+    assert table(app) == {("entries_public", "x"): 1, ("entries_user:1", "x"): 2}
+    before = table(app)
+    app.test_cli_runner().invoke(args=["rebuild_tags"])
+    assert table(app) == before
+
+def test_api_filters_by_tag():
+    app, c = make_app()
+    create(c, "a", "旅行")
+    create(c, "b")
+    data = c.get("/api/v1/entries?tag=旅行").get_json()
+    assert [e["title"] for e in data["entries"]] == ["a"] and data["total"] == 1
+
+def test_dense_and_sparse_filters_agree():
+    app, c = make_app()
+    for i in range(8):
+        create(c, f"e{i}", "x" if i % 3 else "y")
+    with app.app_context():
+        tag_id = tags.find("x").id
+        ids = [sorted(db.session.scalars(tags.filter_entries(db.select(Entry.id), tag_id, dense)))
+               for dense in (False, True)]
+        assert ids[0] == ids[1] and len(ids[0]) == 5
+    assert tags.is_dense(5000, 100_000, 11) and not tags.is_dense(100, 100_000, 11)
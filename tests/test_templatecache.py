@@ -0,0 +1,55 @@
+import os
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from jinja2 import DictLoader
+
+from app import create_app
+import templatecache
+
+def make_app(monkeypatch, **env):
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    app = create_app()
+    app.config.update(TESTING=True, RENDER_CACHE="off")
+    return app
+
+def test_compiled_templates_shared_with_new_worker(monkeypatch, tmp_path):
+    cache = str(tmp_path / "jinja")
+    app = make_app(monkeypatch, TEMPLATE_CACHE_DIR=cache)
+    r = app.test_cli_runner().invoke(args=["compile_templates"])
+    assert r.exit_code == 0, r.output
+    n = len(app.jinja_env.list_templates())
+    assert len([f for f in os.listdir(cache) if f.endswith(".cache")]) == n
+
+    # 別のワーカー: コンパイルせずにキャッシュから読む
+    worker = make_app(monkeypatch, TEMPLATE_CACHE_DIR=cache)
+
+    def no_compile(*args, **kwargs):
+        raise AssertionError("compiled again")
+    worker.jinja_env.compile = no_compile
+    c = worker.test_client()
+    assert c.get("/").status_code == 200 and c.get("/login").status_code == 200
+
+def test_changed_template_is_not_served_from_stale_cache(monkeypatch, tmp_path):
+    cache = str(tmp_path / "jinja")
+    app = make_app(monkeypatch, TEMPLATE_CACHE_DIR=cache)
+    app.jinja_loader = DictLoader({"page.html": "v1"})
+    templatecache.compile_all(app)
+    worker = make_app(monkeypatch, TEMPLATE_CACHE_DIR=cache)
+    worker.jinja_loader = DictLoader({"page.html": "v2"})
+    assert worker.jinja_env.get_template("page.html").render() == "v2"
+
+def test_cli_reports_broken_template(monkeypatch, tmp_path):
+    app = make_app(monkeypatch, TEMPLATE_CACHE_DIR=str(tmp_path))
+    app.jinja_loader = DictLoader({"ok.html": "ok", "bad.html": "{% if %}"})
+    r = app.test_cli_runner().invoke(args=["compile_templates"])
+    assert r.exit_code != 0 and "bad.html" in r.output
+
+def test_production_mode_turns_off_auto_reload(monkeypatch):
+    app = make_app(monkeypatch, TEMPLATES_AUTO_RELOAD="0")
+    app.debug = True
+    assert app.jinja_env.auto_reload is False
+    app = make_app(monkeypatch, TEMPLATES_AUTO_RELOAD="")
+    app.debug = True
+    assert app.jinja_env.auto_reload is True
+    assert app.jinja_env.bytecode_cache is None
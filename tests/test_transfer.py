@@ -0,0 +1,151 @@
+import os, re, io, json, zipfile, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from datetime import datetime
+from pathlib import Path
+
+from app import create_app
+from models import db, Entry, User, Blob, Counter, Tag, TagCount
+import counts
+import tags
+import search
+import transfer
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"export me" * 50
+
+ROWS = [
+    ("天気のいい日", "公園を散歩した。\n二行目, カンマ \"引用\" も入れる"),
+    ("カレー", "夕飯はカレー"),
+    ("plain", "ascii only"),
+]
+
+def login_as_alice(app, client):
+    with app.app_context():
+        if not db.session.execute(db.select(User).where(User.username=="alice")).scalar_one_or_none():
+            u = User(username="alice"); u.set_password("pass1234")
+            db.session.add(u); db.session.commit()
+    r = client.get("/login")
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', r.data, re.S).group(1).decode()
+    client.post("/login", data={"username":"alice","password":"pass1234","csrf_token":token}, follow_redirects=True)
+
+def make_app(rows=ROWS):
+    app = create_app()
+    app.config.update(TESTING=True, UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"))
+    with app.app_context():
+        db.create_all()
+        for i, (title, body) in enumerate(rows):
+            db.session.add(Entry(title=title, body=body,
+                                 created_at=datetime(2024, 1, i + 1, 9, 30)))
+        db.session.commit()
+    return app
+
+def snapshot(app):
+    with app.app_context():
+        return [(e.title, e.body, e.created_at.replace(tzinfo=None))
+                for e in db.session.query(Entry).order_by(Entry.created_at)]
+
+def round_trip(fmt):
+    src = make_app()
+    with src.app_context():
+        data = b"".join(transfer.export(fmt, batch_size=2))
+    path = os.path.join(tempfile.mkdtemp(), f"entries.{fmt}")
+    Path(path).write_bytes(data)
+    dst = make_app(rows=[])
+    with dst.app_context():
+        assert transfer.import_file(path, chunk_size=2) == len(ROWS)
+    return src, dst
+
+def test_jsonl_round_trip():
+    src, dst = round_trip("jsonl")
+    assert snapshot(dst) == snapshot(src)
+    with dst.app_context():
+        stmt, _ = search.apply_search(db.select(Entry), "カレー")
+        assert [e.title for e in db.session.execute(stmt).scalars()] == ["カレー"]
+
+def test_csv_round_trip():
+    src, dst = round_trip("csv")
+    assert snapshot(dst) == snapshot(src)
+
+def test_tags_round_trip():
+    for fmt in ("jsonl", "csv", "zip"):
+        src = make_app()
+        with src.app_context():
+            for e in db.session.query(Entry):
+                e.tags = tags.resolve(["旅行", "料理"] if e.title == "カレー" else ["旅行"])
+            db.session.commit()
+            data = b"".join(transfer.export(fmt, batch_size=2))
+            before = {e.title: [t.name for t in e.tags] for e in db.session.query(Entry)}
+            counts_before = tag_counts()
+        path = os.path.join(tempfile.mkdtemp(), f"entries.{fmt}")
+        Path(path).write_bytes(data)
+        dst = make_app(rows=[])
+        with dst.app_context():
+            transfer.import_file(path, chunk_size=2)
+            assert {e.title: [t.name for t in e.tags]
+                    for e in db.session.query(Entry)} == before, fmt
+            # 取り込み先のタグごとの件数も増える（所有者なしなので公開分）
+            assert tag_counts() == counts_before == {
+                (counts.PUBLIC, "旅行"): 3, (counts.PUBLIC, "料理"): 1}
+            assert tags.rebuild() == 2 and tag_counts() == counts_before
+
+def tag_counts():
+    return {(scope, name): n for scope, name, n in db.session.execute(
+        db.select(TagCount.scope, Tag.name, TagCount.count)
+          .join(Tag, Tag.id == TagCount.tag_id))}
+
+def test_import_rejects_bad_tags():
+    app = make_app(rows=[])
+    with app.app_context():
+        try:
+            transfer.import_rows([{"title": "t", "tags": "a" * 31}])
+        except ValueError as e:
+            assert "30文字" in str(e)
+        else:
+            raise AssertionError("accepted")
+
+def test_import_updates_counters_in_chunks():
+    rows = [{"title": f"t{i}", "body": "b"} for i in range(25)]
+    app = make_app(rows=[])
+    with app.app_context():
+        counts.recount()
+        assert transfer.import_rows(rows, chunk_size=10) == 25
+        assert db.session.get(Counter, counts.TOTAL).value == 25
+        assert "全25件" in app.test_client().get("/").get_data(as_text=True)
+
+def test_zip_download_with_images_round_trip():
+    src = make_app()
+    c = src.test_client()
+    assert c.get("/export.zip").status_code == 302     # 未ログイン
+    login_as_alice(src, c)
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"', c.get("/new").data, re.S).group(1).decode()
+    c.post("/create", data={"title": "画像", "body": "b", "csrf_token": token,
+                            "image": (io.BytesIO(PNG), "a.png")},
+           content_type="multipart/form-data")
+    r = c.get("/export.zip")
+    assert r.status_code == 200 and r.mimetype == "application/zip"
+    assert r.headers["Content-Disposition"] == "attachment; filename=entries.zip"
+    path = os.path.join(tempfile.mkdtemp(), "backup.zip")
+    Path(path).write_bytes(r.data)
+    with zipfile.ZipFile(path) as zf:
+        assert len([n for n in zf.namelist() if n.startswith("images/")]) == 1
+
+    dst = make_app(rows=[])
+    with dst.app_context():
+        # 画面からの書き出しは自分の日記だけ（所有者の無い ROWS は含まない）
+        assert transfer.import_file(path) == 1
+        e = db.session.execute(db.select(Entry).where(Entry.title == "画像")).scalar_one()
+        assert (Path(dst.config["UPLOAD_FOLDER"]) / e.image_path).read_bytes() == PNG
+        assert db.session.get(Blob, e.image_path).refcount == 1
+
+def test_streamed_jsonl_endpoint():
+    app = make_app()
+    c = app.test_client()
+    login_as_alice(app, c)
+    with app.app_context():
+        alice = db.session.execute(db.select(User).where(User.username == "alice")).scalar_one()
+        db.session.execute(db.update(Entry).where(Entry.title != "plain").values(user_id=alice.id))
+        db.session.commit()
+    r = c.get("/export.jsonl")
+    assert r.is_streamed or r.status_code == 200
+    lines = [json.loads(l) for l in r.get_data(as_text=True).splitlines()]
+    assert [l["title"] for l in lines] == [t for t, _ in ROWS if t != "plain"]
+    assert c.get("/export.xml").status_code == 404
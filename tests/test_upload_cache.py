@@ -0,0 +1,115 @@
+import os, re, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+from app import create_app
+from models import db, Entry, User
+
+CONTENT = b"\x89PNG\r\n\x1a\n" + b"0123456789" * 10
+
+def make_app_with_file(is_public=True, **config):
+    app = create_app()
+    app.config.update(TESTING=True, UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"),
+                      PASSWORD_HASH_METHOD="pbkdf2:sha256:1000", RATE_LIMIT_STORE="off",
+                      **config)
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.flush()
+        db.session.add(Entry(title="t", body="b", user_id=u.id, is_public=is_public,
+                             image_path="abc123.png"))
+        db.session.commit()
+    (Path(app.config["UPLOAD_FOLDER"]) / "abc123.png").write_bytes(CONTENT)
+    return app
+
+def login(c):
+    token = re.search(rb'name="csrf_token".*?value="([^"]+)"',
+                      c.get("/login").data, re.S).group(1).decode()
+    c.post("/login", data={"username": "alice", "password": "pass1234",
+                           "csrf_token": token})
+
+def test_immutable_cache_headers():
+    c = make_app_with_file().test_client()
+    r = c.get("/uploads/abc123.png")
+    assert r.status_code == 200 and r.data == CONTENT
+    cc = r.headers["Cache-Control"]
+    assert "public" in cc and "max-age=31536000" in cc and "immutable" in cc
+    assert r.headers["ETag"] == '"abc123.png"'   # 強い ETag（W/ なし）
+    assert r.headers.get("Last-Modified")
+    assert r.headers.get("Accept-Ranges") == "bytes"
+
+def test_conditional_requests_return_304():
+    c = make_app_with_file().test_client()
+    r = c.get("/uploads/abc123.png")
+    etag, last_mod = r.headers["ETag"], r.headers["Last-Modified"]
+
+    r2 = c.get("/uploads/abc123.png", headers={"If-None-Match": etag})
+    assert r2.status_code == 304 and r2.data == b""
+    assert "immutable" in r2.headers["Cache-Control"]
+
+    r3 = c.get("/uploads/abc123.png", headers={"If-Modified-Since": last_mod})
+    assert r3.status_code == 304
+
+    r4 = c.get("/uploads/abc123.png", headers={"If-None-Match": '"other"'})
+    assert r4.status_code == 200
+
+def test_range_request():
+    c = make_app_with_file().test_client()
+    r = c.get("/uploads/abc123.png", headers={"Range": "bytes=8-17"})
+    assert r.status_code == 206
+    assert r.data == b"0123456789"
+    assert r.headers["Content-Range"] == f"bytes 8-17/{len(CONTENT)}"
+
+    r2 = c.get("/uploads/abc123.png", headers={"Range": "bytes=9999-"})
+    assert r2.status_code == 416
+
+def test_missing_file_is_404():
+    c = make_app_with_file().test_client()
+    assert c.get("/uploads/nope.png").status_code == 404
+    assert c.get("/uploads/../app.py").status_code == 404
+
+def test_x_accel_redirect_mode():
+    app = make_app_with_file(UPLOAD_SENDFILE="x-accel",
+                             UPLOAD_ACCEL_PREFIX="/internal/")
+    c = app.test_client()
+    r = c.get("/uploads/abc123.png")
+    assert r.status_code == 200 and r.data == b""
+    assert r.headers["X-Accel-Redirect"] == "/internal/abc123.png"
+    assert r.mimetype == "image/png"
+    assert "immutable" in r.headers["Cache-Control"]
+    assert c.get("/uploads/nope.png").status_code == 404
+
+def test_x_sendfile_mode():
+    app = make_app_with_file(USE_X_SENDFILE=True)
+    r = app.test_client().get("/uploads/abc123.png")
+    assert r.headers["X-Sendfile"].endswith("abc123.png")
+
+def test_private_image_needs_owner_and_stays_out_of_shared_caches():
+    app = make_app_with_file(is_public=False, UPLOAD_SENDFILE="x-accel",
+                             UPLOAD_ACCEL_PREFIX="/internal/")
+    c = app.test_client()
+    assert c.get("/uploads/abc123.png").status_code == 404
+    assert c.get("/uploads/abc123_thumb.webp").status_code == 404
+    login(c)
+    r = c.get("/uploads/abc123.png")
+    assert r.status_code == 200 and r.data == CONTENT
+    assert "X-Accel-Redirect" not in r.headers
+    cc = r.headers["Cache-Control"]
+    assert "private" in cc and "no-cache" in cc
+    assert "public" not in cc and "immutable" not in cc
+    r2 = c.get("/uploads/abc123.png", headers={"If-None-Match": r.headers["ETag"]})
+    assert r2.status_code == 304
+
+def test_image_shared_with_public_entry_is_public():
+    app = make_app_with_file(is_public=False)
+    with app.app_context():
+        # 同じ内容は同じキーになる。公開の日記が1つでもあれば公開として返す
+        db.session.add(Entry(title="p", body="b", user_id=None, image_path="abc123.png"))
+        db.session.commit()
+    r = app.test_client().get("/uploads/abc123.png")
+    assert r.status_code == 200 and "public" in r.headers["Cache-Control"]
+
+def test_unreferenced_file_is_404():
+    app = make_app_with_file()
+    (Path(app.config["UPLOAD_FOLDER"]) / "orphan.png").write_bytes(CONTENT)
+    assert app.test_client().get("/uploads/orphan.png").status_code == 404
@@ -0,0 +1,138 @@
+import os, re, io, hashlib, tempfile
+os.environ["DB_URL"] = "sqlite:///:memory:"
+from pathlib import Path
+
+from app import create_app
+from models import db, Entry, User
+import incoming
+
+FAST = "pbkdf2:sha256:1000"
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 3000
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off",
+                      UPLOAD_FOLDER=tempfile.mkdtemp(prefix="up_"), **config)
+    with app.app_context():
+        db.create_all()
+        u = User(username="alice"); u.set_password("pass1234")
+        db.session.add(u); db.session.commit()
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    c.post("/login", data={"username": "alice", "password": "pass1234", "csrf_token": token})
+    return app, c
+
+def files(app):
+    return sorted(p.relative_to(app.config["UPLOAD_FOLDER"]).as_posix()
+                  for p in Path(app.config["UPLOAD_FOLDER"]).rglob("*") if p.is_file())
+
+def create(c, content, name="x.png"):
+    token = csrf(c.get("/new").data)
+    return c.post("/create", data={
+        "title": "t", "body": "b", "csrf_token": token,
+        "image": (io.BytesIO(content), name),
+    }, content_type="multipart/form-data")
+
+class CountingStream(io.BytesIO):
+    """アプリが読んだバイト数を数える wsgi.input"""
+    def __init__(self, data):
+        super().__init__(data)
+        self.consumed = 0
+    def read(self, n=-1):
+        chunk = super().read(n)
+        self.consumed += len(chunk)
+        return chunk
+
+def multipart(token, content, name):
+    boundary = "----diarytest"
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+             for k, v in (("csrf_token", token), ("title", "t"), ("body", "b"))]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; '
+                 f'filename="{name}"\r\nContent-Type: image/png\r\n\r\n'.encode()
+                 + content + f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def test_sniff():
+    assert incoming.sniff(b"\x89PNG\r\n\x1a\n\0\0\0\0") == "png"
+    assert incoming.sniff(b"\xff\xd8\xff\xe0\0\x10JFIF") == "jpg"
+    assert incoming.sniff(b"GIF89a\x01\0\x01\0") == "gif"
+    assert incoming.sniff(b"RIFF\x24\0\0\0WEBPVP8 ") == "webp"
+    assert incoming.sniff(b"<?php echo 1; ?>") is None
+    assert incoming.sniff(b"RIFF\x24\0\0\0WAVEfmt ") is None
+
+def test_upload_is_renamed_into_place_without_leftovers():
+    app, c = make_app()
+    r = create(c, PNG)
+    assert r.status_code == 302
+    digest = hashlib.sha256(PNG).hexdigest()
+    assert files(app) == [f"{digest[:2]}/{digest[2:4]}/{digest}.png"]
+
+def test_stored_extension_follows_content():
+    # 拡張子ではなく中身で保存名を決める（PNG を .jpg と名付けても .png）
+    app, c = make_app()
+    assert create(c, PNG, name="photo.jpg").status_code == 302
+    with app.app_context():
+        assert db.session.query(Entry).one().image_path.endswith(".png")
+
+def test_spoofed_image_rejected_before_reading_the_rest():
+    app, c = make_app()
+    token = csrf(c.get("/new").data)
+    body, content_type = multipart(token, b"MZ\x90\0" + os.urandom(2 * 1024 * 1024), "evil.png")
+    stream = CountingStream(body)
+    r = c.post("/create", input_stream=stream, content_length=len(body),
+               content_type=content_type)
+    assert r.status_code == 303 and r.headers["Location"].endswith("/new")
+    assert stream.consumed < 256 * 1024
+    assert "画像ファイル" in c.get("/new").get_data(as_text=True)
+    assert files(app) == []
+    with app.app_context():
+        assert db.session.query(Entry).count() == 0
+
+def test_tiny_non_image_rejected():
+    app, c = make_app()
+    r = create(c, b"hi", name="x.gif")
+    assert r.status_code == 303
+    assert files(app) == []
+
+def test_per_file_limit():
+    app, c = make_app(UPLOAD_MAX_FILE_BYTES=1024)
+    r = create(c, PNG)
+    assert r.status_code == 303
+    assert "ファイルが大きすぎます" in c.get("/new").get_data(as_text=True)
+    assert files(app) == []
+    assert create(c, PNG[:1000]).status_code == 302
+
+def test_request_limit_rejects_large_body():
+    app, c = make_app(MAX_CONTENT_LENGTH=64 * 1024)
+    r = create(c, PNG + b"\0" * 100 * 1024)
+    assert r.status_code == 303
+    assert "送信内容が大きすぎます（0.0625 MB まで）" in c.get("/new").get_data(as_text=True)
+    assert files(app) == []
+
+def test_update_with_spoofed_file_returns_to_edit_form():
+    app, c = make_app()
+    r = create(c, PNG)
+    entry_id = int(r.headers["Location"].rsplit("/", 1)[-1])
+    token = csrf(c.get(f"/entry/{entry_id}/edit").data)
+    r = c.post(f"/entry/{entry_id}/update", data={
+        "title": "t2", "body": "b", "csrf_token": token,
+        "image": (io.BytesIO(b"not an image at all"), "y.webp"),
+    }, content_type="multipart/form-data")
+    assert r.status_code == 303
+    assert r.headers["Location"].endswith(f"/entry/{entry_id}/edit")
+    with app.app_context():
+        e = db.session.get(Entry, entry_id)
+        assert e.title == "t" and e.image_path.endswith(".png")
+    assert len(files(app)) == 1
+
+def test_limits_read_from_environment(monkeypatch):
+    monkeypatch.setenv("MAX_CONTENT_LENGTH_MB", "10")
+    monkeypatch.setenv("UPLOAD_MAX_FILE_MB", "2")
+    app = create_app()
+    assert app.config["MAX_CONTENT_LENGTH"] == 10 * 1024 * 1024
+    assert app.config["UPLOAD_MAX_FILE_BYTES"] == 2 * 1024 * 1024
@@ -0,0 +1,161 @@
+import os, re
+from types import SimpleNamespace
+os.environ["DB_URL"] = "sqlite:///:memory:"
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, User
+import usercache
+
+FAST = "pbkdf2:sha256:1000"
+
+def csrf(html: bytes) -> str:
+    m = re.search(rb'name="csrf_token".*?value="([^"]+)"', html, re.S)
+    assert m, "csrf_token not found"
+    return m.group(1).decode()
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off")
+    app.config.update(config)
+    with app.app_context():
+        db.create_all()
+        for name in ("alice", "bob"):
+            u = User(username=name)
+            u.set_password("pass1234")
+            db.session.add(u)
+        db.session.commit()
+    return app
+
+def login(app, username="alice"):
+    c = app.test_client()
+    token = csrf(c.get("/login").data)
+    r = c.post("/login", data={"username": username, "password": "pass1234",
+                               "csrf_token": token})
+    assert r.status_code == 302
+    return c
+
+def user_queries(app):
+    """users を読んだ SELECT を数える。"""
+    seen = []
+    with app.app_context():
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM users" in statement:
+                seen.append(statement)
+    return seen
+
+def update_user(app, username="alice", **values):
+    with app.app_context():
+        u = db.session.execute(db.select(User).where(User.username == username)).scalar_one()
+        if "password" in values:
+            u.set_password(values.pop("password"))
+        for k, v in values.items():
+            setattr(u, k, v)
+        db.session.commit()
+
+def test_snapshot_avoids_user_query():
+    app = make_app()
+    c = login(app)
+    seen = user_queries(app)
+    for _ in range(5):
+        assert c.get("/new").status_code == 200
+    assert seen == []
+    assert app.extensions["user_cache"].stats["snapshot"] == 5
+
+def test_process_cache_without_snapshot():
+    app = make_app(USER_SNAPSHOT=False)
+    c = login(app)
+    seen = user_queries(app)
+    for _ in range(5):
+        assert c.get("/new").status_code == 200
+    stats = app.extensions["user_cache"].stats
+    assert len(seen) == 1 and stats["miss"] == 1 and stats["hit"] == 4
+
+def test_password_change_revokes_session():
+    app = make_app()
+    c = login(app)
+    assert c.get("/new").status_code == 200
+    update_user(app, password="newpass99")
+    r = c.get("/new")
+    assert r.status_code == 302 and "/login" in r.headers["Location"]
+    assert app.extensions["user_cache"].stats["revoked"] == 1
+    # 他のユーザーはそのまま
+    other = login(app, "bob")
+    assert other.get("/new").status_code == 200
+
+def test_deactivated_user_is_logged_out_and_cannot_login():
+    app = make_app(USER_SNAPSHOT=False)
+    c = login(app)
+    assert c.get("/new").status_code == 200   # プロセス内キャッシュに載る
+    update_user(app, active=False)
+    assert c.get("/new").status_code == 302
+    c2 = app.test_client()
+    token = csrf(c2.get("/login").data)
+    r = c2.post("/login", data={"username": "alice", "password": "pass1234",
+                                "csrf_token": token})
+    assert r.status_code == 400 and "ユーザー名またはパスワードが違います".encode() in r.data
+
+def test_change_from_other_worker_visible_after_ttl():
+    # 他のワーカーでの変更はこのプロセスのフックを通らない（Core の UPDATE で再現）
+    app = make_app(USER_SNAPSHOT_TTL=3600, USER_CACHE_TTL=3600)
+    c = login(app)
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.username == "alice")
+                             .values(active=False))
+        db.session.commit()
+    assert c.get("/new").status_code == 200   # TTL 内は古いまま
+    app.config.update(USER_SNAPSHOT_TTL=0, USER_CACHE_TTL=0)
+    assert c.get("/new").status_code == 302
+
+def test_revocation_on_other_worker_bounded_by_longer_ttl(monkeypatch, tmp_path):
+    # 同じ DB を見る2つのワーカー。A に来続けるセッションを B での変更で取り消す
+    monkeypatch.setenv("DB_URL", f"sqlite:///{tmp_path / 't.db'}")
+    now = [1_000_000.0]
+    monkeypatch.setattr(usercache, "time", SimpleNamespace(time=lambda: now[0],
+                                                           monotonic=lambda: now[0]))
+    ttl = dict(USER_CACHE_TTL=100, USER_SNAPSHOT_TTL=60)
+    a = make_app(**ttl)
+    b = create_app()
+    b.config.update(TESTING=True, PASSWORD_HASH_METHOD=FAST, RATE_LIMIT_STORE="off", **ttl)
+    c = login(a)
+    now[0] += 61                              # スナップショットが切れて A の LRU に載る
+    assert c.get("/new").status_code == 200
+    now[0] += 1
+    update_user(b, password="newpass99")      # A のキャッシュには届かない
+    revoked_at, results = now[0], []
+    while now[0] < revoked_at + 200:
+        now[0] += 5
+        results.append((now[0] - revoked_at, c.get("/new").status_code))
+    # max(USER_CACHE_TTL, USER_SNAPSHOT_TTL) を過ぎたら通らず、一度切れたら戻らない
+    assert all(status == 302 for t, status in results if t > 100)
+    first = [status for _, status in results].index(302)
+    assert {status for _, status in results[first:]} == {302}
+
+def test_cache_size_is_bounded():
+    app = make_app(USER_CACHE_SIZE=2, USER_SNAPSHOT=False)
+    cache = app.extensions["user_cache"]
+    with app.app_context():
+        for i in range(1, 5):
+            cache._set(usercache.SessionUser(i, f"u{i}", "x"))
+    assert list(cache.items) == [3, 4]
+
+def test_login_and_logout_manage_snapshot():
+    app = make_app()
+    c = login(app)
+    with c.session_transaction() as s:
+        snap = s[usercache.SESSION_KEY]
+    assert snap["n"] == "alice" and "pass1234" not in str(snap)
+    token = csrf(c.get("/new").data)
+    c.post("/logout", data={"csrf_token": token})
+    with c.session_transaction() as s:
+        assert usercache.SESSION_KEY not in s
+
+def test_metrics_report_loader_results(monkeypatch):
+    monkeypatch.setenv("METRICS", "1")
+    app = make_app()
+    c = login(app)
+    c.get("/new")
+    body = app.test_client().get("/metrics").data.decode()
+    assert 'diary_user_loader_total{result="snapshot"} 1' in body
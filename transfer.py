@@ -0,0 +1,298 @@
+"""日記の一括エクスポート / インポート（JSONL / CSV / ZIP）
+
+エクスポートはジェネレータで少しずつ bytes を返す。行は yield_per で
+取り出すので（PostgreSQL ではサーバー側カーソル）、件数が増えてもメモリは
+一定。ZIP は entries.jsonl と、参照している画像を images/<image_path> に入れる。
+タグは tags 列に空白区切りの名前で入れる（取り込みは入力欄と同じく tags.parse）。
+
+インポートは chunk_size 件ずつ Core の一括 INSERT（executemany）で入れる。
+ORM のイベントを通らないので、検索トークン・件数カウンタ・日付のアーカイブ・
+blobs の参照数・タグごとの件数・描画キャッシュはここで更新する。id は振り直し、created_at は保つ。
+user_id を指定すると、書き出しはその人の日記だけ、取り込みはその人の日記になる。
+書き出しに ids を渡すとその日記だけ（一覧で選んだ分。bulk.CHUNK 件ずつ引く）。
+"""
+import csv
+import io
+import json
+import zipfile
+from collections import Counter as Tally
+from contextlib import closing
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from models import db, Entry
+import counts
+import archive
+import bulk
+import storage
+import tags
+from search import entry_tokens
+from excerpts import body_fields
+
+COLUMNS = ["id", "title", "body", "image_path", "is_public", "created_at"]
+FIELDS = COLUMNS + ["tags"]
+FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "zip": "application/zip",
+}
+CHUNK = 64 * 1024
+
+
+# --- エクスポート ---
+def _owned(stmt, user_id):
+    return stmt if user_id is None else stmt.where(Entry.user_id == user_id)
+
+
+def _selected(stmt, ids):
+    """ids が無ければ stmt をそのまま、あれば id の IN を区切って付けた文を順に。"""
+    if ids is None:
+        yield stmt
+        return
+    for part in bulk.chunks(ids):
+        yield stmt.where(Entry.id.in_(part))
+
+
+def iter_rows(batch_size=1000, user_id=None, ids=None):
+    stmt = (_owned(db.select(*(getattr(Entry, f) for f in COLUMNS)), user_id)
+              .order_by(Entry.id)
+              .execution_options(yield_per=batch_size))
+    for part in _selected(stmt, ids):
+        # batch_size 件ごとにタグをまとめて引く
+        for rows in db.session.execute(part).partitions():
+            names = tags.names_for([r.id for r in rows])
+            for row in rows:
+                d = row._asdict()
+                d["created_at"] = d["created_at"].isoformat() if d["created_at"] else None
+                d["tags"] = " ".join(names.get(row.id, ()))
+                yield d
+
+
+def _buffered(chunks):
+    """小さな書き込みを CHUNK 程度にまとめる。"""
+    buf, size = [], 0
+    for c in chunks:
+        buf.append(c)
+        size += len(c)
+        if size >= CHUNK:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def export_jsonl(batch_size=1000, user_id=None, ids=None):
+    return _buffered(
+        (json.dumps(r, ensure_ascii=False) + "\n").encode()
+        for r in iter_rows(batch_size, user_id, ids))
+
+
+def export_csv(batch_size=1000, user_id=None, ids=None):
+    def rows():
+        out = io.StringIO()
+        w = csv.DictWriter(out, FIELDS)
+        # Excel で文字化けしないよう BOM を付ける
+        yield "\ufeff".encode()
+        w.writeheader()
+        for r in iter_rows(batch_size, user_id, ids):
+            w.writerow(r)
+            yield out.getvalue().encode()
+            out.seek(0); out.truncate()
+        yield out.getvalue().encode()
+    return _buffered(rows())
+
+
+class _Pipe(io.RawIOBase):
+    """ZipFile の書き込み先。書かれた分を drain() で取り出す（seek 不可）。"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = b"".join(self.chunks)
+        self.chunks, self.size = [], 0
+        return out
+
+
+def export_zip(batch_size=1000, user_id=None, ids=None):
+    pipe = _Pipe()
+    backend = storage.get_storage()
+    with zipfile.ZipFile(pipe, "w", zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("entries.jsonl", "w", force_zip64=True) as f:
+            for chunk in export_jsonl(batch_size, user_id, ids):
+                f.write(chunk)
+                if pipe.size >= CHUNK:
+                    yield pipe.drain()
+        keys = (_owned(db.select(Entry.image_path).distinct(), user_id)
+                  .where(Entry.image_path.is_not(None))
+                  .execution_options(yield_per=batch_size))
+        seen = set()   # ids を区切って引くと、同じ画像が別の区切りにも出る
+        for key in (k for part in _selected(keys, ids)
+                    for k in db.session.execute(part).scalars()):
+            if key in seen or not backend.exists(key):
+                continue
+            if ids is not None:
+                seen.add(key)
+            # 画像は圧縮済みなのでそのまま格納する
+            info = zipfile.ZipInfo(f"images/{key}",
+                                   datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with closing(backend.open(key)) as src, \
+                    zf.open(info, "w", force_zip64=True) as dst:
+                while True:
+                    block = src.read(CHUNK)
+                    if not block:
+                        break
+                    dst.write(block)
+                    if pipe.size >= CHUNK:
+                        yield pipe.drain()
+    yield pipe.drain()
+
+
+def export(fmt: str, batch_size=1000, user_id=None, ids=None):
+    return {"jsonl": export_jsonl, "csv": export_csv,
+            "zip": export_zip}[fmt](batch_size, user_id, ids)
+
+
+# --- インポート ---
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(stream):
+    yield from csv.DictReader(stream)
+
+
+def _parse_bool(value):
+    # JSONL は true/false、CSV は "True"/"False"。列が無い古い書き出しは公開
+    if value is None or value == "":
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() not in ("false", "0", "no", "off")
+    return bool(value)
+
+
+def _parse_time(value):
+    if not value:
+        return datetime.now(timezone.utc)
+    t = datetime.fromisoformat(value)
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def import_rows(rows, chunk_size=1000, resolve_image=None, user_id=None) -> int:
+    """rows（dict の iterable）を chunk_size 件ずつ入れて件数を返す。
+
+    resolve_image(image_path) は取り込み先での image_path（無ければ None）を返す。
+    省略時は保存先に同じキーがあればそのまま使う。
+    途中で失敗しても、それまでにコミットしたチャンクは残る。
+    """
+    backend = storage.get_storage()
+    known = {}
+
+    def default_resolve(key):
+        if key not in known:
+            known[key] = key if backend.exists(key) else None
+        return known[key]
+
+    resolve_image = resolve_image or default_resolve
+    total = 0
+    chunk, chunk_tags = [], []
+
+    def flush():
+        if any(chunk_tags):
+            # タグを付けるために振られた id を入力順に受け取る
+            ids = db.session.scalars(
+                db.insert(Entry).returning(Entry.id, sort_by_parameter_order=True),
+                chunk).all()
+            tags.add_rows(db.session, user_id, [
+                (entry_id, r["is_public"], names)
+                for entry_id, r, names in zip(ids, chunk, chunk_tags) if names])
+        else:
+            db.session.execute(db.insert(Entry), chunk)
+        counts.bump(db.session, len(chunk), Tally(
+            name for r in chunk
+            for name in counts.scope_names(user_id, r["is_public"])))
+        archive.bump_days(db.session, archive.tally_days(
+            ((user_id, r["is_public"], r["created_at"]) for r in chunk), archive.zone()))
+        storage.adjust_refs(db.session, Tally(
+            r["image_path"] for r in chunk if r["image_path"]).items())
+        db.session.commit()
+
+    for r in rows:
+        title, body = (r.get("title") or "").strip(), r.get("body") or ""
+        if not title:
+            raise ValueError(f"title がありません: {r!r:.80}")
+        image = r.get("image_path") or None
+        raw_tags = r.get("tags") or ""
+        try:
+            # JSONL は文字列でもリストでもよい
+            chunk_tags.append(tags.parse(
+                raw_tags if isinstance(raw_tags, str) else " ".join(raw_tags)))
+        except ValueError as e:
+            raise ValueError(f"{e}: {r!r:.80}") from None
+        chunk.append({
+            "title": title[:120],
+            "body": body,
+            "image_path": resolve_image(image) if image else None,
+            "user_id": user_id,
+            "is_public": _parse_bool(r.get("is_public")),
+            "search_tokens": entry_tokens(title, body),
+            **body_fields(body),
+            "created_at": _parse_time(r.get("created_at")),
+        })
+        if len(chunk) >= chunk_size:
+            flush()
+            total += len(chunk)
+            chunk, chunk_tags = [], []
+    if chunk:
+        flush()
+        total += len(chunk)
+
+    cache = current_app.extensions.get("render_cache")
+    if cache and total:
+        cache.invalidate([])
+    return total
+
+
+def import_file(path, fmt=None, chunk_size=1000, user_id=None) -> int:
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+    if fmt == "zip":
+        return import_zip(path, chunk_size, user_id)
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = read_csv(f) if fmt == "csv" else read_jsonl(f)
+        return import_rows(rows, chunk_size, user_id=user_id)
+
+
+def import_zip(path, chunk_size=1000, user_id=None) -> int:
+    backend = storage.get_storage()
+    mapping = {}
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+
+        def resolve(key):
+            if key not in mapping:
+                name = f"images/{key}"
+                if name in names:
+                    # 内容アドレスで保存し直す（同じ内容なら同じキー）
+                    with zf.open(name) as src:
+                        mapping[key] = backend.put(src, key.rsplit(".", 1)[-1].lower())
+                else:
+                    mapping[key] = key if backend.exists(key) else None
+            return mapping[key]
+
+        with zf.open("entries.jsonl") as raw:
+            stream = io.TextIOWrapper(raw, encoding="utf-8")
+            return import_rows(read_jsonl(stream), chunk_size, resolve, user_id)
@@ -0,0 +1,203 @@
+"""ログイン中ユーザーの読み込み（Flask-Login の user_loader）
+
+毎リクエスト users を主キーで引く代わりに
+  1. セッション内のスナップショット（USER_SNAPSHOT=1 のとき）: ログイン時・
+     読み込み時に {id, username, stamp, 時刻} をセッションに入れる。セッションは
+     SECRET_KEY で署名されるので改ざんできない。USER_SNAPSHOT_TTL 秒以内なら
+     DB を見ずにそのまま使う
+  2. プロセス内 LRU（USER_CACHE_TTL 秒、USER_CACHE_SIZE 件まで）
+  3. DB
+の順に見る。current_user は ORM の User ではなく SessionUser（id と username だけ）。
+
+stamp はパスワードハッシュと有効/無効から作る値で、パスワード変更・無効化で
+変わる。2・3 で読んだ値とセッションの stamp が違えばログアウト扱いにする。
+同じプロセスでの変更はコミット直後にキャッシュを捨て、それより前に作られた
+スナップショットも使わない。スナップショットは DB から読んだ値でだけ作り直す
+（LRU の古い値から作ると、その古さに USER_SNAPSHOT_TTL が足されて
+USER_CACHE_TTL + USER_SNAPSHOT_TTL 秒まで古い値を使い続けてしまう）。
+このため他のワーカーでの変更は、最長で max(USER_CACHE_TTL, USER_SNAPSHOT_TTL)
+秒遅れて反映される。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+SESSION_KEY = "_user_snap"
+
+
+def stamp(password_hash: str, active: bool) -> str:
+    """パスワード・状態が変わると変わる短い値（セッションに入れても元は分からない）。"""
+    raw = f"{password_hash}|{int(bool(active))}".encode()
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class SessionUser:
+    """current_user として使う軽いユーザー（Flask-Login の要件を満たす）。"""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, stamp, active=True):
+        self.id = id
+        self.username = username
+        self.stamp = stamp
+        self.active = active
+
+    @property
+    def is_active(self):
+        return self.active
+
+    def get_id(self):
+        return str(self.id)
+
+    @classmethod
+    def from_user(cls, u):
+        return cls(u.id, u.username, stamp(u.password_hash, u.active), bool(u.active))
+
+    def __repr__(self):
+        return f"<SessionUser {self.id} {self.username}>"
+
+
+class UserCache:
+    """USER_CACHE_TTL / USER_CACHE_SIZE / USER_SNAPSHOT / USER_SNAPSHOT_TTL"""
+
+    def __init__(self, app=None):
+        self.stats = {"snapshot": 0, "hit": 0, "miss": 0, "revoked": 0}
+        self.items = OrderedDict()    # user_id -> (SessionUser, 期限)
+        self.revoked = OrderedDict()  # user_id -> このプロセスで変更をコミットした時刻
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["user_cache"] = self
+
+    # --- プロセス内 LRU ---
+    def _get(self, user_id):
+        with self.lock:
+            item = self.items.get(user_id)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                del self.items[user_id]
+                return None
+            self.items.move_to_end(user_id)
+            return item[0]
+
+    def _set(self, user):
+        cfg = self.app.config
+        with self.lock:
+            self.items[user.id] = (user, time.monotonic() + cfg["USER_CACHE_TTL"])
+            self.items.move_to_end(user.id)
+            while len(self.items) > cfg["USER_CACHE_SIZE"]:
+                self.items.popitem(last=False)
+
+    def invalidate(self, user_ids):
+        now = time.time()
+        with self.lock:
+            for i in user_ids:
+                self.items.pop(i, None)
+                self.revoked[i] = now
+                self.revoked.move_to_end(i)
+            while len(self.revoked) > 10_000:
+                self.revoked.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    # --- セッション ---
+    def remember(self, user):
+        """ログイン直後に呼ぶ（ORM の User でも SessionUser でもよい）。"""
+        u = user if isinstance(user, SessionUser) else SessionUser.from_user(user)
+        session[SESSION_KEY] = {"i": u.id, "n": u.username, "s": u.stamp,
+                                "t": round(time.time(), 3)}
+
+    def forget(self):
+        session.pop(SESSION_KEY, None)
+
+    def _revoke(self):
+        # Flask-Login のログイン情報も消す。残すと次のリクエストでスナップショットの
+        # 無い古いセッションとして受け入れ、取り消しが効かなくなる
+        self.stats["revoked"] += 1
+        self.forget()
+        for key in ("_user_id", "_fresh", "_id"):
+            session.pop(key, None)
+
+    def _from_snapshot(self, user_id, snap):
+        cfg = self.app.config
+        if not cfg["USER_SNAPSHOT"] or not snap or snap.get("i") != user_id:
+            return None
+        if snap["t"] + cfg["USER_SNAPSHOT_TTL"] < time.time():
+            return None
+        with self.lock:
+            if self.revoked.get(user_id, 0) >= snap["t"]:
+                return None
+        return SessionUser(user_id, snap["n"], snap["s"])
+
+    def load(self, user_id: int):
+        """user_loader 本体。ログアウト扱いなら None。"""
+        snap = session.get(SESSION_KEY)
+        user = self._from_snapshot(user_id, snap)
+        if user is not None:
+            self.stats["snapshot"] += 1
+            return user
+
+        # スナップショットを作り直すときは LRU を飛ばして DB から読む
+        cfg = self.app.config
+        refresh = not snap or (cfg["USER_SNAPSHOT"]
+                               and snap["t"] + cfg["USER_SNAPSHOT_TTL"] // 2 < time.time())
+        user = None if refresh else self._get(user_id)
+        if user is not None:
+            self.stats["hit"] += 1
+        else:
+            self.stats["miss"] += 1
+            row = db.session.execute(
+                db.select(User.id, User.username, User.password_hash, User.active)
+                  .where(User.id == user_id)).first()
+            if row is not None:
+                user = SessionUser.from_user(row)
+                self._set(user)
+
+        # スナップショットが無い古いセッションはそのまま受け入れて stamp を付ける
+        if user is None or not user.active or (snap and snap.get("s") != user.stamp):
+            self._revoke()
+            return None
+        if refresh:
+            self.remember(user)
+        return user
+
+
+# --- users の変更をコミット後に反映 ---
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    ids = session.info.setdefault("users_dirty", set())
+    for o in session.dirty:
+        if isinstance(o, User) and session.is_modified(o):
+            ids.add(o.id)
+    for o in session.deleted:
+        if isinstance(o, User):
+            ids.add(o.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_users_after_commit(session):
+    ids = session.info.pop("users_dirty", None)
+    if not ids:
+        return
+    from flask import current_app
+    cache = current_app.extensions.get("user_cache")
+    if cache:
+        cache.invalidate(ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("users_dirty", None)